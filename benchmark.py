@@ -1,50 +1,300 @@
 """
-Utility to compare the different Backends performance.
+Benchmark suite comparing the different BackEnds performance.
 
-Below the elapsed time running the tests using:
+Every operation is executed `--number` times per backend and whitelist size,
+reporting operations per second and p50/p99 latency (microseconds).
 
-- Mac OS X 10.10
-- Redis 2.8.17, standalone mode, default configuration
+    # In-process REDIS stand-in (requires `pip install fakeredis`)
+    python benchmark.py run --redis fake
 
-    python benchmark.py
-        03.25  # (seconds) using MemoryBackEnd
-        29.07  # (seconds) Using RedisBackEnd
-        05.28  # (seconds) Using RedisHighPerfBackEnd
+    # Spawn a local `redis-server` (must be available in the PATH)
+    python benchmark.py run --redis spawn --sizes 100 10000 --output new.json
+
+    # Existing server. Its database is flushed, so --flush is required
+    python benchmark.py run --redis redis://localhost:6379/15 --flush
+
+    # Flag regressions (ops/sec dropping more than 10%) between two runs
+    python benchmark.py compare old.json new.json --threshold 0.1
+
+Focused microbenchmarks for MemoryBackEnd live in `benchmarks/`.
 """
+from __future__ import print_function
 
-import hanoi
-import redis
+import argparse
+import json
+import platform
+import re
+import shutil
+import socket
+import subprocess
+import sys
 import time
 
-_redis = redis.Redis('localhost', 6379)
+import hanoi
+from hanoi.api import RolloutException
+from hanoi.backend import Feature
 
-rolloutM = hanoi.Rollout(hanoi.MemoryBackEnd())
+_timer = getattr(time, 'perf_counter', time.time)
 
-rollout = hanoi.Rollout(hanoi.RedisBackEnd(_redis))
+FN = 'FOO'
+USER = 'USER-{0}'
+VARIANTS = ['foo', 'bar', 'bazz']
+BATCH = 100
 
-rolloutHP = hanoi.Rollout(hanoi.RedisHighPerfBackEnd(_redis))
+BACKENDS = ('memory', 'redis', 'highperf', 'highperf-lua', 'caching')
+SIZES = (100, 10000)
+
+
+def build_backend(kind, redis):
+    if kind == 'memory':
+        return hanoi.MemoryBackEnd()
+    if kind == 'redis':
+        return hanoi.RedisBackEnd(redis)
+    if kind == 'highperf':
+        return hanoi.RedisHighPerfBackEnd(redis)
+    if kind == 'highperf-lua':
+        return hanoi.RedisHighPerfBackEnd(redis, lua=True)
+    if kind == 'caching':
+        return hanoi.CachingBackEnd(hanoi.RedisHighPerfBackEnd(redis))
+    raise ValueError("Unknown backend <%s>" % kind)
+
+
+def populate(backend, size):
+    """
+    Define the functionalities used by the operations, whitelisting `size` users
+    """
+    users = [USER.format(i) for i in range(size)]
+    if isinstance(backend, hanoi.MemoryBackEnd):
+        backend.add_functionality(Feature(FN, percentage=0))
+        for user in users:
+            backend.add(FN, user)
+    else:
+        backend.add_functionality(Feature(FN, percentage=0), users)
+
+    backend.add_functionality(Feature('percentage', percentage=50))
+    backend.add_functionality(Feature('regex', percentage=0))
+    backend.set_rule('regex', re.compile(r'1$'))
+    backend.add_functionality(Feature('variant', percentage=100, variants=VARIANTS))
+
+
+def operations(rollout, size):
+    """
+    Return a list of (operation name, callable receiving the iteration number)
+    """
+    hit = USER.format(size // 2)
+
+    @rollout.check(FN, 1)
+    def checked(user):
+        return user
+
+    @rollout.enabled(FN)
+    def enabled():
+        return True
+
+    def register(i):
+        rollout.register(FN, USER.format(size + i))
+
+    def check_decorator(i):
+        checked(hit)
+
+    def check_decorator_denied(i):
+        try:
+            checked(USER.format('miss'))
+        except Exception:
+            pass
+
+    def enabled_decorator(i):
+        try:
+            enabled()
+        except RolloutException:
+            pass
+
+    batch = [USER.format(i) for i in range(size - BATCH // 2, size + BATCH // 2)]
+
+    return [
+        ('add_func', lambda i: rollout.add_func('func-{0}'.format(i % 1000))),
+        ('register', register),
+        ('is_enabled:hit', lambda i: rollout.is_enabled(FN, hit)),
+        ('is_enabled:miss', lambda i: rollout.is_enabled(FN, 'miss-{0}'.format(i))),
+        ('is_enabled:percentage', lambda i: rollout.is_enabled('percentage', str(i))),
+        ('is_enabled:regex', lambda i: rollout.is_enabled('regex', str(i))),
+        ('is_enabled_many:%d' % BATCH, lambda i: rollout.is_enabled_many(FN, batch)),
+        ('variant', lambda i: rollout.variant('variant', str(i))),
+        ('decorator:check', check_decorator),
+        ('decorator:check_denied', check_decorator_denied),
+        ('decorator:enabled', enabled_decorator),
+    ]
+
+
+def measure(fn, number):
+    latencies = []
+    for i in range(number):
+        t0 = _timer()
+        fn(i)
+        latencies.append(_timer() - t0)
+    total = sum(latencies)
+    latencies.sort()
+    return {
+        'ops_per_sec': number / total if total else float('inf'),
+        'p50_us': latencies[int(number * 0.50)] * 1e6,
+        'p99_us': latencies[min(number - 1, int(number * 0.99))] * 1e6,
+    }
+
+
+class RedisServer(object):
+    """
+    Provide a REDIS client according to the --redis option:
+    `fake` (fakeredis), `spawn` (temporary redis-server) or a URL
+    """
+
+    def __init__(self, target, flush=False):
+        self.target = target
+        self.flush = flush
+        self.process = None
+        self.client = None
+
+    def __enter__(self):
+        if self.target is None:
+            # Only MemoryBackEnd
+            pass
+        elif self.target == 'fake':
+            try:
+                import fakeredis
+            except ImportError:
+                sys.exit("--redis fake requires fakeredis: pip install fakeredis")
+            self.client = fakeredis.FakeStrictRedis()
+        elif self.target == 'spawn':
+            self.client = self._spawn()
+        else:
+            if not self.flush:
+                sys.exit("The benchmark flushes %s, use --flush to allow it" % self.target)
+            import redis
+            self.client = redis.Redis.from_url(self.target)
+        return self
+
+    def _spawn(self):
+        import redis
+        server = shutil.which('redis-server') if hasattr(shutil, 'which') else 'redis-server'
+        if not server:
+            sys.exit("--redis spawn requires redis-server in the PATH")
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        self.process = subprocess.Popen(
+            [server, '--port', str(port), '--save', '', '--appendonly', 'no'],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+        )
+        client = redis.Redis(port=port)
+        for _ in range(100):
+            try:
+                client.ping()
+                return client
+            except redis.ConnectionError:
+                time.sleep(0.05)
+        self.process.terminate()
+        sys.exit("Unable to start redis-server")
+
+    def reset(self):
+        if self.client is not None:
+            self.client.flushdb()
+
+    def __exit__(self, *args):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+
+
+def run(args):
+    results = []
+    with RedisServer(args.redis, args.flush) as server:
+        for kind in args.backends:
+            for size in args.sizes:
+                server.reset()
+                backend = build_backend(kind, server.client)
+                populate(backend, size)
+                rollout = hanoi.Rollout(backend)
+                for operation, fn in operations(rollout, size):
+                    number = max(1, args.number // BATCH) if operation.startswith('is_enabled_many') \
+                        else args.number
+                    stats = measure(fn, number)
+                    stats.update(backend=kind, operation=operation, size=size, number=number)
+                    results.append(stats)
+                    print('{backend:>13} {size:>8} {operation:>24} {ops_per_sec:>12.0f} ops/s '
+                          '{p50_us:>9.1f} us p50 {p99_us:>9.1f} us p99'.format(**stats))
+        server.reset()
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'redis': args.redis,
+            'number': args.number,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
 
-FN = 'FOO'
 
-USER = "USER-{0}"
+def compare(args):
+    def load(path):
+        with open(path) as f:
+            report = json.load(f)
+        return dict(
+            ((r['backend'], r['operation'], r['size']), r) for r in report['results']
+        )
 
-LOOP = 10000
+    base, new = load(args.base), load(args.new)
+    regressions = 0
+    for key in sorted(set(base) & set(new)):
+        before, after = base[key]['ops_per_sec'], new[key]['ops_per_sec']
+        change = (after - before) / before
+        flag = ''
+        if change < -args.threshold:
+            flag = 'REGRESSION'
+            regressions += 1
+        print('{0:>13} {2:>8} {1:>24} {3:>12.0f} -> {4:>12.0f} ops/s {5:>+7.1%} {6}'.format(
+            key[0], key[1], key[2], before, after, change, flag))
 
-for client in (rolloutM, rollout, rolloutHP):
+    print('%d regression(s) over %.0f%%' % (regressions, args.threshold * 100))
+    return 1 if regressions else 0
 
-    t0 = time.time()
 
-    client.add_func(FN)
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Hanoi benchmark suite')
+    commands = parser.add_subparsers(dest='command')
 
-    for i in xrange(0, LOOP):
-        client.register(FN, USER.format(str(i)))
+    run_parser = commands.add_parser('run', help='execute the benchmark')
+    run_parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    run_parser.add_argument('--sizes', nargs='+', type=int, default=list(SIZES),
+                            help='amount of whitelisted users')
+    run_parser.add_argument('--number', type=int, default=2000,
+                            help='iterations per operation')
+    run_parser.add_argument('--redis', default='fake',
+                            help='`fake`, `spawn` or a redis:// URL')
+    run_parser.add_argument('--flush', action='store_true',
+                            help='allow flushing the database given as URL')
+    run_parser.add_argument('--output', help='JSON file to store the results')
 
-    for i in xrange(0, LOOP):
-        client.is_enabled(FN, USER.format(str(i)))
-        client.is_enabled(FN, USER.format('a'))
+    compare_parser = commands.add_parser('compare', help='compare two JSON results')
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='ops/sec drop flagged as regression (0.1 = 10%%)')
 
-    t1 = time.time()
+    args = parser.parse_args(argv)
+    if args.command == 'compare':
+        return compare(args)
+    if args.command == 'run':
+        if all(b == 'memory' for b in args.backends):
+            args.redis = None
+        return run(args)
+    parser.print_help()
+    return 2
 
-    print "%.2f" % round(t1-t0, 2)
 
-    _redis.flushdb()
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Measure the MemoryBackEnd `is_enabled` cost per check for the different
+kinds of functionality, comparing the compiled decision functions with
+the previous implementation (evaluating every step on each check).
+
+    python benchmarks/decision.py
+"""
+from __future__ import print_function
+
+import os
+import re
+import sys
+import timeit
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import hanoi  # noqa
+from hanoi.backend import Feature  # noqa
+
+NUMBER = 200000
+
+
+class PreviousMemoryBackEnd(hanoi.MemoryBackEnd):
+    """`is_enabled` as implemented before compiling the decisions"""
+
+    def is_enabled(self, name, item=None):
+        func_is_enabled = name in self.funcs and self.funcs[name].enabled
+        if item is None:
+            return func_is_enabled
+
+        if not func_is_enabled:
+            return func_is_enabled
+
+        flag = self.funcs[name].percentage == 100
+        flag = flag or item in self.reg.get(name, ())
+        flag = flag or (name in self.rules and self.rules[name].match(str(item)))
+        if not flag and self.funcs[name].percentage > 0:
+            try:  # python 3
+                val = bytes(self.funcs[name].get_item_id(item), 'utf-8')
+            except:
+                val = self.funcs[name].get_item_id(item)
+            flag = zlib.crc32(val) % 100 <= self.funcs[name].percentage
+        return flag
+
+
+def setup(backend):
+    backend.add_functionality(Feature('full', percentage=100))
+    disabled = Feature('disabled', percentage=50)
+    disabled.enabled = False
+    backend.add_functionality(disabled)
+    backend.add_functionality(Feature('whitelist', percentage=0))
+    backend.add_functionality(Feature('percentage', percentage=50))
+    backend.add_functionality(Feature('rule', percentage=50))
+    backend.set_rule('rule', re.compile(r'01$'))
+    for i in range(1000):
+        for name in ('whitelist', 'percentage', 'rule'):
+            backend.add(name, 'USER-{0}'.format(i))
+    return backend
+
+
+CASES = (
+    ('100%', 'full', 'USER-a'),
+    ('disabled', 'disabled', 'USER-a'),
+    ('whitelist hit', 'whitelist', 'USER-10'),
+    ('whitelist miss', 'whitelist', 'USER-a'),
+    ('percentage', 'percentage', 'USER-a'),
+    ('rule + percentage', 'rule', 'USER-a'),
+    ('unknown', 'unknown', 'USER-a'),
+)
+
+
+def measure(backend, name, item, number=NUMBER):
+    timer = timeit.Timer(
+        'is_enabled(name, item)',
+        setup='is_enabled = backend.is_enabled',
+        globals={'backend': backend, 'name': name, 'item': item}
+    ) if sys.version_info >= (3, 5) else timeit.Timer(lambda: backend.is_enabled(name, item))
+    return min(timer.repeat(number=number, repeat=5)) / number * 1e9
+
+
+def main():
+    previous = setup(PreviousMemoryBackEnd())
+    current = setup(hanoi.MemoryBackEnd())
+    print('{0:>18} {1:>14} {2:>14} {3:>8}'.format('case', 'previous (ns)', 'compiled (ns)', 'speedup'))
+    for label, name, item in CASES:
+        before = measure(previous, name, item)
+        after = measure(current, name, item)
+        print('{0:>18} {1:>14.0f} {2:>14.0f} {3:>7.1f}x'.format(label, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Measure the MemoryBackEnd `is_enabled` latency for whitelisted and
+non whitelisted items while the whitelist grows from 10 to 1M identifiers.
+
+    python benchmarks/memory_whitelist.py
+
+The check latency should stay flat, as the whitelist is stored in a SET.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import hanoi  # noqa
+
+FN = 'FOO'
+USER = 'USER-{0}'
+SIZES = (10, 1000, 100000, 1000000)
+NUMBER = 100000
+
+
+def run(size, number=NUMBER):
+    rollout = hanoi.Rollout(hanoi.MemoryBackEnd())
+    rollout.add_func(FN, percentage=0)
+    for i in range(size):
+        rollout.register(FN, USER.format(i))
+
+    hit = USER.format(size // 2)
+    miss = USER.format('a')
+    is_enabled = rollout.is_enabled
+
+    t_hit = min(timeit.repeat(lambda: is_enabled(FN, hit), number=number, repeat=3))
+    t_miss = min(timeit.repeat(lambda: is_enabled(FN, miss), number=number, repeat=3))
+    return t_hit / number * 1e9, t_miss / number * 1e9
+
+
+def main():
+    print('{0:>10} {1:>12} {2:>12}'.format('whitelist', 'hit (ns)', 'miss (ns)'))
+    for size in SIZES:
+        hit, miss = run(size)
+        print('{0:>10} {1:>12.0f} {2:>12.0f}'.format(size, hit, miss))
+
+
+if __name__ == '__main__':
+    main()
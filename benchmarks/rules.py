@@ -0,0 +1,64 @@
+"""
+Measure the cost of matching an item against the rules registered to a
+functionality while the amount of rules grows from 1 to 10K. Half of them
+are prefixes (MSISDN ranges) and half suffixes (the README `01$` example).
+
+    python benchmarks/rules.py
+
+`RuleSet` cost should stay roughly flat, while searching every rule grows linearly.
+Items are different on every check, so the per-item memo does not help.
+"""
+from __future__ import print_function
+
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from hanoi.rules import RuleSet  # noqa
+
+SIZES = (1, 10, 100, 1000, 10000)
+NUMBER = 2000
+
+
+def build(size):
+    rules = []
+    for i in range(size):
+        if i % 2:
+            rules.append(re.compile(r'^34%04d' % i))
+        else:
+            rules.append(re.compile(r'%04d1$' % i))
+    return rules
+
+
+def run(size, number=NUMBER):
+    rules = build(size)
+    rule_set = RuleSet(rules)
+    searches = [rule.search for rule in rules]
+    items = ['4479%08d' % i for i in range(number)]
+
+    def linear():
+        for item in items:
+            any(search(item) is not None for search in searches)
+
+    def indexed():
+        match = rule_set.match
+        for item in items:
+            match(item)
+
+    t_linear = min(timeit.repeat(linear, number=1, repeat=3))
+    t_indexed = min(timeit.repeat(indexed, number=1, repeat=3))
+    return t_linear / number * 1e9, t_indexed / number * 1e9
+
+
+def main():
+    print('{0:>8} {1:>14} {2:>14}'.format('rules', 'search (ns)', 'RuleSet (ns)'))
+    for size in SIZES:
+        linear, indexed = run(size)
+        print('{0:>8} {1:>14.0f} {2:>14.0f}'.format(size, linear, indexed))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,17 @@
-from .api import Rollout
+from .api import Decision, Rollout
 from .backend import MemoryBackEnd, RedisBackEnd, RedisHighPerfBackEnd
+from .cache import CachingBackEnd, ChangeSubscriber
+from .backup import dump, load
+from .migration import DualWriteBackEnd
+from .snapshot import SnapshotBackEnd, write_snapshot
 
-__all__ = ['Rollout', 'MemoryBackEnd', 'RedisBackEnd', 'RedisHighPerfBackEnd']
+__all__ = ['Decision', 'Rollout', 'MemoryBackEnd', 'RedisBackEnd', 'RedisHighPerfBackEnd',
+           'CachingBackEnd', 'ChangeSubscriber', 'DualWriteBackEnd', 'SnapshotBackEnd', 'dump', 'load',
+           'write_snapshot']
+
+try:
+    from .aio import AsyncRollout, AsyncRedisBackEnd, AsyncRedisHighPerfBackEnd
+    __all__ += ['AsyncRollout', 'AsyncRedisBackEnd', 'AsyncRedisHighPerfBackEnd']
+except SyntaxError:
+    # asyncio requires python >= 3.5
+    pass
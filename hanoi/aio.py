@@ -0,0 +1,647 @@
+"""
+asyncio versions of the REDIS BackEnds and Rollout (Python >= 3.5).
+
+Every method doing I/O is a coroutine. The connections are taken from the
+pool of the `redis.asyncio` client, and concurrent coroutines checking the same
+functionality share a single in-flight fetch of its definition.
+
+    rollout = AsyncRollout(AsyncRedisHighPerfBackEnd())
+    await rollout.add_func('cdc_on', percentage=80)
+    await rollout.is_enabled('cdc_on', '447568110000')
+"""
+import asyncio
+import functools
+import inspect
+
+try:
+    from redis.asyncio import Redis
+    from redis.exceptions import ResponseError
+except ImportError:
+    # redis-py < 4.2
+    pass
+
+from .api import Rollout, RolloutException, _decision, _precheck, _regex_type
+from .backend import (
+    CHUNK_SIZE, RedisBackEnd, RedisHighPerfBackEnd, RedisAbstractBackEnd, Feature,
+    FeatureReader, _append_new, _batches, _bucket, _chunks, _variant_of
+)
+from .encoding import is_encoded
+
+
+async def _resolve(value):
+    """
+    Await `value` if needed, so AsyncRollout works with synchronous BackEnds too
+    """
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+def enabled_wrapper(rollout, name, fn):
+    """
+    Coroutine version of the `Rollout.enabled` decorator
+    """
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        if await _resolve(rollout.backend.is_enabled(name)):
+            return await fn(*args, **kwargs)
+        raise RolloutException("Feature <%s> is not enabled" % name)
+    return wrapper
+
+
+def check_wrapper(rollout, func, fn, get_item):
+    """
+    Coroutine version of the `Rollout.check` decorator
+    """
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        backend = rollout.backend
+        definition = await _resolve(backend._load(func))
+        functionality = backend._feature(definition)
+        _id = rollout._checked_id(func, functionality, get_item, args, kwargs)
+        decision = _precheck(functionality, _id)
+        if decision is None:
+            enabled = await _resolve(backend._evaluate(definition, _id))
+            decision = _decision(functionality, _id, enabled, False)
+        if not decision.enabled:
+            raise rollout._not_enabled(func, _id)
+        return await fn(*args, **kwargs)
+    return wrapper
+
+
+def _drops_flight(method):
+    """
+    Decorate a method modifying a functionality (its name or the Feature is the first
+    argument), so a fetch in progress, that could have read the value previous to the
+    change, is not joined by the checks issued afterwards
+    """
+    @functools.wraps(method)
+    async def wrapper(self, name, *args, **kwargs):
+        try:
+            return await method(self, name, *args, **kwargs)
+        finally:
+            self._flights.pop(getattr(name, 'name', name), None)
+    return wrapper
+
+
+class AsyncRedisAbstractBackEnd(object):
+    """
+    I/O of the REDIS BackEnds implemented with coroutines. The data layout,
+    serialization and evaluation logic are inherited from the synchronous BackEnds.
+    """
+
+    def __init__(self, obj=None, channel=RedisAbstractBackEnd.CHANNEL, max_connections=None):
+        if obj is None:
+            self._redis = Redis(max_connections=max_connections)
+        elif isinstance(obj, (list, tuple)):
+            host, port = obj[0], obj[1]
+            db = obj[2] if len(obj) >= 3 else 0
+            self._redis = Redis(host=host, port=port, db=db, max_connections=max_connections)
+        else:
+            self._redis = obj
+
+        self._prefix_len = len(self.PREFIX.format(''))
+        self.channel = channel
+        self.rules = {}
+        self._rule_versions = {}
+
+        # Functionality name -> fetch in progress
+        self._flights = {}
+
+    async def close(self):
+        """
+        Release the connections of the pool
+        """
+        close = getattr(self._redis, 'aclose', None) or self._redis.close
+        await close()
+
+    async def _functionality_names(self):
+        return [x.decode('utf-8') for x in await self._redis.smembers(self.REGISTRY_KEY)]
+
+    async def get_functionalities_page(self, cursor=0, count=1000):
+        cursor, names = await self._redis.sscan(self.REGISTRY_KEY, cursor, count=count)
+        return cursor, [x.decode('utf-8') for x in names]
+
+    async def migrate_registry(self, count=1000):
+        found = 0
+        batch = []
+        async for key in self._redis.scan_iter(match=self._get_func_key('*'), count=count):
+            batch.append(key)
+            if len(batch) >= count:
+                found += await self._register_keys(batch)
+                batch = []
+        if batch:
+            found += await self._register_keys(batch)
+        return found
+
+    async def _register_keys(self, keys):
+        pipe = self._redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.type(key)
+        types = await pipe.execute()
+
+        names = [
+            key[self._prefix_len:] for key, _type in zip(keys, types)
+            if _type in (b'string', 'string')
+        ]
+        if names:
+            await self._redis.sadd(self.REGISTRY_KEY, *names)
+        return len(names)
+
+    @_drops_flight
+    async def set_rule(self, name, rule):
+        pipe = self._redis.pipeline()
+        pipe.hset(self._get_rules_key(name), rule.pattern, rule.flags)
+        pipe.hincrby(self.RULES_VERSIONS_KEY, name, 1)
+        self._publish(pipe, name)
+        await pipe.execute()
+
+    @_drops_flight
+    async def remove_rule(self, name, rule):
+        pipe = self._redis.pipeline()
+        pipe.hdel(self._get_rules_key(name), rule.pattern)
+        pipe.hincrby(self.RULES_VERSIONS_KEY, name, 1)
+        self._publish(pipe, name)
+        await pipe.execute()
+
+    async def get_rules(self, name):
+        await self._sync_rules(name, await self._redis.hget(self.RULES_VERSIONS_KEY, name))
+        return list(self.rules.get(name, ()))
+
+    def iter_whitelist(self, name, chunk_size=CHUNK_SIZE):
+        raise NotImplementedError('iter_whitelist unavailable in the asyncio BackEnds')
+
+    async def _sync_rules(self, name, version):
+        version = int(version) if version else 0
+        if self._rule_versions.get(name, 0) != version:
+            patterns = await self._redis.hgetall(self._get_rules_key(name))
+            self._compile_rules(name, version, patterns)
+
+    async def _get_functionality(self, name):
+        value = await self._redis.get(self._get_func_key(name))
+        return self._editable(self._definition(name, value))
+
+    async def get_functionality(self, name):
+        return self._feature(await self._get_functionality(name))
+
+    async def _load(self, name):
+        """
+        Fetch the functionality definition. Concurrent calls for the same
+        functionality wait for the fetch already in progress
+        """
+        flight = self._flights.get(name)
+        if flight is None:
+            flight = self._flights[name] = asyncio.ensure_future(self._fetch(name))
+            flight.add_done_callback(lambda f: self._land(name, f))
+        # A cancelled caller must not cancel the fetch shared with the others
+        return await asyncio.shield(flight)
+
+    def _land(self, name, flight):
+        if self._flights.get(name) is flight:
+            del self._flights[name]
+
+    async def _fetch(self, name):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.get(self._get_func_key(name))
+        pipe.hget(self.RULES_VERSIONS_KEY, name)
+        value, version = await pipe.execute()
+        await self._sync_rules(name, version)
+        return self._definition(name, value)
+
+    async def _load_all(self):
+        names = await self._functionality_names()
+        if not names:
+            return []
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.mget([self._get_func_key(name) for name in names])
+        pipe.hgetall(self.RULES_VERSIONS_KEY)
+        values, versions = await pipe.execute()
+        for name in names:
+            await self._sync_rules(name, versions.get(name.encode('utf-8')))
+        return [
+            self._definition(name, value)
+            for name, value in zip(names, values) if value is not None
+        ]
+
+    async def is_enabled(self, name, item=None):
+        return await self._evaluate(await self._load(name), item)
+
+    async def is_enabled_many(self, name, items):
+        return await self._evaluate_many(await self._load(name), items)
+
+    async def variant(self, name, item):
+        definition = await self._load(name)
+        if not await self._evaluate(definition, item):
+            return None
+        return _variant_of(self._feature(definition), item)
+
+    async def _update(self, name, update):
+        """
+        Apply `update(func)` to the functionality and save it
+        """
+        definition = await self._get_functionality(name)
+        update(self._feature(definition))
+        await self._save(definition)
+
+    @_drops_flight
+    async def set_percentage(self, name, percentage):
+        def update(func):
+            func.percentage = percentage
+        await self._update(name, update)
+
+    @_drops_flight
+    async def disable(self, name):
+        def update(func):
+            func.enabled = False
+        await self._update(name, update)
+
+    @_drops_flight
+    async def enable(self, name, enable_to_all=False):
+        def update(func):
+            func.enabled = True
+            if enable_to_all:
+                func.percentage = 100
+        await self._update(name, update)
+
+    @_drops_flight
+    async def toggle(self, name):
+        def update(func):
+            func.enabled = not func.enabled
+        await self._update(name, update)
+
+
+class AsyncRedisBackEnd(AsyncRedisAbstractBackEnd, RedisBackEnd):
+    """
+    asyncio version of `RedisBackEnd`
+    """
+
+    def __init__(self, obj=None, channel=RedisAbstractBackEnd.CHANNEL, max_connections=None):
+        super(AsyncRedisBackEnd, self).__init__(obj, channel, max_connections)
+        self._append_script = self._redis.register_script(self.LUA_APPEND)
+
+    async def get_functionalities(self):
+        return await self._functionality_names()
+
+    @_drops_flight
+    async def add_functionality(self, fn, users=None):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.set(self._get_func_key(fn.name), self.serialize_feature(fn, users))
+        pipe.sadd(self.REGISTRY_KEY, fn.name)
+        self._publish(pipe, fn.name)
+        await pipe.execute()
+
+    async def _transaction(self, name, update):
+        key = self._get_func_key(name)
+
+        async def execute(pipe):
+            func, users = self._editable(self._definition(name, await pipe.get(key)))
+            if update(func, users):
+                pipe.multi()
+                pipe.set(key, self.serialize_feature(func, users))
+                self._publish(pipe, name)
+
+        await self._redis.transaction(execute, key)
+
+    async def _update(self, name, update):
+        def _update(func, users):
+            update(func)
+            return True
+        await self._transaction(name, _update)
+
+    async def _head(self, name):
+        head = await self._redis.getrange(self._get_func_key(name), 0, self.HEAD_SIZE - 1)
+        if is_encoded(head):
+            reader = FeatureReader(name, head)
+            if reader.has_field():
+                return reader
+        return None
+
+    @_drops_flight
+    async def add(self, name, item):
+        head = await self._head(name)
+        if head is not None:
+            item_id = head.get_item_id(item)
+            key = self._get_func_key(name)
+            appended = await self._append_script(
+                keys=[key], args=self._append_args(name, [item_id]))
+            if appended == 1:
+                return
+        added = []
+
+        def update(func, users):
+            if not func:
+                return False
+            added.append(True)
+            return _append_new(users, func.get_item_id(item))
+        await self._transaction(name, update)
+        if not added:
+            raise ValueError("Functionality <%s> does not exist" % name)
+
+    async def _appendable(self, name):
+        head = await self._head(name)
+        if head is None:
+            if not (await self._get_functionality(name))[0]:
+                raise ValueError("Functionality <%s> does not exist" % name)
+            await self._transaction(name, lambda func, users: func is not None)
+            head = await self._head(name)
+        return head
+
+    @_drops_flight
+    async def add_many(self, name, items, chunk_size=CHUNK_SIZE, progress=None):
+        head = await self._appendable(name)
+        count = 0
+        for batch in _batches(items, chunk_size):
+            await self._add_ids(name, [head.get_item_id(item) for item in batch])
+            count += len(batch)
+            if progress is not None:
+                progress(count)
+        return count
+
+    @_drops_flight
+    async def _add_ids(self, name, ids):
+        key = self._get_func_key(name)
+        appended = await self._append_script(keys=[key], args=self._append_args(name, ids))
+        if appended == 0:
+            # Legacy format, rewritten encoded
+            await self._appendable(name)
+            appended = await self._append_script(keys=[key], args=self._append_args(name, ids))
+        if appended != 1:
+            raise ValueError("Functionality <%s> does not exist" % name)
+
+    @_drops_flight
+    async def remove(self, name, item):
+        def update(func, users):
+            if func:
+                item_id = func.get_item_id(item)
+                if item_id in users:
+                    users.remove(item_id)
+                    return True
+            return False
+        await self._transaction(name, update)
+
+    @_drops_flight
+    async def remove_functionality(self, name):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.delete(self._get_func_key(name))
+        pipe.srem(self.REGISTRY_KEY, name)
+        self._remove_rules(pipe, name)
+        self._publish(pipe, name)
+        await pipe.execute()
+
+    async def _evaluate(self, definition, item=None):
+        return RedisBackEnd._evaluate(self, definition, item)
+
+    async def _evaluate_many(self, definition, items):
+        return RedisBackEnd._evaluate_many(self, definition, items)
+
+    async def evaluate_all(self, item):
+        bucket = _bucket(str(item))
+        definitions = await self._load_all()
+        enabled = [
+            functionality.enabled and (
+                functionality.get_item_id(item) in users or
+                self._is_enabled_locally(functionality, item, bucket)
+            )
+            for functionality, users in definitions
+        ]
+        return self._variants_of([f for f, _ in definitions], enabled, item)
+
+
+def _no_bloom(self, *args, **kwargs):
+    raise NotImplementedError('Bloom filters unavailable in the asyncio BackEnds')
+
+
+class AsyncRedisHighPerfBackEnd(AsyncRedisAbstractBackEnd, RedisHighPerfBackEnd):
+    """
+    asyncio version of `RedisHighPerfBackEnd`. The Lua check and the Bloom filters
+    are not available.
+    """
+
+    _check_script = None
+
+    use_bloom = drop_bloom = rebuild_bloom = _no_bloom
+
+    async def get_functionalities(self, count=1000):
+        names = []
+        seen = set()
+        cursor = None
+        while cursor != 0:
+            cursor, page = await self.get_functionalities_page(cursor or 0, count)
+            for name in page:
+                if name not in seen:
+                    seen.add(name)
+                    names.append(name)
+        return names
+
+    async def get_functionalities_detail(self, names=None, count=1000):
+        if names is None:
+            names = await self.get_functionalities(count)
+        names = list(names)
+        return self._details(names, await self._details_pipeline(names).execute())
+
+    @_drops_flight
+    async def add_functionality(self, fn, users=None):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.set(self._get_func_key(fn.name), self.serialize_feature(fn))
+        pipe.sadd(self.REGISTRY_KEY, fn.name)
+        if users:
+            pipe.sadd(self.SET_PREFIX.format(fn.name), *users)
+            pipe.hincrby(self.WHITELIST_VERSIONS_KEY, fn.name, 1)
+        self._publish(pipe, fn.name)
+        await pipe.execute()
+
+    async def _save(self, definition):
+        await self.add_functionality(definition)
+
+    @_drops_flight
+    async def add(self, name, item):
+        func = await self._get_functionality(name)
+        if func:
+            await self._add_ids(func.name, [func.get_item_id(item)])
+        else:
+            raise ValueError("Functionality <%s> does not exist" % name)
+
+    @_drops_flight
+    async def add_many(self, name, items, chunk_size=CHUNK_SIZE, progress=None):
+        func = await self._get_functionality(name)
+        if not func:
+            raise ValueError("Functionality <%s> does not exist" % name)
+        count = 0
+        for batch in _batches(items, chunk_size):
+            await self._add_ids(name, [func.get_item_id(item) for item in batch])
+            count += len(batch)
+            if progress is not None:
+                progress(count)
+        return count
+
+    @_drops_flight
+    async def _add_ids(self, name, ids):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.sadd(self.SET_PREFIX.format(name), *ids)
+        pipe.hincrby(self.WHITELIST_VERSIONS_KEY, name, 1)
+        self._publish(pipe, name)
+        await pipe.execute()
+
+    @_drops_flight
+    async def remove(self, name, item):
+        func = await self._get_functionality(name)
+        if func:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.srem(self.SET_PREFIX.format(func.name), func.get_item_id(item))
+            pipe.hincrby(self.WHITELIST_VERSIONS_KEY, func.name, 1)
+            self._publish(pipe, func.name)
+            await pipe.execute()
+
+    @_drops_flight
+    async def remove_functionality(self, name):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.delete(self._get_func_key(name), self.SET_PREFIX.format(name))
+        pipe.hincrby(self.WHITELIST_VERSIONS_KEY, name, 1)
+        pipe.srem(self.REGISTRY_KEY, name)
+        self._remove_rules(pipe, name)
+        self._publish(pipe, name)
+        await pipe.execute()
+
+    async def _allowed_user(self, functionality, user):
+        return bool(await self._redis.sismember(
+            self.SET_PREFIX.format(functionality.name),
+            functionality.get_item_id(user)
+        ))
+
+    async def _allowed_users(self, functionality, ids):
+        key = self.SET_PREFIX.format(functionality.name)
+        result = []
+        for chunk in _chunks(ids):
+            try:
+                result.extend(await self._redis.smismember(key, chunk))
+            except ResponseError:
+                pipe = self._redis.pipeline(transaction=False)
+                for _id in chunk:
+                    pipe.sismember(key, _id)
+                result.extend(await pipe.execute())
+        return [bool(x) for x in result]
+
+    async def _evaluate(self, functionality, item=None):
+        if not functionality:
+            return False
+        if item is None or not functionality.enabled:
+            return functionality.enabled
+        return (
+            self._is_enabled_locally(functionality, item) or
+            await self._allowed_user(functionality, item)
+        )
+
+    async def _evaluate_many(self, functionality, items):
+        items = list(items)
+        if not functionality or not functionality.enabled:
+            return [False] * len(items)
+
+        result = [self._is_enabled_locally(functionality, item) for item in items]
+        pending = [i for i, flag in enumerate(result) if not flag]
+        if pending:
+            ids = [functionality.get_item_id(items[i]) for i in pending]
+            for i, flag in zip(pending, await self._allowed_users(functionality, ids)):
+                result[i] = flag
+        return result
+
+    async def evaluate_all(self, item):
+        bucket = _bucket(str(item))
+        functionalities = await self._load_all()
+        enabled = [
+            f.enabled and self._is_enabled_locally(f, item, bucket)
+            for f in functionalities
+        ]
+        pending = [
+            i for i, f in enumerate(functionalities) if f.enabled and not enabled[i]
+        ]
+        if pending:
+            pipe = self._redis.pipeline(transaction=False)
+            for i in pending:
+                f = functionalities[i]
+                pipe.sismember(self.SET_PREFIX.format(f.name), f.get_item_id(item))
+            for i, flag in zip(pending, await pipe.execute()):
+                enabled[i] = bool(flag)
+        return self._variants_of(functionalities, enabled, item)
+
+
+class AsyncRollout(Rollout):
+    """
+    Rollout whose operations are coroutines. It works with the asyncio
+    BackEnds as well as with any synchronous BackEnd (i.e. MemoryBackEnd).
+    """
+
+    async def add_func(self, name, check=None, percentage=0, variants=None):
+        fn = Feature(name, check, percentage, variants)
+        await _resolve(self.backend.add_functionality(fn))
+        self._forget_accessor(name)
+
+    async def is_enabled(self, name, item=None):
+        return await _resolve(self.backend.is_enabled(name, item))
+
+    async def decide(self, name, item=None):
+        return await self._fetch_decision(name, item, True)
+
+    async def _fetch_decision(self, name, item, variant):
+        backend = self.backend
+        definition = await _resolve(backend._load(name))
+        functionality = backend._feature(definition)
+        decision = _precheck(functionality, item)
+        if decision is None:
+            enabled = await _resolve(backend._evaluate(definition, item))
+            decision = _decision(functionality, item, enabled, variant)
+        return decision
+
+    async def is_enabled_many(self, name, items):
+        return await _resolve(self.backend.is_enabled_many(name, items))
+
+    async def evaluate_all(self, item):
+        return await _resolve(self.backend.evaluate_all(item))
+
+    async def register(self, name, item):
+        fn = self.backend.set_rule if type(item) == _regex_type else self.backend.add
+        await _resolve(fn(name, item))
+
+    async def register_many(self, name, items, chunk_size=CHUNK_SIZE, progress=None):
+        return await _resolve(self.backend.add_many(name, items, chunk_size, progress))
+
+    async def unregister(self, name, item):
+        fn = self.backend.remove_rule if type(item) == _regex_type else self.backend.remove
+        await _resolve(fn(name, item))
+
+    async def remove_func(self, name):
+        await _resolve(self.backend.remove_functionality(name))
+        self._forget_accessor(name)
+
+    async def set_percentage(self, name, percentage):
+        await _resolve(self.backend.set_percentage(name, percentage))
+
+    async def variant(self, name, item):
+        return (await self.decide(name, item)).variant
+
+    async def enable(self, name):
+        await _resolve(self.backend.enable(name))
+
+    async def disable(self, name):
+        await _resolve(self.backend.disable(name))
+
+    async def toggle(self, name):
+        await _resolve(self.backend.toggle(name))
+
+    async def get_functionality(self, name):
+        return await _resolve(self.backend.get_functionality(name))
+
+    def __getattr__(self, key):
+        """
+        `await rollout.is_<name>(item=None)` checks the functionality `name`
+        """
+        prefix, _, func = key.partition('_')
+        if prefix != 'is' or not func:
+            raise AttributeError(key)
+
+        async def accessor(item=None):
+            decision = await self._fetch_decision(func, item, False)
+            if not decision.defined:
+                self._forget_accessor(func)
+                raise ValueError("Feature <%s> not defined" % func)
+            return decision.enabled
+        return self._cache_accessor(func, accessor)
@@ -1,17 +1,178 @@
+import contextlib
+import functools
+import inspect
 import re
+import threading
+import weakref
+from collections import namedtuple
 
-from .backend import Feature
+from .backend import CHUNK_SIZE, Feature, _variant_of
 
 _regex_type = type(re.compile(r''))
 
+try:
+    from contextvars import ContextVar
+except ImportError:
+    # python < 3.7
+    ContextVar = None
+
+try:
+    from inspect import iscoroutinefunction
+except ImportError:
+    # python < 3.5
+    def iscoroutinefunction(fn):
+        return False
+
+
+def _positional_names(fn):
+    try:
+        parameters = inspect.signature(fn).parameters.values()
+    except AttributeError:
+        # python 2
+        return inspect.getargspec(fn).args
+    return [
+        p.name for p in parameters
+        if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+    ]
+
+
+def _item_getter(fn, index):
+    """
+    Return a function extracting from the call (args, kwargs) of `fn` its
+    argument number `index` (1 based), even if it was given as keyword
+    """
+    position = index - 1
+    names = _positional_names(fn)
+    name = names[position] if position < len(names) else None
+
+    def get_item(args, kwargs):
+        if position < len(args) or name not in kwargs:
+            return args[position]
+        return kwargs[name]
+    return get_item
+
+
+class _LocalVar(object):
+    """
+    `ContextVar` alike variable (get, set and reset) stored per thread,
+    used when contextvars is not available
+    """
+
+    def __init__(self, default=None):
+        self._local = threading.local()
+        self._default = default
+
+    def get(self):
+        return getattr(self._local, 'value', self._default)
+
+    def set(self, value):
+        token = self.get()
+        self._local.value = value
+        return token
+
+    def reset(self, token):
+        self._local.value = token
+
+
+def _context_var(name):
+    if ContextVar is not None:
+        return ContextVar(name, default=None)
+    return _LocalVar()
+
+
+# Context local (per thread and asyncio task) variable holding the objectId
+# to be used by every Rollout, as a weak mapping so it doesn't keep them alive.
+# The mapping is copied on every change, so each context sees its own one
+_current_ids = _context_var('hanoi_current_ids')
+
+
+def _ensure_sync(value):
+    if hasattr(value, '__await__'):
+        if hasattr(value, 'close'):
+            # Avoid the "never awaited" warning
+            value.close()
+        raise TypeError("An asynchronous BackEnd requires decorating coroutine functions")
+    return value
+
+
+class Decision(namedtuple('Decision', ['defined', 'enabled', 'variant', 'reason'])):
+    """
+    Outcome of evaluating a functionality for an item. It's truthy if enabled.
+    - reason: why the functionality is (not) enabled, one of the constants below
+    """
+    __slots__ = ()
+
+    UNDEFINED = 'undefined'      # The functionality does not exist
+    DISABLED = 'disabled'        # The functionality is disabled
+    GLOBAL = 'global'            # Checked without item: the functionality is enabled
+    MATCHED = 'matched'          # The item is whitelisted, matches a rule or the percentage
+    NOT_MATCHED = 'not_matched'  # The item is not targeted by the functionality
+
+    def __bool__(self):
+        return self.enabled
+
+    __nonzero__ = __bool__
+
+
+_UNDEFINED = Decision(False, False, None, Decision.UNDEFINED)
+_DISABLED = Decision(True, False, None, Decision.DISABLED)
+_GLOBAL = Decision(True, True, None, Decision.GLOBAL)
+_NOT_MATCHED = Decision(True, False, None, Decision.NOT_MATCHED)
+_MATCHED = Decision(True, True, None, Decision.MATCHED)
+
+
+def _precheck(functionality, item):
+    """
+    Return the Decision that does not depend on the item, or None if it should be evaluated
+    """
+    if functionality is None:
+        return _UNDEFINED
+    if not functionality.enabled:
+        return _DISABLED
+    if item is None:
+        return _GLOBAL
+    return None
+
+
+def _decision(functionality, item, enabled, variant=True):
+    """
+    Return the Decision for an evaluated `item`; its variant is picked only if `variant`
+    """
+    if not enabled:
+        return _NOT_MATCHED
+    if not variant or not functionality.variants:
+        return _MATCHED
+    return Decision(True, True, _variant_of(functionality, item), Decision.MATCHED)
+
+
+_UNMATCHED = {
+    Decision.UNDEFINED: _UNDEFINED,
+    Decision.DISABLED: _DISABLED,
+    Decision.NOT_MATCHED: _NOT_MATCHED,
+}
+
+
+def _backend_decision(backend, name, item):
+    """
+    Return the Decision taken by the backend itself in a single round trip
+    (i.e. `RedisHighPerfBackEnd(lua=True)`), or None if it must be evaluated here
+    """
+    decide = getattr(backend, '_decide', None)
+    if decide is None or item is None:
+        return None
+    result = decide(name, item)
+    if result is None:
+        return None
+    reason, variant = result
+    if reason == Decision.MATCHED:
+        return Decision(True, True, variant, reason)
+    return _UNMATCHED[reason]
+
 
 class Rollout(object):
 
     def __init__(self, backend):
         self._backend = backend
-        # `ThreadLocal` alike variable that holds the objectId
-        # to be used
-        self._item = None
 
     @property
     def backend(self):
@@ -26,42 +187,151 @@ class Rollout(object):
         @param check: object field to be used for checking if the functionality
                       is enabled (i.e. `id` for using the property `id` in an `User` instance)
         @param percentage: percentage of objects the functionality should be enabled to
-        @param variants: set of valid variants for the functionality
+        @param variants: set of valid variants for the functionality, equally weighted,
+                         or (variant, weight) pairs, i.e. [('foo', 90), ('bar', 10)]
         """
         # TODO: allow getting a `Feature` instance
         fn = Feature(name, check, percentage, variants)
         self.backend.add_functionality(fn)
+        self._forget_accessor(name)
 
     def is_enabled(self, name, item=None):
         return self.backend.is_enabled(name, item)
 
+    def decide(self, name, item=None):
+        """
+        Evaluate the functionality `name` for `item` (or globally if None)
+        fetching the functionality once from the backend.
+        @return: Decision(defined, enabled, variant, reason)
+        """
+        return self._fetch_decision(name, item, True)
+
+    def _fetch_decision(self, name, item, variant):
+        decision = _backend_decision(self.backend, name, item)
+        if decision is not None:
+            return decision
+        return self._decide(self.backend._load(name), item, variant)
+
+    def _decide(self, definition, item, variant=True):
+        backend = self.backend
+        functionality = backend._feature(definition)
+        decision = _precheck(functionality, item)
+        if decision is None:
+            enabled = backend._evaluate(definition, item)
+            decision = _decision(functionality, item, enabled, variant)
+        return decision
+
+    def is_enabled_many(self, name, items):
+        """
+        Check if a functionality is enabled for every item in `items`.
+        The functionality is fetched once from the backend.
+        @param name: functionality name
+        @param items: iterable of objects to be checked
+        @return: list of booleans, in the same order than `items`
+        """
+        return self.backend.is_enabled_many(name, items)
+
+    def evaluate_all(self, item):
+        """
+        Evaluate every functionality for `item` in a single pass,
+        fetching every definition at once.
+        @return: dict functionality name -> (enabled, variant)
+        """
+        return self.backend.evaluate_all(item)
+
     def register(self, name, item):
         """
         Enables a functionality for either a
-        regular expression (set of objects) or a specific object
+        regular expression (set of objects) or a specific object.
+        Several regular expressions can be registered to the same functionality
         """
         fn = self.backend.set_rule if type(item) == _regex_type else self.backend.add
         fn(name, item)
 
+    def register_many(self, name, items, chunk_size=CHUNK_SIZE, progress=None):
+        """
+        Enables a functionality for every object in `items`, any iterable
+        (i.e. a generator reading identifiers from a file). The functionality is
+        validated once and the objects are written `chunk_size` at a time,
+        so the memory used does not depend on the amount of objects.
+        Regular expressions should be registered with `register`.
+        @param progress: callable invoked with the amount of objects registered
+                         after every chunk
+        @return: amount of objects registered
+        """
+        return self.backend.add_many(name, items, chunk_size, progress)
+
+    def unregister(self, name, item):
+        """
+        Disables a functionality previously registered for either a
+        regular expression or a specific object
+        """
+        fn = self.backend.remove_rule if type(item) == _regex_type else self.backend.remove
+        fn(name, item)
+
+    def remove_func(self, name):
+        """
+        Removes from backend the functionality, its whitelist and its rules
+        """
+        self.backend.remove_functionality(name)
+        self._forget_accessor(name)
+
     def set_percentage(self, name, percentage):
         self.backend.set_percentage(name, percentage)
 
+    @property
+    def _item(self):
+        current = _current_ids.get()
+        return current.get(self) if current else None
+
+    def _set_item(self, name):
+        current = weakref.WeakKeyDictionary(_current_ids.get() or {})
+        if name is None:
+            current.pop(self, None)
+        else:
+            current[self] = name
+        return _current_ids.set(current)
+
     def set_current_id(self, name):
         """
-        Map a specific user to the instance, so there's no need to
+        Map a specific user to the current context, so there's no need to
         pass it as parameter in every check.
-        Don't use this approach if you need a thread safe environment.
+        It's stored per thread and asyncio task (using contextvars, or
+        per thread in python < 3.7), so it's safe under concurrency.
         """
-        self._item = name
+        self._set_item(name)
 
     def cleanup_current_id(self):
-        self._item = None
+        self._set_item(None)
+
+    @contextlib.contextmanager
+    def current_id(self, name):
+        """
+        Context manager mapping a specific user while executing the block,
+        restoring the previous one afterwards:
+
+        with rollout.current_id(user):
+            execute_a_logic()
+        """
+        token = self._set_item(name)
+        try:
+            yield name
+        finally:
+            _current_ids.reset(token)
 
     def enabled(self, name):
-        """Decorator that checks if a functionality is enabled globally"""
+        """
+        Decorator that checks if a functionality is enabled globally.
+        Coroutine functions get a coroutine wrapper, awaiting asynchronous BackEnds.
+        """
         def real_decorator(fn):
+            if iscoroutinefunction(fn):
+                from .aio import enabled_wrapper
+                return enabled_wrapper(self, name, fn)
+
+            @functools.wraps(fn)
             def wrapper(*args, **kwargs):
-                if self.is_enabled(name):
+                if _ensure_sync(self.backend.is_enabled(name)):
                     return fn(*args, **kwargs)
                 else:
                     raise RolloutException("Feature <%s> is not enabled" % name)
@@ -73,7 +343,7 @@ class Rollout(object):
         Return the `name` functionality variant for `item` object.
         It's based on crc32
         """
-        return self.backend.variant(name, item)
+        return self.decide(name, item).variant
 
     def enable(self, name):
         """
@@ -93,53 +363,94 @@ class Rollout(object):
         """
         self.backend.toggle(name)
 
-    def _is_func_defined(self, name):
-        return self.backend.get_functionality(name) is not None
+    def _checked_id(self, func, functionality, get_item, args, kwargs):
+        """
+        Return the identifier `func` should be checked for in a decorated call
+        """
+        if functionality is None:
+            raise Exception("Feature <%s> is not defined" % func)
+        if get_item is not None:
+            _id = functionality.get_item_id(get_item(args, kwargs))
+        else:
+            _id = self._item
+        if _id is None:
+            raise Exception("Identifier should be set before checking the functionality")
+        return _id
 
-    def _callable(self, fn, func):
-        def wrapper(*args, **kwargs):
-            _id = func(*args, **kwargs)
-            return self.backend.is_enabled(fn, _id)
-        return wrapper
+    def _not_enabled(self, func, _id):
+        return Exception("Feature <%s> is not enabled for user <%s> " % (func, _id))
 
     def check(self, func, index=None):
         """
         Decorator to check if a functionality is enabled
         for a specific user/item.
+        Coroutine functions get a coroutine wrapper, awaiting asynchronous BackEnds.
         @param func: functionality name to be checked
-        @param index: argument to be used as user/item. If None, it will seek for the item
-        in the current_id value
+        @param index: argument to be used as user/item (1 based, it might be given
+        as keyword too). If None, it will seek for the item in the current_id value
         """
         def real_decorator(fn):
+            # Resolved once, not on every call
+            get_item = _item_getter(fn, index) if index is not None else None
+
+            if iscoroutinefunction(fn):
+                from .aio import check_wrapper
+                return check_wrapper(self, func, fn, get_item)
+
+            @functools.wraps(fn)
             def wrapper(*args, **kwargs):
-                if self._is_func_defined(func):
-                    if index is not None:
-                        _fn = self.backend.get_functionality(func)
-                        _id = _fn.get_item_id(args[index-1])
-                    else:
-                        _id = self._item
-                    if _id is None:
-                        raise Exception("Identifier should be set before checking the functionality")
-                    if self.backend.is_enabled(func, _id):
+                backend = self.backend
+                if get_item is None:
+                    # The identifier does not depend on the functionality
+                    _id = self._item
+                    decision = _backend_decision(backend, func, _id)
+                    if decision is not None:
+                        if not decision.defined:
+                            raise Exception("Feature <%s> is not defined" % func)
+                        if not decision.enabled:
+                            raise self._not_enabled(func, _id)
                         return fn(*args, **kwargs)
-                    else:
-                        raise Exception("Feature <%s> is not enabled for user <%s> " % (func, _id))
-                else:
-                    raise Exception("Feature <%s> is not defined" % func)
+                # A single fetch of the functionality
+                definition = _ensure_sync(backend._load(func))
+                functionality = backend._feature(definition)
+                _id = self._checked_id(func, functionality, get_item, args, kwargs)
+                if not self._decide(definition, _id, False).enabled:
+                    raise self._not_enabled(func, _id)
+                return fn(*args, **kwargs)
             return wrapper
         return real_decorator
 
+    def _cache_accessor(self, name, accessor):
+        """
+        Store the `is_<name>` accessor as an instance attribute,
+        so next lookups don't reach `__getattr__`
+        """
+        self.__dict__['is_' + name] = accessor
+        return accessor
+
+    def _forget_accessor(self, name):
+        self.__dict__.pop('is_' + name, None)
+
     def __getattr__(self, key):
-        prefix, func = key.split('_', 1)
-        if prefix == 'is' and self._is_func_defined(func):
-            _fn = self.backend.get_functionality(func).function
-            if _fn is None:
-                # Unity lambda. TODO: just avoid wrapping
-                _fn = lambda x: x
-            return self._callable(func, _fn)
-        else:
+        """
+        `rollout.is_<name>(item=None)` checks the functionality `name`.
+        The accessor is built once per functionality, and dropped when the
+        functionality is added, removed or found undefined.
+        """
+        prefix, _, func = key.partition('_')
+        if prefix != 'is' or not func:
+            raise AttributeError(key)
+        if not self.decide(func).defined:
             raise ValueError("Feature <%s> not defined" % func)
 
+        def accessor(item=None):
+            decision = self._fetch_decision(func, item, False)
+            if not decision.defined:
+                self._forget_accessor(func)
+                raise ValueError("Feature <%s> not defined" % func)
+            return decision.enabled
+        return self._cache_accessor(func, accessor)
+
 
 class RolloutException(Exception):
     pass
@@ -1,18 +1,231 @@
+import re
+import threading
 import zlib
 from abc import ABCMeta
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
+from itertools import islice
 
 try:
     from redis import Redis
+    from redis.exceptions import ResponseError
 except ImportError:
     # Redis not available.
     # We expect our user to use only MemoryBackend
     pass
 
+from .bloom import BloomFilter
+from .encoding import VERSION, Record, encode, encode_users, is_encoded
+from .rules import RuleSet
+
+try:
+    _string_types = (basestring,)
+    _text_type = unicode
+except NameError:
+    # python 3
+    _string_types = (str,)
+    _text_type = str
+
+# Maximum number of whitelist lookups sent to REDIS in a single round trip
+CHUNK_SIZE = 10000
+
+# Weighted variants are allocated in buckets of 0.01%
+VARIANT_BUCKETS = 10000
+
+
+def _crc32(value):
+    if isinstance(value, _text_type):
+        value = value.encode('utf-8')
+    return zlib.crc32(value)
+
+
+def _bucket(item_id):
+    """
+    Return the percentage bucket (crc32 % 100) an item identifier belongs to
+    """
+    return _crc32(item_id) % 100
+
+
+def _always(item=None, bucket=None):
+    return True
+
+
+def _never(item=None, bucket=None):
+    return False
+
+
+def _compile_decision(functionality, whitelist, rules):
+    """
+    Build a function deciding if `functionality` is enabled for an item
+    (or globally, if the item is None), specialized for its current state.
+    `bucket`, if provided, is the percentage bucket of `str(item)`:
+    - disabled or 100% functionalities are constants
+    - steps not configured (rules, percentage) are skipped
+    `whitelist` is any container (checked with `in`) and `rules` a `RuleSet` or None.
+    """
+    if functionality is None or not functionality.enabled:
+        return _never
+    if functionality.percentage == 100:
+        return _always
+
+    percentage = functionality.percentage
+    by_field = functionality.field is not None
+    item_id = functionality.get_item_id if by_field else str
+    crc32 = zlib.crc32
+    text_type = _text_type
+    match = rules.match if rules else None
+
+    # Calls are inlined on purpose, as these functions run on every check
+    if percentage == 0:
+        if match is None:
+            def decision(item=None, bucket=None):
+                return item is None or item in whitelist
+        else:
+            def decision(item=None, bucket=None):
+                return item is None or item in whitelist or match(str(item))
+    else:
+        def decision(item=None, bucket=None):
+            if item is None or item in whitelist:
+                return True
+            if match is not None and match(str(item)):
+                return True
+            if bucket is not None and not by_field:
+                return bucket <= percentage
+            value = item_id(item)
+            if isinstance(value, text_type):
+                value = value.encode('utf-8')
+            return crc32(value) % 100 <= percentage
+    return decision
+
+
+# Unknown functionality names whose (constant) decision is cached by MemoryBackEnd
+_MAX_UNKNOWN = 1024
+
+# Reason returned by the Lua check of RedisHighPerfBackEnd when the item is targeted
+_MATCHED = 'matched'
+
+# Allocation tables already compiled, by weights
+_ALLOCATIONS = {}
+_MAX_ALLOCATIONS = 1024
+
+
+def _allocation_table(weights):
+    """
+    Compile variant weights into a table bucket -> variant index, where every
+    variant owns a contiguous range of buckets. Adjusting a weight only moves
+    the buckets around the affected boundaries, so most items keep their variant.
+    Tables are shared by every functionality with the same weights.
+    """
+    if weights is None:
+        return None
+    key = tuple(weights)
+    table = _ALLOCATIONS.get(key)
+    if table is None:
+        if len(_ALLOCATIONS) >= _MAX_ALLOCATIONS:
+            _ALLOCATIONS.clear()
+        table = _ALLOCATIONS[key] = _compile_allocation(weights)
+    return table
+
+
+def _compile_allocation(weights):
+    total = sum(weights)
+    table = bytearray(VARIANT_BUCKETS)
+    start = cumulative = 0
+    for index, weight in enumerate(weights):
+        cumulative += weight
+        end = cumulative * VARIANT_BUCKETS // total
+        table[start:end] = bytearray([index]) * (end - start)
+        start = end
+    return table
+
+
+def _pick_variant(functionality, crc):
+    """
+    Return the variant assigned to an item whose crc32 is `crc`
+    """
+    variants = functionality.variants
+    if not variants:
+        return None
+    allocation = functionality._allocation
+    if allocation is None:
+        # Same weight for every variant
+        return variants[crc % len(variants)]
+    return variants[allocation[crc % VARIANT_BUCKETS]]
+
+
+def _variant_of(functionality, item):
+    """
+    Return the variant assigned to `item`, by the crc32 of its identifier: the item
+    itself if it's a string or a number (as in the Lua check), its id otherwise
+    """
+    if not functionality.variants:
+        return None
+    if not isinstance(item, _string_types + (bytes, int)):
+        item = functionality.get_item_id(item)
+    if not isinstance(item, (bytes, _text_type)):
+        item = _text_type(item)
+    return _pick_variant(functionality, _crc32(item))
+
+
+# Weighted variant in the legacy format, as matched by the Lua check
+_WEIGHTED_VARIANT = re.compile(r'^(.*):([0-9]+)$', re.DOTALL)
+
+
+def _unserialize_variants(value):
+    """
+    Legacy format: variants stored as "foo,bar" or, if weighted, "foo:90,bar:10".
+    Variants are weighted only if every one of them ends with a weight.
+    """
+    if not value:
+        return None
+    variants = value.split(',')
+    weighted = [_WEIGHTED_VARIANT.match(v) for v in variants]
+    if all(weighted):
+        return [(m.group(1), int(m.group(2))) for m in weighted]
+    return variants
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _batches(items, size=CHUNK_SIZE):
+    """
+    Split any iterable in lists of `size` items, consuming it lazily
+    """
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _append_new(items, item):
+    """
+    Append `item` to the list `items` unless already there
+    @return: True if appended
+    """
+    if item in items:
+        return False
+    items.append(item)
+    return True
+
+
+def _get_item_id(field, item):
+    if field is None:
+        return str(item)
+    else:
+        _field = getattr(item, field)
+        if hasattr(_field, '__call__'):
+            return _field()
+        else:
+            return _field
+
 
 class Feature(object):
 
-    __slots__ = ['name', 'field', 'percentage', 'enabled', 'variants']
+    __slots__ = ['name', 'field', 'percentage', 'enabled', 'variants', 'weights', '_allocation']
 
     def __init__(self, name, field=None, percentage=100, variants=None):
         try:
@@ -39,27 +252,58 @@ class Feature(object):
             raise AttributeError("Percentage should be a number between 0 and 100")
         return value
 
+    def _validate_variants(self, variants):
+        """
+        Return (variants, weights). Variants may be a list of names, equally
+        weighted, or a list of (name, weight) pairs.
+        """
+        if not variants or all(isinstance(v, _string_types) for v in variants):
+            return variants, None
+        try:
+            names, weights = zip(*variants)
+        except (TypeError, ValueError):
+            raise AttributeError("Variants should be names or (name, weight) pairs")
+        return list(names), list(weights)
+
+    def _validate_weights(self, weights):
+        if weights is None:
+            return None
+        try:
+            weights = [int(w) for w in weights]
+        except (TypeError, ValueError):
+            raise AttributeError("Variant weights should be valid numbers")
+
+        if len(weights) != len(self.variants or ()):
+            raise AttributeError("There should be a weight per variant")
+        if len(weights) > 256:
+            raise AttributeError("Weighted variants are limited to 256")
+        if any(w < 0 for w in weights) or not sum(weights):
+            raise AttributeError("Variant weights should be positive numbers")
+        return weights
+
     def get_item_id(self, item):
         """
         Return the item id to be used.
         """
-        if self.field is None:
-            return str(item)
-        else:
-            _field = getattr(item, self.field)
-            if hasattr(_field, '__call__'):
-                return _field()
-            else:
-                return _field
+        return _get_item_id(self.field, item)
 
     def __setattr__(self, name, value):
         """
-        Validate two fields while setting them:
+        Validate the fields while setting them:
         - percentage should be an integer between 0 and 100
         - name is read only
+        - variants (and weights) compile the variants allocation table
         """
         if name == 'percentage':
             value = self._validate_percentage(value)
+        elif name == 'variants':
+            value, weights = self._validate_variants(value)
+            object.__setattr__(self, name, value)
+            self.weights = weights
+            return
+        elif name == 'weights':
+            value = self._validate_weights(value)
+            object.__setattr__(self, '_allocation', _allocation_table(value))
         elif name == 'name' and hasattr(self, name):
             raise RuntimeError("Unable to update the Feature name")
 
@@ -73,73 +317,223 @@ class Feature(object):
         )
 
 
+class FeatureReader(Record):
+    """
+    Functionality read from REDIS, decoded lazily (see `hanoi.encoding`).
+    It exposes the same attributes than `Feature`, but it's read only.
+    """
+
+    __slots__ = ['name']
+
+    def __init__(self, name, value):
+        super(FeatureReader, self).__init__(value)
+        self.name = name
+
+    @property
+    def _allocation(self):
+        return _allocation_table(self.weights)
+
+    def get_item_id(self, item):
+        return _get_item_id(self.field, item)
+
+    def to_feature(self):
+        variants = self.variants
+        if self.weights is not None:
+            variants = list(zip(variants, self.weights))
+        f = Feature(self.name, self.field, self.percentage, variants)
+        f.enabled = self.enabled
+        return f
+
+
+def _to_feature(functionality):
+    if isinstance(functionality, FeatureReader):
+        return functionality.to_feature()
+    return functionality
+
+
 class MemoryBackEnd(object):
+    """
+    Implements a BackEnd storing the information in the process memory.
+    - Whitelisted items are stored in a SET per functionality, so checking
+      an item is O(1) regardless the whitelist size and duplicates are ignored.
+    - Every functionality is compiled into a decision function, rebuilt only
+      when the functionality is modified through the backend. Modifying
+      directly a `Feature` already added is not supported.
+    - Several rules can be registered per functionality (see `RuleSet`).
+    """
 
     def __init__(self):
         self.funcs = {}
-        self.reg = defaultdict(lambda: [])
+        self.reg = defaultdict(set)
         self.rules = {}
+        self._decisions = {}
+
+    def _decision(self, name):
+        decision = self._decisions.get(name)
+        if decision is None:
+            functionality = self.funcs.get(name)
+            if functionality is None:
+                # Bounded, so checking arbitrary names does not grow the dict forever
+                if len(self._decisions) < len(self.funcs) + _MAX_UNKNOWN:
+                    self._decisions[name] = _never
+                return _never
+            decision = self._decisions[name] = _compile_decision(
+                functionality, self.reg[name], self.rules.get(name))
+        return decision
 
     def get_functionalities(self):
         return list(self.funcs)
 
     def add_functionality(self, fn):
         self.funcs[fn.name] = fn
+        self._decisions.pop(fn.name, None)
 
     def get_functionality(self, name):
         return self.funcs.get(name)
 
+    def remove_functionality(self, name):
+        self.funcs.pop(name, None)
+        self.reg.pop(name, None)
+        self.rules.pop(name, None)
+        self._decisions.pop(name, None)
+
     def add(self, name, item):
-        self.reg[name].append(item)
+        # The decision function holds the whitelist, so no need to rebuild it
+        self.reg[name].add(item)
+
+    def add_many(self, name, items, chunk_size=CHUNK_SIZE, progress=None):
+        """
+        Whitelist every item in `items`, any iterable, `chunk_size` items at a time.
+        @param progress: callable invoked with the amount of items added after every chunk
+        @return: amount of items added
+        """
+        if name not in self.funcs:
+            raise ValueError("Functionality <%s> does not exist" % name)
+        count = 0
+        for batch in _batches(items, chunk_size):
+            self._add_ids(name, batch)
+            count += len(batch)
+            if progress is not None:
+                progress(count)
+        return count
+
+    def _add_ids(self, name, ids):
+        """
+        Whitelist the identifiers `ids` as stored (see `iter_whitelist`), so they're
+        not resolved again by `get_item_id`; used to restore and copy whitelists
+        """
+        self.reg[name].update(ids)
+
+    def remove(self, name, item):
+        if name in self.reg:
+            self.reg[name].discard(item)
+
+    def iter_whitelist(self, name, chunk_size=CHUNK_SIZE):
+        """
+        Iterate the identifiers of the whitelisted items of a functionality (as
+        `get_item_id` returns them, or as stored if added as identifiers),
+        in lists of `chunk_size` items
+        """
+        functionality = self.funcs.get(name)
+        get_item_id = functionality.get_item_id if functionality is not None else str
+        ids = [item if isinstance(item, _string_types) else get_item_id(item)
+               for item in self.reg.get(name, ())]
+        return _batches(ids, chunk_size)
+
+    def get_rules(self, name):
+        """
+        Return the regular expressions registered to a functionality
+        """
+        return list(self.rules.get(name, ()))
 
     def set_rule(self, name, rule):
-        self.rules[name] = rule
+        self.rules.setdefault(name, RuleSet()).add(rule)
+        self._decisions.pop(name, None)
+
+    def remove_rule(self, name, rule):
+        rules = self.rules.get(name)
+        if rules is not None and rules.remove(rule):
+            if not rules:
+                del self.rules[name]
+            self._decisions.pop(name, None)
 
     def set_percentage(self, name, percentage):
         self.funcs[name].percentage = percentage
+        self._decisions.pop(name, None)
 
-    def is_enabled(self, name, item=None):
-        func_is_enabled = name in self.funcs and self.funcs[name].enabled
-        if item is None:
-            # Global funcionality enabled?
-            return func_is_enabled
+    def _load(self, name):
+        return self.funcs.get(name)
 
-        if not func_is_enabled:
-            # Avoid additional lookup as the functionality is globally disabled
-            return func_is_enabled
+    def _feature(self, definition):
+        return definition
 
-        flag = self.funcs[name].percentage == 100
-        flag = flag or item in self.reg[name]
-        flag = flag or (name in self.rules and self.rules[name].search(str(item)) is not None)
-        if not flag and self.funcs[name].percentage > 0:
-            try:  # python 3
-                val = bytes(self.funcs[name].get_item_id(item), 'utf-8')
-            except:
-                val = self.funcs[name].get_item_id(item)
-            flag = zlib.crc32(val) % 100 <= self.funcs[name].percentage
-        return flag
+    def _decision_of(self, functionality):
+        """
+        Decision function of a definition returned by `_load`. A definition
+        no longer current (i.e. served stale by a cache) is compiled on its own.
+        """
+        name = functionality.name
+        if self.funcs.get(name) is functionality:
+            return self._decision(name)
+        return _compile_decision(functionality, self.reg.get(name, ()), self.rules.get(name))
+
+    def _evaluate(self, functionality, item=None):
+        if functionality is None:
+            return False
+        return self._decision_of(functionality)(item)
+
+    def _evaluate_many(self, functionality, items):
+        if functionality is None:
+            return [False for _ in items]
+        decision = self._decision_of(functionality)
+        return [decision(item) for item in items]
+
+    def _variant(self, functionality, item):
+        if not self._evaluate(functionality, item):
+            return None
+        return _variant_of(functionality, item)
+
+    def is_enabled(self, name, item=None):
+        decision = self._decisions.get(name)
+        if decision is None:
+            decision = self._decision(name)
+        if decision is _never:
+            # Disabled and unknown functionalities skip the call
+            return False
+        return decision(item)
+
+    def is_enabled_many(self, name, items):
+        decision = self._decision(name)
+        return [decision(item) for item in items]
 
     def disable(self, name):
         self.funcs[name].enabled = False
+        self._decisions.pop(name, None)
 
     def enable(self, name, enable_to_all=False):
         self.funcs[name].enabled = True
         if enable_to_all:
             self.funcs[name].percentage = 100
+        self._decisions.pop(name, None)
 
     def toggle(self, name):
         self.funcs[name].enabled = not self.funcs[name].enabled
+        self._decisions.pop(name, None)
 
     def variant(self, name, item):
-        if not self.is_enabled(name, item):
-            return None
-        f = self.get_functionality(name)
-        try:  # python 3
-            item = bytes(item, 'utf-8')
-        except:
-            pass
+        return self._variant(self._load(name), item)
 
-        return f.variants[zlib.crc32(item) % len(f.variants)]
+    def evaluate_all(self, item):
+        """
+        Evaluate every functionality for `item`.
+        @return: dict functionality name -> (enabled, variant)
+        """
+        bucket = _bucket(str(item))
+        result = {}
+        for name, functionality in self.funcs.items():
+            enabled = self._decision(name)(item, bucket)
+            result[name] = (enabled, _variant_of(functionality, item) if enabled else None)
+        return result
 
 
 class RedisAbstractBackEnd(object):
@@ -152,7 +546,20 @@ class RedisAbstractBackEnd(object):
 
     PREFIX = "h:{0}"
 
-    def __init__(self, obj=None):
+    # SET holding every functionality name. It lives outside the `PREFIX`
+    # namespace so it never collides with a functionality key
+    REGISTRY_KEY = "hanoi:functionalities"
+
+    # PUBSUB channel where the name of every modified functionality is published
+    CHANNEL = "hanoi:changes"
+
+    # HASH per functionality holding its rules (pattern -> flags)
+    RULES_PREFIX = "hanoi:rules:{0}"
+
+    # HASH holding the rules version of every functionality (name -> version)
+    RULES_VERSIONS_KEY = "hanoi:rules"
+
+    def __init__(self, obj=None, channel=CHANNEL):
         if obj is None:
             self._redis = Redis()
         elif isinstance(obj, (list, tuple)):
@@ -164,26 +571,223 @@ class RedisAbstractBackEnd(object):
 
         self._prefix_len = len(self.PREFIX.format(''))
 
-        # TODO: rules should be stored in REDIS as well
+        # None disables the change notifications
+        self.channel = channel
+
+        # Rules are stored in REDIS. Every process keeps them compiled
+        # and rebuilds them only when the functionality rules version changes
         self.rules = {}
+        self._rule_versions = {}
 
     def _get_func_key(self, name):
         return self.PREFIX.format(name)
 
+    def _publish(self, pipe, name):
+        """
+        Notify (as part of the `pipe` execution) that a functionality has changed
+        """
+        if self.channel:
+            pipe.publish(self.channel, name)
+
+    def _functionality_names(self):
+        return [x.decode('utf-8') for x in self._redis.smembers(self.REGISTRY_KEY)]
+
+    def get_functionalities_page(self, cursor=0, count=1000):
+        """
+        Page through the functionalities registry with SSCAN, so REDIS is
+        never blocked by a registry with thousands of names.
+        @param cursor: 0 to start, then the cursor returned by the previous page
+        @param count: amount of names requested to REDIS per page
+        @return: (next cursor, names). The iteration is finished when the cursor is 0.
+                 As SCAN, a name could be returned more than once.
+        """
+        cursor, names = self._redis.sscan(self.REGISTRY_KEY, cursor, count=count)
+        return cursor, [x.decode('utf-8') for x in names]
+
+    def migrate_registry(self, count=1000):
+        """
+        Populate the functionalities registry from an existing keyspace.
+        It iterates the keyspace using SCAN, so it can be executed online
+        without blocking REDIS, and it's safe to run it more than once.
+        @param count: amount of keys requested to REDIS per SCAN iteration
+        @return: number of functionalities found
+        """
+        found = 0
+        batch = []
+        keys = self._redis.scan_iter(match=self._get_func_key('*'), count=count)
+        for key in keys:
+            batch.append(key)
+            if len(batch) >= count:
+                found += self._register_keys(batch)
+                batch = []
+        if batch:
+            found += self._register_keys(batch)
+        return found
+
+    def _register_keys(self, keys):
+        pipe = self._redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.type(key)
+        types = pipe.execute()
+
+        # Only STRING keys hold a functionality definition
+        names = [
+            key[self._prefix_len:] for key, _type in zip(keys, types)
+            if _type in (b'string', 'string')
+        ]
+        if names:
+            self._redis.sadd(self.REGISTRY_KEY, *names)
+        return len(names)
+
+    def _get_rules_key(self, name):
+        return self.RULES_PREFIX.format(name)
+
+    def set_rule(self, name, rule):
+        pipe = self._redis.pipeline()
+        pipe.hset(self._get_rules_key(name), rule.pattern, rule.flags)
+        pipe.hincrby(self.RULES_VERSIONS_KEY, name, 1)
+        self._publish(pipe, name)
+        pipe.execute()
+
+    def remove_rule(self, name, rule):
+        pipe = self._redis.pipeline()
+        pipe.hdel(self._get_rules_key(name), rule.pattern)
+        pipe.hincrby(self.RULES_VERSIONS_KEY, name, 1)
+        self._publish(pipe, name)
+        pipe.execute()
+
+    def _remove_rules(self, pipe, name):
+        # The version is increased instead of deleted, so a process holding
+        # the previous rules never mistakes them for the ones created later
+        pipe.delete(self._get_rules_key(name))
+        pipe.hincrby(self.RULES_VERSIONS_KEY, name, 1)
+
+    def get_rules(self, name):
+        self._sync_rules(name, self._redis.hget(self.RULES_VERSIONS_KEY, name))
+        return list(self.rules.get(name, ()))
+
+    def _sync_rules(self, name, version):
+        """
+        Compile the rules of `name` if `version` (as read from REDIS)
+        differs from the version compiled by this process
+        """
+        version = int(version) if version else 0
+        if self._rule_versions.get(name, 0) != version:
+            self._compile_rules(name, version, self._redis.hgetall(self._get_rules_key(name)))
+
+    def _compile_rules(self, name, version, patterns):
+        """
+        Store the rules of `name` from `patterns` (as read from REDIS, pattern -> flags)
+        """
+        rules = RuleSet(
+            re.compile(pattern.decode('utf-8'), int(flags))
+            for pattern, flags in patterns.items()
+        )
+        if rules:
+            self.rules[name] = rules
+        else:
+            self.rules.pop(name, None)
+        self._rule_versions[name] = version
+
+    def _get_functionality(self, name):
+        """
+        Fetch the functionality definition, to be updated
+        """
+        return self._editable(self._definition(name, self._redis.get(self._get_func_key(name))))
+
+    def _load(self, name):
+        """
+        Fetch the functionality definition and its rules version in a single round trip
+        """
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.get(self._get_func_key(name))
+        pipe.hget(self.RULES_VERSIONS_KEY, name)
+        value, version = pipe.execute()
+        self._sync_rules(name, version)
+        return self._definition(name, value)
+
+    def is_enabled(self, name, item=None):
+        return self._evaluate(self._load(name), item)
+
+    def is_enabled_many(self, name, items):
+        """
+        Check a functionality for a list of items fetching the functionality once
+        """
+        return self._evaluate_many(self._load(name), items)
+
+    def variant(self, name, item):
+        return self._variant(self._load(name), item)
+
+    def _variant(self, definition, item):
+        if not self._evaluate(definition, item):
+            return None
+        return _variant_of(self._feature(definition), item)
+
+    def _matches_rule(self, name, item):
+        rules = self.rules.get(name)
+        return rules is not None and rules.match(str(item))
+
+    def _is_enabled_locally(self, functionality, item, bucket=None):
+        """
+        Evaluate the checks that do not require a REDIS lookup (percentage and rule).
+        `bucket`, if provided, is the percentage bucket of `str(item)`
+        """
+        flag = functionality.percentage == 100
+        flag = flag or self._matches_rule(functionality.name, item)
+        if not flag and functionality.percentage > 0:
+            if bucket is None or functionality.field is not None:
+                bucket = _bucket(functionality.get_item_id(item))
+            flag = bucket <= functionality.percentage
+        return flag
+
+    def _load_all(self):
+        """
+        Fetch every functionality definition: one round trip to read
+        the registry and another one to read the definitions
+        """
+        names = self._functionality_names()
+        if not names:
+            return []
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.mget([self._get_func_key(name) for name in names])
+        pipe.hgetall(self.RULES_VERSIONS_KEY)
+        values, versions = pipe.execute()
+        for name in names:
+            self._sync_rules(name, versions.get(name.encode('utf-8')))
+        return [
+            self._definition(name, value)
+            for name, value in zip(names, values) if value is not None
+        ]
+
+    @staticmethod
+    def _variants_of(functionalities, enabled, item):
+        result = {}
+        for functionality, flag in zip(functionalities, enabled):
+            result[functionality.name] = (flag, _variant_of(functionality, item) if flag else None)
+        return result
+
 
 class RedisBackEnd(RedisAbstractBackEnd):
     """
     Implements a BackEnd using REDIS as system storage.
     - It creates a new key per functionality that should be stored.
 
-    - To retrieve the list of functionalities, it searches Redis DB using KEYS.
-        Take this into account as it might create a performance issue if the amount
-        of functionalities is huge: http://redis.io/commands/keys
+    - Every functionality name is stored in a registry SET (`REGISTRY_KEY`),
+        maintained on `add_functionality`, so listing functionalities never
+        requires KEYS. Databases created before the registry existed can be
+        upgraded in place with `migrate_registry`.
 
     - Specific functionality information (percentage, users) is stored using a String.
         Users could be stored via SET, but it would imply a O(N) operation to retrieve
         all the users.
 
+    - Users are the last field of the String, so whitelisting an item is an atomic
+        APPEND (O(1)) done by a Lua script. An item whitelisted twice is stored twice
+        until the String is rewritten: duplicates are ignored when reading it, and
+        dropped by the next transaction.
+        Any other update is a REDIS transaction (WATCH), retried if an item
+        was appended meanwhile.
+
     Another approach to store the information:
     - serialize the functionality names, percentage in a String (to avoid using KEYS `pattern`)
     - store the users in a SET and warn about retrieving every user. We might even deprecate the
@@ -191,11 +795,44 @@ class RedisBackEnd(RedisAbstractBackEnd):
     for a specific user.
     """
 
+    # KEYS: functionality STRING
+    # ARGV: encoded items, encoding version, channel ('' to not publish), name
+    # Returns 1 if appended, 0 if the String is not encoded (legacy format), -1 if not defined
+    LUA_APPEND = """
+local head = redis.call('GETRANGE', KEYS[1], 0, 0)
+if head == '' then
+    return -1
+end
+if string.byte(head) ~= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('APPEND', KEYS[1], ARGV[1])
+if ARGV[3] ~= '' then
+    redis.call('PUBLISH', ARGV[3], ARGV[4])
+end
+return 1
+"""
+
+    # Bytes read (GETRANGE) to know the functionality field before appending an item
+    HEAD_SIZE = 512
+
+    def __init__(self, obj=None, channel=RedisAbstractBackEnd.CHANNEL):
+        super(RedisBackEnd, self).__init__(obj, channel)
+        self._append_script = self._redis.register_script(self.LUA_APPEND)
+
     @classmethod
     def unserialize_feature(cls, name, value):
+        """
+        Return (Feature, users) from a stored value, encoded or in the legacy format
+        """
+        if is_encoded(value):
+            reader = FeatureReader(name, value)
+            return reader.to_feature(), reader.users
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
         if value:
             enabled, percentage, field, users, variants = value.split("|")
-            variants = variants.split(',') or None
+            variants = _unserialize_variants(variants)
         else:
             percentage = 100
             users = field = variants = None
@@ -206,68 +843,172 @@ class RedisBackEnd(RedisAbstractBackEnd):
 
         return f, users.split(",") if users else []
 
+    @classmethod
+    def serialize_feature(cls, fn, users=None):
+        return encode(fn.enabled, fn.percentage, fn.field, fn.variants, fn.weights, users)
+
     def get_functionalities(self):
-        func = self._redis.keys(self._get_func_key('*'))  # HACK: get every functionality
-        return [x[self._prefix_len:].decode('utf-8') for x in func]
+        return self._functionality_names()
 
     def add_functionality(self, fn, users=None):
-        fn_info = ['1' if fn.enabled else '0',
-            str(fn.percentage),
-            fn.field or '',
-            ','.join(users) if users is not None else ''
-        ]
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.set(self._get_func_key(fn.name), self.serialize_feature(fn, users))
+        pipe.sadd(self.REGISTRY_KEY, fn.name)
+        self._publish(pipe, fn.name)
+        pipe.execute()
+
+    def _definition(self, name, redis_value):
+        if not redis_value:
+            return None, []
+        if is_encoded(redis_value):
+            reader = FeatureReader(name, redis_value)
+            return reader, frozenset(reader.users)
+        return self.unserialize_feature(name, redis_value)
+
+    def _editable(self, definition):
+        functionality, users = definition
+        if isinstance(functionality, FeatureReader):
+            # Keep the order, dropping the duplicates
+            return functionality.to_feature(), list(OrderedDict.fromkeys(functionality.users))
+        return functionality, list(users)
+
+    def _transaction(self, name, update):
+        """
+        Read the functionality, apply `update(func, users)` and write it back
+        if `update` returns True, in a REDIS transaction
+        """
+        key = self._get_func_key(name)
 
-        if fn.variants is not None:
-            var_info = ','.join(fn.variants)
-            fn_info.append(var_info)
-        else:
-            fn_info.append('')
+        def execute(pipe):
+            func, users = self._editable(self._definition(name, pipe.get(key)))
+            if update(func, users):
+                pipe.multi()
+                pipe.set(key, self.serialize_feature(func, users))
+                self._publish(pipe, name)
 
-        self._redis.set(
-            self._get_func_key(fn.name),
-            "|".join(fn_info)
-        )
+        self._redis.transaction(execute, key)
 
-    def _get_functionality(self, name):
-        redis_value = self._redis.get(self._get_func_key(name))
-        if redis_value:
-            return self.unserialize_feature(name, redis_value.decode('utf-8'))
-        else:
-            return None, []
+    def _append_args(self, name, item_ids):
+        # Items repeated within the chunk are appended once
+        return [encode_users(list(OrderedDict.fromkeys(item_ids))), VERSION,
+                self.channel or '', name]
 
     def get_functionality(self, name):
         return self._get_functionality(name)[0]
 
+    def _head(self, name):
+        """
+        Fetch the beginning of the functionality, enough to know its field
+        without reading its users. None if it's not encoded or not defined.
+        """
+        head = self._redis.getrange(self._get_func_key(name), 0, self.HEAD_SIZE - 1)
+        if is_encoded(head):
+            reader = FeatureReader(name, head)
+            if reader.has_field():
+                return reader
+        return None
+
     def _add(self, name, item):
-        func, users = self._get_functionality(name)
-        if func:
-            if item not in users:
-                users.append(func.get_item_id(item))
-                self.add_functionality(func, users)
-            else:
-                pass  # Avoid duplicating users
-        else:
+        head = self._head(name)
+        if head is not None:
+            item_id = head.get_item_id(item)
+            key = self._get_func_key(name)
+            appended = self._append_script(keys=[key], args=self._append_args(name, [item_id]))
+            if appended == 1:
+                return
+        added = []
+
+        def update(func, users):
+            if not func:
+                return False
+            added.append(True)
+            return _append_new(users, func.get_item_id(item))
+        # Legacy format (rewritten encoded) or removed meanwhile
+        self._transaction(name, update)
+        if not added:
             # Functionality does not exist
             raise ValueError("Functionality <%s> does not exist" % name)
 
     def add(self, name, item):
         self._add(name, item)
 
-    def set_rule(self, name, rule):
-        self.rules[name] = rule
+    def iter_whitelist(self, name, chunk_size=CHUNK_SIZE):
+        # Every user is stored in the functionality STRING
+        return _batches(self._get_functionality(name)[1], chunk_size)
+
+    def _appendable(self, name):
+        """
+        Return the beginning of the functionality, rewriting it encoded if needed
+        """
+        head = self._head(name)
+        if head is None:
+            if not self._get_functionality(name)[0]:
+                raise ValueError("Functionality <%s> does not exist" % name)
+            self._transaction(name, lambda func, users: func is not None)
+            head = self._head(name)
+        return head
+
+    def add_many(self, name, items, chunk_size=CHUNK_SIZE, progress=None):
+        """
+        Whitelist every item in `items`, any iterable, with an APPEND
+        per `chunk_size` items. See `MemoryBackEnd.add_many`
+        """
+        head = self._appendable(name)
+        count = 0
+        for batch in _batches(items, chunk_size):
+            self._add_ids(name, [head.get_item_id(item) for item in batch])
+            count += len(batch)
+            if progress is not None:
+                progress(count)
+        return count
+
+    def _add_ids(self, name, ids):
+        """
+        Whitelist the identifiers `ids` as stored with a single APPEND.
+        See `MemoryBackEnd._add_ids`
+        """
+        key = self._get_func_key(name)
+        appended = self._append_script(keys=[key], args=self._append_args(name, ids))
+        if appended == 0:
+            # Legacy format, rewritten encoded
+            self._appendable(name)
+            appended = self._append_script(keys=[key], args=self._append_args(name, ids))
+        if appended != 1:
+            raise ValueError("Functionality <%s> does not exist" % name)
+
+    def remove(self, name, item):
+        def update(func, users):
+            if func:
+                item_id = func.get_item_id(item)
+                if item_id in users:
+                    users.remove(item_id)
+                    return True
+            return False
+        self._transaction(name, update)
+
+    def remove_functionality(self, name):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.delete(self._get_func_key(name))
+        pipe.srem(self.REGISTRY_KEY, name)
+        self._remove_rules(pipe, name)
+        self._publish(pipe, name)
+        pipe.execute()
 
     def set_percentage(self, name, percentage):
-        func, users = self._get_functionality(name)
-        func.percentage = percentage
-        self.add_functionality(func, users)
+        def update(func, users):
+            func.percentage = percentage
+            return True
+        self._transaction(name, update)
 
-    def is_enabled(self, name, item=None):
-        func_is_enabled = name in self.get_functionalities()
-        if not func_is_enabled:
+    def _feature(self, definition):
+        return definition[0]
+
+    def _evaluate(self, definition, item=None):
+        functionality, users = definition
+        if not functionality:
             # Stop if functionality not even exist
             return False
 
-        functionality, users = self._get_functionality(name)
         func_is_enabled = functionality.enabled
 
         if item is None:
@@ -278,44 +1019,59 @@ class RedisBackEnd(RedisAbstractBackEnd):
             # Avoid additional lookup as the functionality is globally disabled
             return func_is_enabled
 
-        flag = functionality.percentage == 100
-        flag = flag or functionality.get_item_id(item) in users
-        flag = flag or (name in self.rules and self.rules[name].search(str(item)) is not None)
-        if not flag and functionality.percentage > 0:
-            try:  # python 3
-                item = bytes(item, 'utf-8')
-            except:
-                pass
-            flag = zlib.crc32(item) % 100 <= functionality.percentage
-        return flag
+        return (
+            functionality.get_item_id(item) in users or
+            self._is_enabled_locally(functionality, item)
+        )
+
+    def _evaluate_many(self, definition, items):
+        items = list(items)
+        functionality, users = definition
+        if not functionality or not functionality.enabled:
+            return [False] * len(items)
+
+        users = set(users)
+        return [
+            functionality.get_item_id(item) in users or
+            self._is_enabled_locally(functionality, item)
+            for item in items
+        ]
 
     def disable(self, name):
-        func, users = self._get_functionality(name)
-        func.enabled = False
-        self.add_functionality(func, users)
+        def update(func, users):
+            func.enabled = False
+            return True
+        self._transaction(name, update)
 
     def enable(self, name, enable_to_all=False):
-        func, users = self._get_functionality(name)
-        func.enabled = True
-        if enable_to_all:
-            func.percentage = 100
-        self.add_functionality(func, users)
+        def update(func, users):
+            func.enabled = True
+            if enable_to_all:
+                func.percentage = 100
+            return True
+        self._transaction(name, update)
 
     def toggle(self, name):
-        func, users = self._get_functionality(name)
-        func.enabled = not func.enabled
-        self.add_functionality(func, users)
-
-    def variant(self, name, item):
-        if not self.is_enabled(name, item):
-            return None
-        f, _ = self._get_functionality(name)
-        try:  # python 3
-            item = bytes(item, "utf-8")
-        except:
-            pass
+        def update(func, users):
+            func.enabled = not func.enabled
+            return True
+        self._transaction(name, update)
 
-        return f.variants[zlib.crc32(item) % len(f.variants)]
+    def evaluate_all(self, item):
+        """
+        Evaluate every functionality for `item` in two round trips.
+        @return: dict functionality name -> (enabled, variant)
+        """
+        bucket = _bucket(str(item))
+        definitions = self._load_all()
+        enabled = [
+            functionality.enabled and (
+                functionality.get_item_id(item) in users or
+                self._is_enabled_locally(functionality, item, bucket)
+            )
+            for functionality, users in definitions
+        ]
+        return self._variants_of([f for f, _ in definitions], enabled, item)
 
 
 class RedisHighPerfBackEnd(RedisAbstractBackEnd):
@@ -326,21 +1082,149 @@ class RedisHighPerfBackEnd(RedisAbstractBackEnd):
           information (enabled, field, percentage)
         - It will use a SET with the `whitelisted` identifiers
 
-    - get_functionalities is not implemented
+    - Every functionality name is kept in the registry SET (`REGISTRY_KEY`),
+      that get_functionalities iterates with SSCAN
+
+    - With `lua=True`, checking a functionality for an item (`is_enabled`, `variant`)
+      is evaluated in REDIS by a Lua script in a single round trip. The bucket and the
+      rule are computed in the client, so it applies only to items used directly as
+      identifier (strings and numbers); any other item is checked as usual.
+
+    - With `use_bloom`, a functionality keeps a Bloom filter of its whitelist in the
+      process memory, so users not whitelisted are discarded without a SISMEMBER.
+      Every change of a whitelist increases its version (`WHITELIST_VERSIONS_KEY`),
+      fetched along with the functionality to know if the filter is current.
 
     Use this implementation for better performance.
     """
 
     SET_PREFIX = 'h:users:{0}'
 
+    # Functionality name -> version of its whitelist
+    WHITELIST_VERSIONS_KEY = "hanoi:whitelists"
+
+    # Minimum capacity of the Bloom filters sized by default
+    BLOOM_MIN_CAPACITY = 1024
+
+    # KEYS: functionality STRING, whitelist SET, rules versions HASH
+    # ARGV: item id, percentage bucket, rule matched ('1'/'0'), variant hash, name
+    # Returns {reason (see `hanoi.api.Decision`), variant or nil, rules version or nil}
+    LUA_CHECK = """
+local version = redis.call('HGET', KEYS[3], ARGV[5])
+local value = redis.call('GET', KEYS[1])
+if not value then
+    return {'undefined', false, version}
+end
+local enabled, percentage
+local variants = {}
+local weights = nil
+if string.byte(value, 1) == 1 then
+    -- hanoi.encoding (version 1)
+    local flags = string.byte(value, 2)
+    enabled = flags % 2 == 1
+    percentage = string.byte(value, 3)
+    local f1, f2, v1, v2, v3, v4 = string.byte(value, 4, 9)
+    local position = 10 + f1 * 256 + f2
+    local last = position + ((v1 * 256 + v2) * 256 + v3) * 256 + v4 - 1
+    if math.floor(flags / 8) % 2 == 1 then
+        weights = {}
+    end
+    while position <= last do
+        local l1, l2 = string.byte(value, position, position + 1)
+        local length = l1 * 256 + l2
+        variants[#variants + 1] = string.sub(value, position + 2, position + 1 + length)
+        position = position + 2 + length
+        if weights then
+            local w1, w2, w3, w4 = string.byte(value, position, position + 3)
+            weights[#variants] = ((w1 * 256 + w2) * 256 + w3) * 256 + w4
+            position = position + 4
+        end
+    end
+else
+    -- Legacy format: enabled|percentage|field|variants
+    local info = {}
+    for field in string.gmatch(value .. '|', '([^|]*)|') do
+        info[#info + 1] = field
+    end
+    enabled = info[1] == '1'
+    percentage = tonumber(info[2])
+    local names = {}
+    weights = {}
+    for entry in string.gmatch(info[4] or '', '([^,]+)') do
+        local name, weight = string.match(entry, '^(.*):(%d+)$')
+        variants[#variants + 1] = entry
+        if name then
+            names[#names + 1] = name
+            weights[#names] = tonumber(weight)
+        end
+    end
+    if #names == #variants and #names > 0 then
+        variants = names
+    else
+        weights = nil
+    end
+end
+if not enabled then
+    return {'disabled', false, version}
+end
+local flag = percentage == 100 or ARGV[3] == '1'
+if not flag and percentage > 0 then
+    flag = tonumber(ARGV[2]) <= percentage
+end
+if not flag then
+    flag = redis.call('SISMEMBER', KEYS[2], ARGV[1]) == 1
+end
+if not flag then
+    return {'not_matched', false, version}
+end
+if #variants == 0 then
+    return {'matched', false, version}
+end
+if not weights then
+    -- Same weight for every variant
+    return {'matched', variants[(tonumber(ARGV[4]) % #variants) + 1], version}
+end
+local total = 0
+for i = 1, #weights do
+    total = total + weights[i]
+end
+-- Same contiguous ranges than the allocation table, over VARIANT_BUCKETS (10000)
+local bucket = tonumber(ARGV[4]) % 10000
+local cumulative = 0
+for i, variant in ipairs(variants) do
+    cumulative = cumulative + weights[i]
+    if bucket < math.floor(cumulative * 10000 / total) then
+        return {'matched', variant, version}
+    end
+end
+"""
+
+    def __init__(self, obj=None, channel=RedisAbstractBackEnd.CHANNEL, lua=False):
+        super(RedisHighPerfBackEnd, self).__init__(obj, channel)
+        # `register_script` loads the script once (EVALSHA) and reloads it on NOSCRIPT
+        self._check_script = self._redis.register_script(self.LUA_CHECK) if lua else None
+
+        # Functionality name -> BloomFilter of its whitelist, trusted to discard users
+        self.blooms = {}
+        self._bloom_settings = {}
+        self._bloom_versions = {}
+        # Users whitelisted (by this process) while a filter is being built
+        self._bloom_pending = {}
+        self._bloom_lock = threading.Lock()
+
     @classmethod
     def unserialize_feature(cls, name, value):
         """
         Destructure Feature information from the serialized format
+        (encoded or legacy)
         """
+        if is_encoded(value):
+            return FeatureReader(name, value).to_feature()
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
         if value:
             enabled, percentage, field, variants = value.split("|")
-            variants = variants.split(',') or None
+            variants = _unserialize_variants(variants)
         else:
             enabled = '1'
             percentage = 100
@@ -351,36 +1235,72 @@ class RedisHighPerfBackEnd(RedisAbstractBackEnd):
 
         return f
 
-    def get_functionalities(self):
-        raise NotImplementedError('get_functionalities unavailable in RedisHighPerfBackEnd')
+    @classmethod
+    def serialize_feature(cls, fn):
+        return encode(fn.enabled, fn.percentage, fn.field, fn.variants, fn.weights)
 
-    def add_functionality(self, fn, users=None):
-        fn_info = ['1' if fn.enabled else '0', str(fn.percentage), fn.field or '']
-
-        if fn.variants is not None:
-            # Every variant should include a name and (optionally) a percentage
-            # Missing percentage dictates same weight for every variant
-            # TODO: define percentages. Currently they're by default equally distributed
-            #default_weight = str(100 / len(fn.variants))
-            #var_info = ','.join([v + '-' + default_weight for v in fn.variants])
-            var_info = ','.join(fn.variants)
-            fn_info.append(var_info)
-        else:
-            fn_info.append('')
+    def get_functionalities(self, count=1000):
+        """
+        Every functionality name, fetched `count` names per page
+        """
+        names = []
+        seen = set()
+        cursor = None
+        while cursor != 0:
+            cursor, page = self.get_functionalities_page(cursor or 0, count)
+            for name in page:
+                if name not in seen:
+                    seen.add(name)
+                    names.append(name)
+        return names
+
+    def _details(self, names, values):
+        details = OrderedDict()
+        for name, value, size in zip(names, values[::2], values[1::2]):
+            if value:
+                # Removed meanwhile otherwise
+                details[name] = (self.unserialize_feature(name, value), size)
+        return details
+
+    def _details_pipeline(self, names):
+        pipe = self._redis.pipeline(transaction=False)
+        for name in names:
+            pipe.get(self._get_func_key(name))
+            pipe.scard(self.SET_PREFIX.format(name))
+        return pipe
+
+    def get_functionalities_detail(self, names=None, count=1000):
+        """
+        Fetch the definition and the whitelist size of every functionality
+        (or just `names`) in a single pipeline
+        @return: OrderedDict name -> (Feature, amount of whitelisted users)
+        """
+        if names is None:
+            names = self.get_functionalities(count)
+        names = list(names)
+        return self._details(names, self._details_pipeline(names).execute())
 
-        self._redis.set(
-            self._get_func_key(fn.name),
-            "|".join(fn_info)
-        )
+    def add_functionality(self, fn, users=None):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.set(self._get_func_key(fn.name), self.serialize_feature(fn))
+        pipe.sadd(self.REGISTRY_KEY, fn.name)
         if users:
-            self._redis.sadd(self.SET_PREFIX.format(fn.name), *users)
+            pipe.sadd(self.SET_PREFIX.format(fn.name), *users)
+            pipe.hincrby(self.WHITELIST_VERSIONS_KEY, fn.name, 1)
+        self._publish(pipe, fn.name)
+        result = pipe.execute()
+        if users:
+            self._bloom_update(fn.name, users, result[3])
 
-    def _get_functionality(self, name):
-        redis_value = self._redis.get(self._get_func_key(name))
-        if redis_value:
-            return self.unserialize_feature(name, redis_value.decode('utf-8'))
-        else:
+    def _definition(self, name, redis_value):
+        if not redis_value:
             return None
+        if is_encoded(redis_value):
+            return FeatureReader(name, redis_value)
+        return self.unserialize_feature(name, redis_value)
+
+    def _editable(self, functionality):
+        return _to_feature(functionality)
 
     def get_functionality(self, name):
         return self._get_functionality(name)
@@ -388,23 +1308,110 @@ class RedisHighPerfBackEnd(RedisAbstractBackEnd):
     def add(self, name, item):
         func = self._get_functionality(name)
         if func:
-            self._redis.sadd(
-                self.SET_PREFIX.format(func.name),
-                func.get_item_id(item)
-            )
+            self._add_ids(func.name, [func.get_item_id(item)])
         else:
             raise ValueError("Functionality <%s> does not exist" % name)
 
-    def set_rule(self, name, rule):
-        self.rules[name] = rule
+    def iter_whitelist(self, name, chunk_size=CHUNK_SIZE):
+        """
+        Iterate the whitelist SET with SSCAN, so it's never fetched at once.
+        As SCAN, an item could be returned more than once.
+        """
+        members = self._redis.sscan_iter(self.SET_PREFIX.format(name), count=chunk_size)
+        return _batches((m.decode('utf-8') for m in members), chunk_size)
+
+    def add_many(self, name, items, chunk_size=CHUNK_SIZE, progress=None):
+        """
+        Whitelist every item in `items`, any iterable, with a SADD
+        per `chunk_size` items. See `MemoryBackEnd.add_many`
+        """
+        func = self._get_functionality(name)
+        if not func:
+            raise ValueError("Functionality <%s> does not exist" % name)
+        count = 0
+        for batch in _batches(items, chunk_size):
+            self._add_ids(name, [func.get_item_id(item) for item in batch])
+            count += len(batch)
+            if progress is not None:
+                progress(count)
+        return count
+
+    def _add_ids(self, name, ids):
+        """
+        Whitelist the identifiers `ids` as stored with a single SADD.
+        See `MemoryBackEnd._add_ids`
+        """
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.sadd(self.SET_PREFIX.format(name), *ids)
+        pipe.hincrby(self.WHITELIST_VERSIONS_KEY, name, 1)
+        self._publish(pipe, name)
+        self._bloom_update(name, ids, pipe.execute()[1])
+
+    def remove(self, name, item):
+        func = self._get_functionality(name)
+        if func:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.srem(self.SET_PREFIX.format(func.name), func.get_item_id(item))
+            pipe.hincrby(self.WHITELIST_VERSIONS_KEY, func.name, 1)
+            self._publish(pipe, func.name)
+            # Removed users are kept in the Bloom filter until it's rebuilt
+            self._bloom_update(func.name, (), pipe.execute()[1])
+
+    def remove_functionality(self, name):
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.delete(self._get_func_key(name), self.SET_PREFIX.format(name))
+        # Increased instead of deleted, as the rules version
+        pipe.hincrby(self.WHITELIST_VERSIONS_KEY, name, 1)
+        pipe.srem(self.REGISTRY_KEY, name)
+        self._remove_rules(pipe, name)
+        self._publish(pipe, name)
+        self._bloom_update(name, (), pipe.execute()[1])
 
     def set_percentage(self, name, percentage):
         func = self._get_functionality(name)
         func.percentage = percentage
         self.add_functionality(func)
 
-    def is_enabled(self, name, item=None):
-        functionality = self._get_functionality(name)
+    def _load(self, name):
+        """
+        Fetch the functionality definition and its rules version, along with its
+        whitelist version if a Bloom filter is used, in a single round trip
+        """
+        if name not in self._bloom_settings:
+            return super(RedisHighPerfBackEnd, self)._load(name)
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.get(self._get_func_key(name))
+        pipe.hget(self.RULES_VERSIONS_KEY, name)
+        pipe.hget(self.WHITELIST_VERSIONS_KEY, name)
+        value, version, whitelist_version = pipe.execute()
+        self._sync_rules(name, version)
+        self._sync_bloom(name, whitelist_version)
+        return self._definition(name, value)
+
+    def _load_all(self):
+        if not self._bloom_settings:
+            return super(RedisHighPerfBackEnd, self)._load_all()
+        names = self._functionality_names()
+        if not names:
+            return []
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.mget([self._get_func_key(name) for name in names])
+        pipe.hgetall(self.RULES_VERSIONS_KEY)
+        pipe.hgetall(self.WHITELIST_VERSIONS_KEY)
+        values, versions, whitelist_versions = pipe.execute()
+        for name in names:
+            self._sync_rules(name, versions.get(name.encode('utf-8')))
+        for name in list(self._bloom_settings):
+            self._sync_bloom(name, whitelist_versions.get(name.encode('utf-8')))
+        return [
+            self._definition(name, value)
+            for name, value in zip(names, values) if value is not None
+        ]
+
+    def _feature(self, definition):
+        return definition
+
+    def _evaluate(self, functionality, item=None):
         if not functionality:
             # Stop if functionality not even exist
             return False
@@ -419,22 +1426,227 @@ class RedisHighPerfBackEnd(RedisAbstractBackEnd):
             # Avoid additional lookup as the functionality is globally disabled
             return func_is_enabled
 
-        flag = functionality.percentage == 100
-        flag = flag or self._allowed_user(functionality, item)
-        flag = flag or (name in self.rules and self.rules[name].search(str(item)) is not None)
-        if not flag and functionality.percentage > 0:
-            try:  # python 3
-                item = bytes(item, 'utf-8')
-            except:
-                pass
-            flag = zlib.crc32(item) % 100 <= functionality.percentage
-        return flag
+        # Percentage and rule are checked first to avoid the SISMEMBER round trip
+        return (
+            self._is_enabled_locally(functionality, item) or
+            self._allowed_user(functionality, item)
+        )
+
+    def _check(self, name, item):
+        """
+        Evaluate in REDIS the functionality `name` for `item`.
+        The rule is matched in the client; if its rules turn out to be outdated,
+        they're compiled again and the check repeated.
+        Return a tuple (reason, variant), reason being one of the `Decision` reasons
+        """
+        item_id = str(item)
+        keys = [self._get_func_key(name), self.SET_PREFIX.format(name), self.RULES_VERSIONS_KEY]
+        args = [item_id, _bucket(item_id), None, _crc32(item_id), name]
+        for _ in range(2):
+            args[2] = '1' if self._matches_rule(name, item) else '0'
+            reason, variant, version = self._check_script(keys=keys, args=args)
+            if int(version or 0) == self._rule_versions.get(name, 0):
+                break
+            self._sync_rules(name, version)
+        if isinstance(variant, bytes):
+            variant = variant.decode('utf-8')
+        return reason.decode('utf-8'), variant
+
+    def _scriptable(self, item):
+        return self._check_script is not None and isinstance(item, _string_types + (int,))
+
+    def _decide(self, name, item):
+        """
+        Used by `Rollout.decide`: evaluate `name` for `item` with the Lua check.
+        Return a tuple (reason, variant), or None if `item` is checked as usual
+        """
+        if self._scriptable(item):
+            return self._check(name, item)
+        return None
+
+    def is_enabled(self, name, item=None):
+        if self._scriptable(item):
+            return self._check(name, item)[0] == _MATCHED
+        return super(RedisHighPerfBackEnd, self).is_enabled(name, item)
+
+    def variant(self, name, item):
+        if self._scriptable(item):
+            return self._check(name, item)[1]
+        return super(RedisHighPerfBackEnd, self).variant(name, item)
+
+    def use_bloom(self, name, error_rate=0.01, capacity=None):
+        """
+        Keep in the process memory a Bloom filter of the whitelist of `name`, built
+        from the SET (SSCAN), so checking an user not whitelisted does not require
+        a SISMEMBER; only possible hits (and `error_rate` of the rest) go to REDIS.
+        Users whitelisted through this object are added to the filter. Once another
+        process modifies the whitelist (its version differs), the filter is rebuilt
+        in background and the whitelist is checked in REDIS meanwhile.
+        Users removed from the whitelist are kept in the filter until it's rebuilt.
+        @param capacity: users the filter is sized for. By default, twice the
+                         whitelist size; it's rebuilt in background once exceeded
+        @return: the BloomFilter
+        """
+        with self._bloom_lock:
+            self._bloom_settings[name] = (error_rate, capacity)
+        return self.rebuild_bloom(name)
+
+    def drop_bloom(self, name):
+        """
+        Stop using the Bloom filter of `name`
+        """
+        with self._bloom_lock:
+            self._bloom_settings.pop(name, None)
+            self._bloom_versions.pop(name, None)
+            self.blooms.pop(name, None)
+
+    def rebuild_bloom(self, name, background=False):
+        """
+        Build again the Bloom filter of `name` from its whitelist; the current
+        one (if any) is used meanwhile. A single build per functionality runs at once.
+        @return: the BloomFilter, or the thread building it if `background`
+        """
+        if background:
+            worker = threading.Thread(target=self._build_bloom, args=(name,))
+            worker.daemon = True
+            worker.start()
+            return worker
+        return self._build_bloom(name)
+
+    def _build_bloom(self, name):
+        with self._bloom_lock:
+            settings = self._bloom_settings.get(name)
+            if settings is None or name in self._bloom_pending:
+                # Not used, or already being built
+                return self.blooms.get(name)
+            self._bloom_pending[name] = []
+        key = self.SET_PREFIX.format(name)
+        try:
+            error_rate, capacity = settings
+            # Read before the SSCAN: any change meanwhile makes the filter outdated
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.hget(self.WHITELIST_VERSIONS_KEY, name)
+            pipe.scard(key)
+            version, size = pipe.execute()
+            version = int(version) if version else 0
+            if capacity is None:
+                capacity = max(2 * size, self.BLOOM_MIN_CAPACITY)
+            bloom = BloomFilter(capacity, error_rate)
+            bloom.update(self._redis.sscan_iter(key, count=CHUNK_SIZE))
+            with self._bloom_lock:
+                if name not in self._bloom_settings:
+                    return None
+                # Changes done by this process meanwhile
+                for changed, ids in sorted(self._bloom_pending[name], key=lambda c: c[0]):
+                    bloom.update(ids)
+                    if changed == version + 1:
+                        version = changed
+                self.blooms[name] = bloom
+                self._bloom_versions[name] = version
+                return bloom
+        finally:
+            with self._bloom_lock:
+                self._bloom_pending.pop(name, None)
+
+    def _bloom_update(self, name, ids, version):
+        """
+        Add to the Bloom filter of `name` the identifiers whitelisted by this process,
+        the whitelist being at `version` (as returned by REDIS) after the change
+        """
+        if name not in self._bloom_settings:
+            return
+        rebuild = False
+        with self._bloom_lock:
+            pending = self._bloom_pending.get(name)
+            if pending is not None:
+                pending.append((version, ids))
+            bloom = self.blooms.get(name)
+            if bloom is not None:
+                if self._bloom_versions.get(name) == version - 1:
+                    bloom.update(ids)
+                    self._bloom_versions[name] = version
+                    rebuild = pending is None and len(bloom) > bloom.capacity
+                else:
+                    # Modified by another process meanwhile
+                    del self.blooms[name]
+                    rebuild = pending is None
+        if rebuild:
+            self.rebuild_bloom(name, background=True)
+
+    def _sync_bloom(self, name, version):
+        """
+        Stop using the Bloom filter of `name` if its whitelist `version` (as read
+        from REDIS) is not the one the filter holds, and rebuild it in background
+        """
+        version = int(version) if version else 0
+        if name in self.blooms and self._bloom_versions.get(name) == version:
+            return
+        with self._bloom_lock:
+            if name not in self._bloom_settings:
+                return
+            if name in self.blooms and self._bloom_versions.get(name) == version:
+                return
+            self.blooms.pop(name, None)
+            if name in self._bloom_pending:
+                # Being built
+                return
+        self.rebuild_bloom(name, background=True)
+
+    def _may_be_whitelisted(self, functionality, item):
+        bloom = self.blooms.get(functionality.name)
+        return bloom is None or functionality.get_item_id(item) in bloom
 
     def _allowed_user(self, functionality, user):
-        return self._redis.sismember(
-            self.SET_PREFIX.format(functionality.name),
-            functionality.get_item_id(user)
-        )
+        item_id = functionality.get_item_id(user)
+        bloom = self.blooms.get(functionality.name)
+        if bloom is not None and item_id not in bloom:
+            return False
+        return bool(self._redis.sismember(self.SET_PREFIX.format(functionality.name), item_id))
+
+    def _allowed_users(self, functionality, ids):
+        """
+        Check the whitelist membership of a list of identifiers using
+        SMISMEMBER (REDIS >= 6.2) or a pipeline of SISMEMBER otherwise
+        """
+        bloom = self.blooms.get(functionality.name)
+        if bloom is not None:
+            candidates = [i for i, _id in enumerate(ids) if _id in bloom]
+            result = [False] * len(ids)
+            if candidates:
+                found = self._allowed_users_in_redis(functionality, [ids[i] for i in candidates])
+                for i, flag in zip(candidates, found):
+                    result[i] = flag
+            return result
+        return self._allowed_users_in_redis(functionality, ids)
+
+    def _allowed_users_in_redis(self, functionality, ids):
+        key = self.SET_PREFIX.format(functionality.name)
+        result = []
+        for chunk in _chunks(ids):
+            try:
+                result.extend(self._redis.smismember(key, chunk))
+            except ResponseError:
+                pipe = self._redis.pipeline(transaction=False)
+                for _id in chunk:
+                    pipe.sismember(key, _id)
+                result.extend(pipe.execute())
+        return [bool(x) for x in result]
+
+    def _evaluate_many(self, functionality, items):
+        """
+        Resolve the whitelist membership in a single round trip per chunk
+        """
+        items = list(items)
+        if not functionality or not functionality.enabled:
+            return [False] * len(items)
+
+        result = [self._is_enabled_locally(functionality, item) for item in items]
+        pending = [i for i, flag in enumerate(result) if not flag]
+        if pending:
+            ids = [functionality.get_item_id(items[i]) for i in pending]
+            for i, flag in zip(pending, self._allowed_users(functionality, ids)):
+                result[i] = flag
+        return result
 
     def disable(self, name):
         func = self._get_functionality(name)
@@ -453,13 +1665,27 @@ class RedisHighPerfBackEnd(RedisAbstractBackEnd):
         func.enabled = not func.enabled
         self.add_functionality(func)
 
-    def variant(self, name, item):
-        if not self.is_enabled(name, item):
-            return None
-        f = self._get_functionality(name)
-        try:  # python 3
-            item = bytes(item, "utf-8")
-        except:
-            pass
-
-        return f.variants[zlib.crc32(item) % len(f.variants)]
+    def evaluate_all(self, item):
+        """
+        Evaluate every functionality for `item` in (at most) three round trips:
+        registry, definitions and a pipeline with the required SISMEMBER.
+        @return: dict functionality name -> (enabled, variant)
+        """
+        bucket = _bucket(str(item))
+        functionalities = self._load_all()
+        enabled = [
+            f.enabled and self._is_enabled_locally(f, item, bucket)
+            for f in functionalities
+        ]
+        pending = [
+            i for i, f in enumerate(functionalities)
+            if f.enabled and not enabled[i] and self._may_be_whitelisted(f, item)
+        ]
+        if pending:
+            pipe = self._redis.pipeline(transaction=False)
+            for i in pending:
+                f = functionalities[i]
+                pipe.sismember(self.SET_PREFIX.format(f.name), f.get_item_id(item))
+            for i, flag in zip(pending, pipe.execute()):
+                enabled[i] = bool(flag)
+        return self._variants_of(functionalities, enabled, item)
@@ -0,0 +1,105 @@
+"""
+Streaming export and import of the state of a BackEnd (functionalities,
+rules and whitelists) in JSON Lines, one record per line:
+
+    {"type": "hanoi", "version": 1}
+    {"type": "functionality", "name": "A", "field": null, "percentage": 10, ...}
+    {"type": "rule", "name": "A", "pattern": "01$", "flags": 32}
+    {"type": "users", "name": "A", "users": ["1", "2", ...]}
+
+Whitelists are written and read in chunks (a `users` record per chunk),
+so the memory used does not depend on their size.
+
+    with open('hanoi.jsonl', 'w') as f:
+        hanoi.dump(backend, f)
+
+    with open('hanoi.jsonl') as f:
+        hanoi.load(other_backend, f)
+"""
+import json
+import re
+
+from .backend import CHUNK_SIZE, Feature, _batches
+
+VERSION = 1
+
+
+def _write(fp, record):
+    fp.write(json.dumps(record, sort_keys=True))
+    fp.write('\n')
+
+
+def _functionality_record(fn):
+    return {
+        'type': 'functionality',
+        'name': fn.name,
+        'field': fn.field,
+        'percentage': fn.percentage,
+        'enabled': fn.enabled,
+        'variants': fn.variants,
+        'weights': fn.weights,
+    }
+
+
+def dump(backend, fp, chunk_size=CHUNK_SIZE):
+    """
+    Write every functionality of `backend`, its rules and its whitelist to `fp`
+    @param chunk_size: maximum amount of users per record
+    @return: number of functionalities written
+    """
+    _write(fp, {'type': 'hanoi', 'version': VERSION})
+    count = 0
+    for name in sorted(backend.get_functionalities()):
+        fn = backend.get_functionality(name)
+        if fn is None:
+            # Removed meanwhile
+            continue
+        _write(fp, _functionality_record(fn))
+        for rule in backend.get_rules(name):
+            _write(fp, {'type': 'rule', 'name': name, 'pattern': rule.pattern, 'flags': rule.flags})
+        for users in backend.iter_whitelist(name, chunk_size):
+            _write(fp, {'type': 'users', 'name': name, 'users': users})
+        count += 1
+    return count
+
+
+def _feature(record):
+    variants = record['variants']
+    if variants is not None and record.get('weights') is not None:
+        variants = list(zip(variants, record['weights']))
+    fn = Feature(record['name'], record['field'], record['percentage'], variants)
+    fn.enabled = record['enabled']
+    return fn
+
+
+def load(backend, fp, chunk_size=CHUNK_SIZE):
+    """
+    Restore in `backend` the functionalities written by `dump`. Each one replaces
+    the functionality with the same name (including its rules and whitelist);
+    any other functionality is kept.
+    @return: number of functionalities read
+    """
+    count = 0
+    for number, line in enumerate(fp, 1):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        kind = record.get('type')
+        if kind == 'hanoi':
+            if record.get('version') != VERSION:
+                raise ValueError("Unsupported dump version %s" % record.get('version'))
+        elif kind == 'functionality':
+            fn = _feature(record)
+            backend.remove_functionality(fn.name)
+            backend.add_functionality(fn)
+            count += 1
+        elif kind == 'rule':
+            backend.set_rule(record['name'], re.compile(record['pattern'], record['flags']))
+        elif kind == 'users':
+            # Identifiers as stored, not resolved again
+            for ids in _batches(record['users'], chunk_size):
+                backend._add_ids(record['name'], ids)
+        else:
+            raise ValueError("Unknown record in line %d: %s" % (number, kind))
+    return count
@@ -0,0 +1,79 @@
+import hashlib
+import math
+import struct
+
+_HASHES = struct.Struct('<QQ')
+
+try:
+    _text_type = unicode
+except NameError:
+    # python 3
+    _text_type = str
+
+
+def _hashes(item):
+    """
+    Two independent 64 bits hashes of the identifier `item`
+    """
+    if not isinstance(item, bytes):
+        item = _text_type(item).encode('utf-8')
+    return _HASHES.unpack(hashlib.md5(item).digest())
+
+
+class BloomFilter(object):
+    """
+    Set of identifiers answering "definitely not added" or "possibly added".
+    It's sized for `capacity` identifiers with a false positive rate of
+    `error_rate`; adding more identifiers increases that rate.
+    Identifiers are compared as text, as stored in REDIS.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        if not 0 < error_rate < 1:
+            raise ValueError("error_rate must be between 0 and 1")
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.bits = max(int(math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.bits / float(self.capacity) * math.log(2))), 1)
+        self.count = 0
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def size(self):
+        """
+        Memory used by the bit array, in bytes
+        """
+        return len(self._array)
+
+    @property
+    def false_positive_rate(self):
+        """
+        Expected false positive rate given the identifiers added so far
+        """
+        return (1 - math.exp(-self.hashes * self.count / float(self.bits))) ** self.hashes
+
+    def _positions(self, item):
+        # Double hashing: h1 + i * h2 (Kirsch & Mitzenmacher)
+        h1, h2 = _hashes(item)
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in range(self.hashes)]
+
+    def add(self, item):
+        array = self._array
+        for position in self._positions(item):
+            array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        array = self._array
+        for position in self._positions(item):
+            if not array[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
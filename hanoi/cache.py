@@ -0,0 +1,306 @@
+import threading
+import time
+from collections import OrderedDict
+
+from .backend import CHUNK_SIZE, RedisAbstractBackEnd
+
+_now = getattr(time, 'monotonic', time.time)
+
+
+class _Flight(object):
+    """
+    A fetch in progress. Concurrent misses for the same functionality
+    wait for it instead of issuing their own request to the backend.
+    """
+
+    __slots__ = ['event', 'value', 'error']
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class CachingBackEnd(object):
+    """
+    Wraps any BackEnd caching in the process memory the functionality definitions,
+    including the negative results for functionalities not defined.
+
+    - The cache is bounded to `max_size` functionalities (least recently used are evicted).
+    - An entry is fresh for `ttl` seconds. During the following `stale_ttl` seconds
+      the stale entry is still served while it gets refreshed in background.
+    - Concurrent misses for the same functionality issue a single fetch.
+    - Mutations done through this object invalidate the affected functionality.
+      Mutations done by other processes are visible once the entry expires.
+
+    Whitelist membership is still resolved by the wrapped backend, so checking a
+    whitelisted user in RedisHighPerfBackEnd costs a SISMEMBER.
+
+    rollout = Rollout(CachingBackEnd(RedisHighPerfBackEnd(), ttl=5))
+
+    Use `subscribe` to invalidate the cache as soon as another process
+    modifies a functionality, so a longer `ttl` can be used safely.
+    """
+
+    def __init__(self, backend, max_size=1024, ttl=5, stale_ttl=30):
+        self.backend = backend
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+    def invalidate(self, name=None):
+        """
+        Drop the cached definition for `name`, or every definition if None.
+        Any fetch in progress is discarded too, as it could have read
+        the value previous to the change.
+        """
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+                self._flights.clear()
+            else:
+                self._entries.pop(name, None)
+                self._flights.pop(name, None)
+
+    def subscribe(self, redis=None, channel=None):
+        """
+        Start a `ChangeSubscriber` invalidating this cache. By default it listens
+        to the channel of the wrapped REDIS backend, using its connection.
+        """
+        redis = redis if redis is not None else self.backend._redis
+        channel = channel or self.backend.channel
+        subscriber = ChangeSubscriber(redis, channel)
+        subscriber.attach(self)
+        return subscriber.start(wait=5)
+
+    def _load(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None:
+                definition, expires = entry
+                now = _now()
+                if now < expires + self.stale_ttl:
+                    self.hits += 1
+                    # Keep the LRU order
+                    del self._entries[name]
+                    self._entries[name] = entry
+                    if now >= expires and name not in self._flights:
+                        self._start_refresh(name)
+                    return definition
+            self.misses += 1
+            flight = self._flights.get(name)
+            leader = flight is None
+            if leader:
+                flight = self._flights[name] = _Flight()
+
+        if leader:
+            self._fetch(name, flight)
+        else:
+            flight.event.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _start_refresh(self, name):
+        # Called holding the lock
+        flight = self._flights[name] = _Flight()
+        worker = threading.Thread(target=self._fetch, args=(name, flight))
+        worker.daemon = True
+        worker.start()
+
+    def _fetch(self, name, flight):
+        try:
+            flight.value = self.backend._load(name)
+        except Exception as e:
+            flight.error = e
+
+        with self._lock:
+            if self._flights.get(name) is flight:
+                del self._flights[name]
+                if flight.error is None:
+                    self._store(name, flight.value)
+        flight.event.set()
+
+    def _store(self, name, definition):
+        # Called holding the lock
+        self._entries.pop(name, None)
+        self._entries[name] = (definition, _now() + self.ttl)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    # Read operations
+
+    def _feature(self, definition):
+        return self.backend._feature(definition)
+
+    def _evaluate(self, definition, item=None):
+        return self.backend._evaluate(definition, item)
+
+    def is_enabled(self, name, item=None):
+        return self.backend._evaluate(self._load(name), item)
+
+    def is_enabled_many(self, name, items):
+        return self.backend._evaluate_many(self._load(name), items)
+
+    def variant(self, name, item):
+        return self.backend._variant(self._load(name), item)
+
+    def evaluate_all(self, item):
+        return self.backend.evaluate_all(item)
+
+    def get_functionality(self, name):
+        return self.backend.get_functionality(name)
+
+    def get_functionalities(self):
+        return self.backend.get_functionalities()
+
+    def iter_whitelist(self, name, chunk_size=CHUNK_SIZE):
+        return self.backend.iter_whitelist(name, chunk_size)
+
+    def get_rules(self, name):
+        return self.backend.get_rules(name)
+
+    # Write operations
+
+    def add_functionality(self, fn, *args, **kwargs):
+        self.backend.add_functionality(fn, *args, **kwargs)
+        self.invalidate(fn.name)
+
+    def remove_functionality(self, name):
+        self.backend.remove_functionality(name)
+        self.invalidate(name)
+
+    def add(self, name, item):
+        self.backend.add(name, item)
+        self.invalidate(name)
+
+    def add_many(self, name, items, chunk_size=CHUNK_SIZE, progress=None):
+        try:
+            return self.backend.add_many(name, items, chunk_size, progress)
+        finally:
+            self.invalidate(name)
+
+    def _add_ids(self, name, ids):
+        try:
+            self.backend._add_ids(name, ids)
+        finally:
+            self.invalidate(name)
+
+    def remove(self, name, item):
+        self.backend.remove(name, item)
+        self.invalidate(name)
+
+    def set_rule(self, name, rule):
+        self.backend.set_rule(name, rule)
+        self.invalidate(name)
+
+    def remove_rule(self, name, rule):
+        self.backend.remove_rule(name, rule)
+        self.invalidate(name)
+
+    def set_percentage(self, name, percentage):
+        self.backend.set_percentage(name, percentage)
+        self.invalidate(name)
+
+    def enable(self, name, enable_to_all=False):
+        self.backend.enable(name, enable_to_all)
+        self.invalidate(name)
+
+    def disable(self, name):
+        self.backend.disable(name)
+        self.invalidate(name)
+
+    def toggle(self, name):
+        self.backend.toggle(name)
+        self.invalidate(name)
+
+
+class ChangeSubscriber(object):
+    """
+    Listens in background to the changes published by the REDIS backends
+    and invalidates the affected functionality in every attached cache.
+    While the subscription is not active (i.e. connection lost) notifications
+    might be missed, so every cache is completely invalidated upon (re)subscribing.
+
+    subscriber = ChangeSubscriber(redis_client)
+    subscriber.attach(caching_backend)
+    subscriber.start()
+    """
+
+    def __init__(self, redis, channel=None, retry_interval=1):
+        self._redis = redis
+        self.channel = channel or RedisAbstractBackEnd.CHANNEL
+        self.retry_interval = retry_interval
+        self._caches = []
+        self._running = threading.Event()
+        self._subscribed = threading.Event()
+        self._thread = None
+
+    def attach(self, cache):
+        self._caches.append(cache)
+
+    def detach(self, cache):
+        self._caches.remove(cache)
+
+    @property
+    def subscribed(self):
+        return self._subscribed.is_set()
+
+    def start(self, wait=None):
+        """
+        Start listening in a daemon thread.
+        @param wait: seconds to wait for the subscription to be active
+        """
+        self._running.set()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        if wait is not None:
+            self._subscribed.wait(wait)
+        return self
+
+    def stop(self):
+        self._running.clear()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _invalidate(self, name=None):
+        for cache in list(self._caches):
+            cache.invalidate(name)
+
+    def _run(self):
+        while self._running.is_set():
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self.channel)
+                self._invalidate()
+                self._subscribed.set()
+                while self._running.is_set():
+                    message = pubsub.get_message(timeout=self.retry_interval)
+                    if message and message['type'] == 'message':
+                        name = message['data']
+                        if isinstance(name, bytes):
+                            name = name.decode('utf-8')
+                        self._invalidate(name)
+            except Exception:
+                self._subscribed.clear()
+                time.sleep(self.retry_interval)
+            finally:
+                self._subscribed.clear()
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
@@ -0,0 +1,167 @@
+"""
+Compact binary encoding of the functionalities stored in REDIS:
+
+    header    version (1 byte), flags (1 byte), percentage (1 byte),
+              field length (2 bytes), variants length (4 bytes)
+    field     utf-8
+    variants  length (2 bytes) + utf-8 name [+ weight (4 bytes)] per variant
+    users     length (2 bytes) + utf-8 identifier per user, up to the end
+
+Integers are big endian. Values stored before this encoding existed
+("1|100|field|...") never start with a version byte, so both can be told apart.
+"""
+import struct
+
+VERSION = 1
+
+ENABLED = 0x01
+HAS_FIELD = 0x02
+HAS_VARIANTS = 0x04
+WEIGHTED = 0x08
+
+_HEADER = struct.Struct('!BBBHI')
+_LENGTH = struct.Struct('!H')
+_WEIGHT = struct.Struct('!I')
+
+# Legacy values start with the enabled flag
+_LEGACY = (b'0', b'1')
+
+_MISSING = object()
+
+try:
+    _text_type = unicode
+except NameError:
+    # python 3
+    _text_type = str
+
+
+def _encode_text(value):
+    if isinstance(value, bytes):
+        data = value
+    else:
+        data = _text_type(value).encode('utf-8')
+    if len(data) > 0xFFFF:
+        raise ValueError("Unable to encode values longer than 65535 bytes")
+    return _LENGTH.pack(len(data)) + data
+
+
+def encode_users(users):
+    """
+    Encode a list of identifiers. As users are the last field, the result
+    may be appended to an encoded functionality to whitelist them.
+    """
+    return b''.join(_encode_text(u) for u in users or ())
+
+
+def encode(enabled, percentage, field=None, variants=None, weights=None, users=None):
+    """
+    Encode the information of a functionality (and optionally its whitelist)
+    @return: bytes
+    """
+    flags = ENABLED if enabled else 0
+    field_data = b''
+    if field is not None:
+        flags |= HAS_FIELD
+        field_data = field.encode('utf-8')
+        if len(field_data) > 0xFFFF:
+            raise ValueError("Unable to encode a field longer than 65535 bytes")
+
+    variants_data = b''
+    if variants is not None:
+        flags |= HAS_VARIANTS
+        if weights is None:
+            variants_data = b''.join(_encode_text(v) for v in variants)
+        else:
+            flags |= WEIGHTED
+            variants_data = b''.join(
+                _encode_text(v) + _WEIGHT.pack(w) for v, w in zip(variants, weights)
+            )
+
+    users_data = encode_users(users)
+    header = _HEADER.pack(VERSION, flags, int(percentage), len(field_data), len(variants_data))
+    return b''.join((header, field_data, variants_data, users_data))
+
+
+def is_encoded(value):
+    """
+    Check if a stored value uses this encoding (and not the legacy string format)
+    """
+    return isinstance(value, bytes) and bool(value) and value[:1] not in _LEGACY
+
+
+class Record(object):
+    """
+    Read-only view of an encoded functionality. The header is decoded upon
+    creation; field, variants and users are decoded upon first access.
+    """
+
+    __slots__ = ['enabled', 'percentage', '_value', '_flags', '_field_end',
+                 '_variants_end', '_field', '_variants', '_weights', '_users']
+
+    def __init__(self, value):
+        version, flags, percentage, field_length, variants_length = _HEADER.unpack_from(value)
+        if version != VERSION:
+            raise ValueError("Unsupported encoding version %d" % version)
+        self.enabled = bool(flags & ENABLED)
+        self.percentage = percentage
+        self._value = value
+        self._flags = flags
+        self._field_end = _HEADER.size + field_length
+        self._variants_end = self._field_end + variants_length
+        self._field = self._variants = self._weights = self._users = _MISSING
+
+    def has_field(self):
+        """
+        Check if the value includes the whole field, as it could be just
+        the beginning of an encoded functionality
+        """
+        return len(self._value) >= self._field_end
+
+    def _decode_list(self, start, end, weighted=False):
+        value = self._value
+        items = []
+        weights = []
+        while start < end:
+            length, = _LENGTH.unpack_from(value, start)
+            start += _LENGTH.size
+            items.append(value[start:start + length].decode('utf-8'))
+            start += length
+            if weighted:
+                weights.append(_WEIGHT.unpack_from(value, start)[0])
+                start += _WEIGHT.size
+        return items, weights
+
+    @property
+    def field(self):
+        if self._field is _MISSING:
+            if self._flags & HAS_FIELD:
+                self._field = self._value[_HEADER.size:self._field_end].decode('utf-8')
+            else:
+                self._field = None
+        return self._field
+
+    def _decode_variants(self):
+        if self._flags & HAS_VARIANTS:
+            weighted = bool(self._flags & WEIGHTED)
+            variants, weights = self._decode_list(self._field_end, self._variants_end, weighted)
+            self._variants, self._weights = variants, weights if weighted else None
+        else:
+            self._variants = self._weights = None
+
+    @property
+    def variants(self):
+        if self._variants is _MISSING:
+            self._decode_variants()
+        return self._variants
+
+    @property
+    def weights(self):
+        if self._weights is _MISSING:
+            self._decode_variants()
+        return self._weights
+
+    @property
+    def users(self):
+        if self._users is _MISSING:
+            self._users = self._decode_list(self._variants_end, len(self._value))[0]
+        return self._users
@@ -0,0 +1,292 @@
+"""
+Move the state of a BackEnd (functionalities, rules and whitelists) to another
+one, i.e. from RedisBackEnd to RedisHighPerfBackEnd or between REDIS instances,
+without downtime:
+
+1. Write to both backends, reading from the current one:
+
+       rollout = Rollout(DualWriteBackEnd(old, new))
+
+2. Copy the existing state. Whitelists are copied in chunks of identifiers, as
+   stored, so the memory used does not depend on their size:
+
+       copy(old, new)
+
+3. Check both backends take the same decisions:
+
+       verify(old, new, sample_ids) | should.be_empty()
+
+4. Read from the new backend, still writing to the old one in case of rollback:
+
+       rollout = Rollout(DualWriteBackEnd(new, old))
+"""
+from collections import namedtuple
+
+from .backend import CHUNK_SIZE, Feature, _batches, _crc32, _pick_variant
+
+
+def _clone(fn):
+    # MemoryBackEnd stores the very object given, that must not be shared
+    variants = fn.variants
+    if variants is not None and fn.weights is not None:
+        variants = list(zip(variants, fn.weights))
+    clone = Feature(fn.name, fn.field, fn.percentage, variants)
+    clone.enabled = fn.enabled
+    return clone
+
+
+def copy(source, target, names=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Copy every functionality of `source` (or just `names`), its rules and its
+    whitelist to `target`. Each one replaces the functionality with the same name.
+    @param progress: called with (name, users copied) after every chunk
+    @return: number of functionalities copied
+    """
+    if names is None:
+        names = sorted(source.get_functionalities())
+    count = 0
+    for name in names:
+        fn = source.get_functionality(name)
+        if fn is None:
+            # Removed meanwhile
+            continue
+        target.remove_functionality(name)
+        target.add_functionality(_clone(fn))
+        for rule in source.get_rules(name):
+            target.set_rule(name, rule)
+        copied = 0
+        for users in source.iter_whitelist(name, chunk_size):
+            target._add_ids(name, users)
+            copied += len(users)
+            if progress is not None:
+                progress(name, copied)
+        count += 1
+    return count
+
+
+class Mismatch(namedtuple('Mismatch', ['name', 'item', 'expected', 'found'])):
+    """
+    A different decision for `item` (None for the global decision). `expected` (source)
+    and `found` (target) are (enabled, variant) tuples, or None if the functionality
+    is not defined.
+    """
+    __slots__ = ()
+
+
+class _StoredId(object):
+    """
+    Identifier as stored, checked as an item whose field is the identifier itself
+    """
+
+    __slots__ = ['value']
+
+    def __init__(self, value):
+        self.value = value
+
+    def __getattr__(self, field):
+        return self.value
+
+    def __eq__(self, other):
+        return self.value == getattr(other, 'value', other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.value)
+
+    def __str__(self):
+        return str(self.value)
+
+
+def _decisions(backend, fn, items):
+    if fn is None:
+        return [None] * len(items)
+    checked = items
+    if fn.field is not None:
+        # `get_item_id` must not be applied to the identifiers
+        checked = [_StoredId(item) for item in items]
+    enabled = backend.is_enabled_many(fn.name, checked)
+    return [(e, _pick_variant(fn, _crc32(item)) if e else None)
+            for e, item in zip(enabled, items)]
+
+
+def verify(source, target, items=(), names=None, sample_size=100, chunk_size=CHUNK_SIZE):
+    """
+    Compare the decisions taken by `source` and `target` for `items`
+    (identifiers, as stored in the backends) in every functionality of `source`
+    (or just `names`). The global decision and the first `sample_size`
+    whitelisted users of each functionality are checked as well.
+    @return: list of Mismatch, empty if both backends agree
+    """
+    if names is None:
+        names = sorted(source.get_functionalities())
+    items = list(items)
+    mismatches = []
+    for name in names:
+        expected_fn = source.get_functionality(name)
+        found_fn = target.get_functionality(name)
+        expected = (source.is_enabled(name), None) if expected_fn is not None else None
+        found = (target.is_enabled(name), None) if found_fn is not None else None
+        if expected != found:
+            mismatches.append(Mismatch(name, None, expected, found))
+        whitelisted = []
+        if expected_fn is not None and sample_size:
+            for users in source.iter_whitelist(name, min(sample_size, chunk_size)):
+                whitelisted.extend(users[:sample_size - len(whitelisted)])
+                if len(whitelisted) >= sample_size:
+                    break
+        for batch in _batches(items + whitelisted, chunk_size):
+            expected = _decisions(source, expected_fn, batch)
+            found = _decisions(target, found_fn, batch)
+            for item, e, f in zip(batch, expected, found):
+                if e != f:
+                    mismatches.append(Mismatch(name, item, e, f))
+    return mismatches
+
+
+class DualWriteBackEnd(object):
+    """
+    Wraps two BackEnds during a migration: every read is served by `primary`
+    and every write is applied to `primary` and then to `secondary`.
+    Functionalities not defined in `secondary` yet are only updated in `primary`;
+    `copy` brings them over later.
+    A failure writing to `secondary` is raised once `primary` has been updated,
+    so both could differ until the operation is retried (or `copy` run again).
+
+    rollout = Rollout(DualWriteBackEnd(RedisBackEnd(), RedisHighPerfBackEnd()))
+    """
+
+    def __init__(self, primary, secondary):
+        self.primary = primary
+        self.secondary = secondary
+
+    def _load(self, name):
+        return self.primary._load(name)
+
+    # Read operations
+
+    def _feature(self, definition):
+        return self.primary._feature(definition)
+
+    def _evaluate(self, definition, item=None):
+        return self.primary._evaluate(definition, item)
+
+    def _evaluate_many(self, definition, items):
+        return self.primary._evaluate_many(definition, items)
+
+    def _variant(self, definition, item):
+        return self.primary._variant(definition, item)
+
+    def _decide(self, name, item):
+        decide = getattr(self.primary, '_decide', None)
+        return decide(name, item) if decide is not None else None
+
+    def is_enabled(self, name, item=None):
+        return self.primary.is_enabled(name, item)
+
+    def is_enabled_many(self, name, items):
+        return self.primary.is_enabled_many(name, items)
+
+    def variant(self, name, item):
+        return self.primary.variant(name, item)
+
+    def evaluate_all(self, item):
+        return self.primary.evaluate_all(item)
+
+    def get_functionality(self, name):
+        return self.primary.get_functionality(name)
+
+    def get_functionalities(self):
+        return self.primary.get_functionalities()
+
+    def iter_whitelist(self, name, chunk_size=CHUNK_SIZE):
+        return self.primary.iter_whitelist(name, chunk_size)
+
+    def get_rules(self, name):
+        return self.primary.get_rules(name)
+
+    def _secondary(self, name):
+        """
+        Return `secondary` if it defines the functionality `name`, None otherwise
+        """
+        if self.secondary.get_functionality(name) is None:
+            return None
+        return self.secondary
+
+    # Write operations
+
+    def add_functionality(self, fn, *args, **kwargs):
+        self.primary.add_functionality(fn, *args, **kwargs)
+        self.secondary.add_functionality(_clone(fn), *args, **kwargs)
+
+    def remove_functionality(self, name):
+        self.primary.remove_functionality(name)
+        self.secondary.remove_functionality(name)
+
+    def add(self, name, item):
+        self.primary.add(name, item)
+        secondary = self._secondary(name)
+        if secondary is not None:
+            secondary.add(name, item)
+
+    def add_many(self, name, items, chunk_size=CHUNK_SIZE, progress=None):
+        # `items` may be consumed once, so both backends get the same chunk
+        secondary = self._secondary(name)
+        count = 0
+        for batch in _batches(items, chunk_size):
+            self.primary.add_many(name, batch, chunk_size)
+            if secondary is not None:
+                secondary.add_many(name, batch, chunk_size)
+            count += len(batch)
+            if progress is not None:
+                progress(count)
+        return count
+
+    def _add_ids(self, name, ids):
+        self.primary._add_ids(name, ids)
+        secondary = self._secondary(name)
+        if secondary is not None:
+            secondary._add_ids(name, ids)
+
+    def remove(self, name, item):
+        self.primary.remove(name, item)
+        secondary = self._secondary(name)
+        if secondary is not None:
+            secondary.remove(name, item)
+
+    def set_rule(self, name, rule):
+        self.primary.set_rule(name, rule)
+        secondary = self._secondary(name)
+        if secondary is not None:
+            secondary.set_rule(name, rule)
+
+    def remove_rule(self, name, rule):
+        self.primary.remove_rule(name, rule)
+        secondary = self._secondary(name)
+        if secondary is not None:
+            secondary.remove_rule(name, rule)
+
+    def set_percentage(self, name, percentage):
+        self.primary.set_percentage(name, percentage)
+        secondary = self._secondary(name)
+        if secondary is not None:
+            secondary.set_percentage(name, percentage)
+
+    def enable(self, name, enable_to_all=False):
+        self.primary.enable(name, enable_to_all)
+        secondary = self._secondary(name)
+        if secondary is not None:
+            secondary.enable(name, enable_to_all)
+
+    def disable(self, name):
+        self.primary.disable(name)
+        secondary = self._secondary(name)
+        if secondary is not None:
+            secondary.disable(name)
+
+    def toggle(self, name):
+        self.primary.toggle(name)
+        secondary = self._secondary(name)
+        if secondary is not None:
+            secondary.toggle(name)
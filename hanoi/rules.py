@@ -0,0 +1,211 @@
+import re
+from collections import OrderedDict
+
+# Flags a pattern may have and still be served from the index
+_DEFAULT_FLAGS = re.compile(r'').flags
+
+_SPECIAL = frozenset('.^$*+?{}[]\\|()')
+
+# Backreferences and named groups change their meaning inside an alternation
+_NOT_COMBINABLE = re.compile(r'\\[1-9]|\(\?P[<=]')
+
+_END = ''
+
+
+def _literal(text):
+    """
+    Return the literal string matched by the regular expression `text`,
+    or None if it uses any special construction. Escaped punctuation is allowed.
+    """
+    chars = []
+    escaped = False
+    for char in text:
+        if escaped:
+            if char.isalnum() or char == '_':
+                # \d, \w, \b...
+                return None
+            chars.append(char)
+            escaped = False
+        elif char == '\\':
+            escaped = True
+        elif char in _SPECIAL:
+            return None
+        else:
+            chars.append(char)
+    if escaped or not chars:
+        return None
+    return ''.join(chars)
+
+
+def classify(rule):
+    """
+    Return (kind, literal) for a compiled regular expression, where kind is
+    'exact' (^foo$), 'prefix' (^foo), 'suffix' (foo$) or None if it can only
+    be evaluated by the regular expression engine.
+    """
+    if rule.flags != _DEFAULT_FLAGS:
+        return None, None
+    pattern = rule.pattern
+    if not isinstance(pattern, str):
+        return None, None
+    starts = pattern.startswith('^')
+    ends = pattern.endswith('$') and not pattern.endswith('\\$')
+    body = pattern[1 if starts else 0:len(pattern) - 1 if ends else len(pattern)]
+    literal = _literal(body)
+    if literal is None or not (starts or ends):
+        return None, None
+    if starts and ends:
+        return 'exact', literal
+    return ('prefix' if starts else 'suffix'), literal
+
+
+def _trie_add(trie, literal):
+    node = trie
+    for char in literal:
+        node = node.setdefault(char, {})
+    node[_END] = True
+
+
+def _trie_match(trie, chars):
+    """
+    Check if any word stored in `trie` is a prefix of `chars`
+    """
+    node = trie
+    if _END in node:
+        return True
+    for char in chars:
+        node = node.get(char)
+        if node is None:
+            return False
+        if _END in node:
+            return True
+    return False
+
+
+class RuleSet(object):
+    """
+    Set of regular expressions registered to a functionality, matched with `search`.
+    An item matches the set if it matches any of its rules.
+
+    - Anchored literal patterns (^foo$, ^foo, foo$) are served from a hash (exact)
+      and two tries (prefix and reversed suffix), so their cost depends on the
+      item length, not on the number of rules.
+    - Any other pattern is combined in a single alternation.
+    - The result of the last `cache_size` items is memoized.
+
+    The index is rebuilt lazily, upon the first match after adding or removing rules.
+    """
+
+    def __init__(self, rules=None, cache_size=1024):
+        self.cache_size = cache_size
+        self._rules = OrderedDict()
+        for rule in rules or ():
+            self._rules[rule.pattern] = rule
+        self._index = None
+        self._memo = OrderedDict()
+
+    def __len__(self):
+        return len(self._rules)
+
+    def __iter__(self):
+        return iter(self._rules.values())
+
+    def __contains__(self, rule):
+        return rule.pattern in self._rules
+
+    @property
+    def patterns(self):
+        return list(self._rules)
+
+    def add(self, rule):
+        """
+        Add a compiled regular expression. A rule with the same pattern is replaced.
+        """
+        self._rules[rule.pattern] = rule
+        self._index = None
+
+    def remove(self, rule):
+        """
+        Remove the rule with the same pattern than `rule`
+        @return: True if it was registered
+        """
+        if self._rules.pop(rule.pattern, None) is None:
+            return False
+        self._index = None
+        return True
+
+    def _build(self):
+        exact = set()
+        prefixes = {}
+        suffixes = {}
+        others = []
+        for rule in self._rules.values():
+            kind, literal = classify(rule)
+            if kind == 'exact':
+                exact.add(literal)
+            elif kind == 'prefix':
+                _trie_add(prefixes, literal)
+            elif kind == 'suffix':
+                _trie_add(suffixes, literal[::-1])
+            else:
+                others.append(rule)
+
+        searches = []
+        combinable = OrderedDict()
+        for rule in others:
+            if isinstance(rule.pattern, str) and not _NOT_COMBINABLE.search(rule.pattern):
+                combinable.setdefault(rule.flags, []).append(rule)
+            else:
+                searches.append(rule.search)
+        for flags, rules in combinable.items():
+            if len(rules) == 1:
+                searches.append(rules[0].search)
+                continue
+            try:
+                combined = re.compile('|'.join('(?:%s)' % r.pattern for r in rules), flags)
+            except re.error:
+                searches.extend(r.search for r in rules)
+            else:
+                searches.append(combined.search)
+
+        # Swapped at once, so concurrent readers see a consistent index
+        self._memo = OrderedDict()
+        self._index = index = (exact, prefixes, suffixes, tuple(searches))
+        return index
+
+    def _match(self, text):
+        index = self._index
+        if index is None:
+            index = self._build()
+        exact, prefixes, suffixes, searches = index
+        # `$` also matches before a trailing newline
+        stripped = text[:-1] if text.endswith('\n') else text
+        if text in exact or stripped in exact:
+            return True
+        if prefixes and _trie_match(prefixes, text):
+            return True
+        if suffixes and (_trie_match(suffixes, reversed(text)) or
+                         stripped is not text and _trie_match(suffixes, reversed(stripped))):
+            return True
+        for search in searches:
+            if search(text) is not None:
+                return True
+        return False
+
+    def match(self, text):
+        """
+        Check if `text` matches any rule
+        """
+        if self._index is None:
+            self._build()
+        memo = self._memo
+        result = memo.pop(text, None)
+        if result is None:
+            result = self._match(text)
+            if len(memo) >= self.cache_size:
+                try:
+                    memo.popitem(last=False)
+                except KeyError:
+                    pass
+        memo[text] = result
+        return result
@@ -0,0 +1,341 @@
+"""
+Read-only BackEnd served from a snapshot file mapped in memory, so every
+process of a host (i.e. pre-forked workers) shares the same page cache pages
+and opening it does not decode the whitelists:
+
+    header     magic (8 bytes), version (1 byte), directory offset (8 bytes),
+               functionalities (4 bytes)
+    per functionality
+      definition  see `hanoi.encoding`, without users
+      rules       length (2 bytes) + utf-8 pattern + flags (4 bytes) per rule
+      whitelist   size + 1 offsets (4 bytes each) followed by the identifiers,
+                  utf-8 and sorted, so membership is a binary search
+    directory  length (2 bytes) + utf-8 name + the offset and length
+               of every section, per functionality
+
+Integers are big endian. Snapshots are written from any BackEnd with
+`write_snapshot`, to a temporary file then renamed, so a process never
+reads a file partially written.
+
+    write_snapshot(RedisHighPerfBackEnd(), '/var/lib/hanoi/flags.snapshot')
+    rollout = Rollout(SnapshotBackEnd('/var/lib/hanoi/flags.snapshot'))
+"""
+import mmap
+import os
+import re
+import struct
+import tempfile
+import time
+
+from .backend import (CHUNK_SIZE, FeatureReader, _batches, _bucket, _compile_decision,
+                      _never, _text_type, _variant_of)
+from .encoding import _LENGTH, _encode_text, encode
+from .rules import RuleSet
+
+MAGIC = b'HANOISNP'
+VERSION = 1
+
+_HEADER = struct.Struct('!8sBQI')
+_ENTRY = struct.Struct('!QIQIQI')
+_OFFSET = struct.Struct('!I')
+_BOUNDS = struct.Struct('!II')
+_FLAGS = struct.Struct('!I')
+
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+    return _text_type(value).encode('utf-8')
+
+
+def _encode_rules(rules):
+    return b''.join(_encode_text(rule.pattern) + _FLAGS.pack(rule.flags) for rule in rules)
+
+
+def _encode_whitelist(ids):
+    offsets = [0]
+    for value in ids:
+        offsets.append(offsets[-1] + len(value))
+    return b''.join(_OFFSET.pack(o) for o in offsets) + b''.join(ids)
+
+
+def write_snapshot(backend, path, chunk_size=CHUNK_SIZE):
+    """
+    Write a snapshot of every functionality of `backend`, its rules and its whitelist.
+    The file is replaced atomically, so processes reading `path` pick it up upon their
+    next check (see `SnapshotBackEnd`). Each whitelist is sorted in memory.
+    @return: number of functionalities written
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix='.hanoi-', dir=directory)
+    try:
+        # Readable by the workers, as a regular file
+        os.chmod(tmp, 0o644)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, 0, 0))
+            entries = []
+            for name in sorted(backend.get_functionalities()):
+                fn = backend.get_functionality(name)
+                if fn is None:
+                    # Removed meanwhile
+                    continue
+                sections = [
+                    encode(fn.enabled, fn.percentage, fn.field, fn.variants, fn.weights),
+                    _encode_rules(backend.get_rules(name)),
+                ]
+                ids = set()
+                for users in backend.iter_whitelist(name, chunk_size):
+                    ids.update(_to_bytes(u) for u in users)
+                sections.append(_encode_whitelist(sorted(ids)))
+
+                entry = []
+                for section in sections:
+                    entry.extend((f.tell(), len(section)))
+                    f.write(section)
+                # The whitelist is located by its size, not its length
+                entry[-1] = len(ids)
+                entries.append((name, entry))
+
+            offset = f.tell()
+            for name, entry in entries:
+                f.write(_encode_text(name))
+                f.write(_ENTRY.pack(*entry))
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, VERSION, offset, len(entries)))
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return len(entries)
+
+
+class Whitelist(object):
+    """
+    Sorted identifiers of a functionality in the mapped buffer.
+    Checking an item is a binary search, decoding only the visited identifiers.
+    """
+
+    __slots__ = ['_buffer', '_offsets', '_data', '_size', '_get_id']
+
+    def __init__(self, buffer, offset, size, get_id):
+        self._buffer = buffer
+        self._offsets = offset
+        self._data = offset + _OFFSET.size * (size + 1)
+        self._size = size
+        self._get_id = get_id
+
+    def __len__(self):
+        return self._size
+
+    def _at(self, index):
+        start, end = _BOUNDS.unpack_from(self._buffer, self._offsets + _OFFSET.size * index)
+        return self._buffer[self._data + start:self._data + end]
+
+    def __contains__(self, item):
+        value = _to_bytes(self._get_id(item))
+        low, high = 0, self._size
+        while low < high:
+            middle = (low + high) // 2
+            if self._at(middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self._size and self._at(low) == value
+
+    def __iter__(self):
+        for index in range(self._size):
+            yield self._at(index).decode('utf-8')
+
+
+class Snapshot(object):
+    """
+    A snapshot file mapped in memory. Functionalities and their decision
+    functions are built upon first use; the whitelists are never copied.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.identity = (stat.st_ino, stat.st_size, stat.st_mtime)
+
+        magic, version, offset, count = _HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise ValueError("%s is not a hanoi snapshot" % path)
+        if version != VERSION:
+            raise ValueError("Unsupported snapshot version %d" % version)
+
+        self.entries = {}
+        for _ in range(count):
+            length, = _LENGTH.unpack_from(self.buffer, offset)
+            offset += _LENGTH.size
+            name = self.buffer[offset:offset + length].decode('utf-8')
+            offset += length
+            self.entries[name] = _ENTRY.unpack_from(self.buffer, offset)
+            offset += _ENTRY.size
+
+        self._functionalities = {}
+        self._decisions = {}
+
+    def functionality(self, name):
+        functionality = self._functionalities.get(name)
+        if functionality is None:
+            entry = self.entries.get(name)
+            if entry is None:
+                return None
+            offset, length = entry[:2]
+            functionality = self._functionalities[name] = FeatureReader(
+                name, self.buffer[offset:offset + length])
+        return functionality
+
+    def whitelist(self, name):
+        functionality = self.functionality(name)
+        if functionality is None:
+            return None
+        offset, size = self.entries[name][4:]
+        return Whitelist(self.buffer, offset, size, functionality.get_item_id)
+
+    def rules(self, name):
+        offset, length = self.entries[name][2:4]
+        buffer = self.buffer
+        end = offset + length
+        rules = []
+        while offset < end:
+            size, = _LENGTH.unpack_from(buffer, offset)
+            offset += _LENGTH.size
+            pattern = buffer[offset:offset + size].decode('utf-8')
+            offset += size
+            flags, = _FLAGS.unpack_from(buffer, offset)
+            offset += _FLAGS.size
+            rules.append(re.compile(pattern, flags))
+        return rules
+
+    def decision(self, name):
+        decision = self._decisions.get(name)
+        if decision is None:
+            functionality = self.functionality(name)
+            if functionality is None:
+                return _never
+            rules = self.rules(name)
+            decision = self._decisions[name] = _compile_decision(
+                functionality, self.whitelist(name), RuleSet(rules) if rules else None)
+        return decision
+
+
+def _read_only(self, *args, **kwargs):
+    raise NotImplementedError('SnapshotBackEnd is read only, write a new snapshot instead')
+
+
+class SnapshotBackEnd(object):
+    """
+    Implements a read-only BackEnd serving a snapshot written by `write_snapshot`.
+    - The file is mapped in memory (mmap), so every process shares it and
+      opening it only reads the directory of functionalities.
+    - Whitelists are sorted, and checking an item is a binary search over the
+      mapped buffer, O(log n) without decoding the whitelist.
+    - Every `check_interval` seconds (upon a check) the file is checked, and a new
+      snapshot written to the same path replaces the current one at once.
+      Use `reload` to pick it up immediately.
+    """
+
+    def __init__(self, path, check_interval=1):
+        self.path = path
+        self.check_interval = check_interval
+        self._snapshot = Snapshot(path)
+        self._checked = time.time()
+
+    def reload(self):
+        """
+        Map again the snapshot file. Checks in progress finish with the previous
+        snapshot, which is unmapped once no longer used.
+        """
+        self._snapshot = Snapshot(self.path)
+        self._checked = time.time()
+
+    def _current(self):
+        snapshot = self._snapshot
+        now = time.time()
+        if now - self._checked >= self.check_interval:
+            self._checked = now
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                # Keep serving the mapped snapshot
+                return snapshot
+            if (stat.st_ino, stat.st_size, stat.st_mtime) != snapshot.identity:
+                self.reload()
+                snapshot = self._snapshot
+        return snapshot
+
+    def _load(self, name):
+        snapshot = self._current()
+        return snapshot.functionality(name), snapshot.decision(name)
+
+    # Read operations
+
+    def _feature(self, definition):
+        return definition[0]
+
+    def _evaluate(self, definition, item=None):
+        return definition[1](item)
+
+    def _evaluate_many(self, definition, items):
+        decision = definition[1]
+        return [decision(item) for item in items]
+
+    def _variant(self, definition, item):
+        if not self._evaluate(definition, item):
+            return None
+        return _variant_of(definition[0], item)
+
+    def is_enabled(self, name, item=None):
+        return self._current().decision(name)(item)
+
+    def is_enabled_many(self, name, items):
+        return self._evaluate_many(self._load(name), items)
+
+    def variant(self, name, item):
+        return self._variant(self._load(name), item)
+
+    def evaluate_all(self, item):
+        """
+        Evaluate every functionality for `item`.
+        @return: dict functionality name -> (enabled, variant)
+        """
+        snapshot = self._current()
+        bucket = _bucket(str(item))
+        result = {}
+        for name in snapshot.entries:
+            enabled = snapshot.decision(name)(item, bucket)
+            variant = _variant_of(snapshot.functionality(name), item) if enabled else None
+            result[name] = (enabled, variant)
+        return result
+
+    def get_functionalities(self):
+        return list(self._current().entries)
+
+    def get_functionality(self, name):
+        functionality = self._current().functionality(name)
+        return functionality.to_feature() if functionality is not None else None
+
+    def iter_whitelist(self, name, chunk_size=CHUNK_SIZE):
+        whitelist = self._current().whitelist(name)
+        return _batches(whitelist if whitelist is not None else (), chunk_size)
+
+    def get_rules(self, name):
+        snapshot = self._current()
+        if name not in snapshot.entries:
+            return []
+        return snapshot.rules(name)
+
+    # Write operations
+
+    add_functionality = remove_functionality = _read_only
+    add = add_many = remove = _read_only
+    set_rule = remove_rule = _read_only
+    set_percentage = enable = disable = toggle = _read_only
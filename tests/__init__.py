@@ -1,14 +1,49 @@
 import unittest
 
 from .api import (
-    RolloutTestCase, RolloutWithRedisTestCase, RolloutWithRedisHighPerfTestCase
+    RolloutTestCase, RolloutWithRedisTestCase, RolloutWithRedisHighPerfTestCase,
+    RolloutWithRedisHighPerfLuaTestCase
 )
 
 from .backend import (
     FeatureTestCase,
-    RedisBackEndTestCase, RedisHighPerfBackEndTestCase, MemoryBackEndTestCase
+    RedisBackEndTestCase, RedisHighPerfBackEndTestCase, RedisHighPerfLuaBackEndTestCase,
+    MemoryBackEndTestCase
 )
 
+from .rules import ClassifyTestCase, RuleSetTestCase
+
+from .encoding import EncodingTestCase
+
+from .bloom import BloomFilterTestCase
+
+from .backup import BackupTestCase, BackupRedisTestCase, BackupRedisBackEndTestCase
+
+from .migration import (
+    MigrationTestCase, MigrationToRedisHighPerfTestCase, MigrationFromRedisTestCase
+)
+
+from .snapshot import SnapshotBackEndTestCase, SnapshotFromRedisHighPerfTestCase
+
+from .cache import (
+    CachingBackEndTestCase, CachingRedisHighPerfBackEndTestCase, ChangeSubscriberTestCase
+)
+
+try:
+    from .aio import (
+        AsyncRedisBackEndTestCase, AsyncRedisHighPerfBackEndTestCase,
+        AsyncRolloutTestCase, AsyncRolloutWithRedisHighPerfTestCase,
+        AsyncDecoratorTestCase, AsyncDecoratorWithRedisHighPerfTestCase
+    )
+    ASYNC_TESTS = [
+        AsyncRedisBackEndTestCase, AsyncRedisHighPerfBackEndTestCase,
+        AsyncRolloutTestCase, AsyncRolloutWithRedisHighPerfTestCase,
+        AsyncDecoratorTestCase, AsyncDecoratorWithRedisHighPerfTestCase
+    ]
+except SyntaxError:
+    # asyncio requires python >= 3.5
+    ASYNC_TESTS = []
+
 
 def all_tests():
     suite = unittest.TestSuite()
@@ -16,7 +51,26 @@ def all_tests():
     suite.addTest(unittest.makeSuite(RolloutTestCase))
     suite.addTest(unittest.makeSuite(RolloutWithRedisTestCase))
     suite.addTest(unittest.makeSuite(RolloutWithRedisHighPerfTestCase))
+    suite.addTest(unittest.makeSuite(RolloutWithRedisHighPerfLuaTestCase))
     suite.addTest(unittest.makeSuite(MemoryBackEndTestCase))
     suite.addTest(unittest.makeSuite(RedisBackEndTestCase))
     suite.addTest(unittest.makeSuite(RedisHighPerfBackEndTestCase))
+    suite.addTest(unittest.makeSuite(RedisHighPerfLuaBackEndTestCase))
+    suite.addTest(unittest.makeSuite(ClassifyTestCase))
+    suite.addTest(unittest.makeSuite(RuleSetTestCase))
+    suite.addTest(unittest.makeSuite(EncodingTestCase))
+    suite.addTest(unittest.makeSuite(BloomFilterTestCase))
+    suite.addTest(unittest.makeSuite(BackupTestCase))
+    suite.addTest(unittest.makeSuite(BackupRedisTestCase))
+    suite.addTest(unittest.makeSuite(BackupRedisBackEndTestCase))
+    suite.addTest(unittest.makeSuite(MigrationTestCase))
+    suite.addTest(unittest.makeSuite(MigrationToRedisHighPerfTestCase))
+    suite.addTest(unittest.makeSuite(MigrationFromRedisTestCase))
+    suite.addTest(unittest.makeSuite(SnapshotBackEndTestCase))
+    suite.addTest(unittest.makeSuite(SnapshotFromRedisHighPerfTestCase))
+    suite.addTest(unittest.makeSuite(CachingBackEndTestCase))
+    suite.addTest(unittest.makeSuite(CachingRedisHighPerfBackEndTestCase))
+    suite.addTest(unittest.makeSuite(ChangeSubscriberTestCase))
+    for test_case in ASYNC_TESTS:
+        suite.addTest(unittest.makeSuite(test_case))
     return suite
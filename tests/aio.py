@@ -0,0 +1,468 @@
+# -*- encoding: utf-8 -*-
+
+import re
+import unittest
+from pyshould import should
+
+# Requires python >= 3.5 (tests/__init__.py skips it in previous versions)
+import asyncio
+import inspect
+
+from hanoi.aio import AsyncRollout, AsyncRedisBackEnd, AsyncRedisHighPerfBackEnd
+from hanoi.api import Decision, Rollout, RolloutException
+from hanoi.backend import MemoryBackEnd, RedisBackEnd, RedisHighPerfBackEnd, Feature
+
+
+class Foo(object):
+    def __init__(self, id):
+        self.id = id
+
+    def __repr__(self):
+        return self.id
+
+
+class AsyncTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_until_complete(self, coro):
+        return self.loop.run_until_complete(coro)
+
+
+class AsyncRedisBackEndTestCase(AsyncTestCase):
+
+    FN = 'FOO'
+    SYNC_BACKEND = RedisBackEnd
+
+    def _get_backend(self):
+        return AsyncRedisBackEnd(max_connections=10)
+
+    def setUp(self):
+        super(AsyncRedisBackEndTestCase, self).setUp()
+        self.backend = self._get_backend()
+        self.run_until_complete(self.backend._redis.flushdb())
+
+    def tearDown(self):
+        self.run_until_complete(self.backend.close())
+        super(AsyncRedisBackEndTestCase, self).tearDown()
+
+    def test_is_enabled_when_functionality_not_exist(self):
+        self.run_until_complete(self.backend.is_enabled(self.FN)) | should.be_false()
+
+    def test_is_enabled_globally(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN)))
+        self.run_until_complete(self.backend.is_enabled(self.FN)) | should.be_true()
+
+    def test_is_enabled_for_a_whitelisted_user(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN, percentage=0)))
+        self.run_until_complete(self.backend.add(self.FN, 'bar'))
+        self.run_until_complete(self.backend.is_enabled(self.FN, 'bar')) | should.be_true()
+        self.run_until_complete(self.backend.is_enabled(self.FN, 'bazz')) | should.be_false()
+        self.run_until_complete(self.backend.remove(self.FN, 'bar'))
+        self.run_until_complete(self.backend.is_enabled(self.FN, 'bar')) | should.be_false()
+
+    def test_add_a_user_to_a_functionality_not_exist(self):
+        with should.throw(ValueError):
+            self.run_until_complete(self.backend.add(self.FN, 'bar'))
+
+    def test_is_enabled_with_a_rule(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN, percentage=0)))
+        self.run_until_complete(self.backend.set_rule(self.FN, re.compile(r'00$')))
+        self.run_until_complete(self.backend.is_enabled(self.FN, '4400')) | should.be_true()
+        self.run_until_complete(self.backend.remove_rule(self.FN, re.compile(r'00$')))
+        self.run_until_complete(self.backend.is_enabled(self.FN, '4400')) | should.be_false()
+
+    def test_is_enabled_many(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN, percentage=0)))
+        self.run_until_complete(self.backend.add(self.FN, 'bar'))
+        self.run_until_complete(
+            self.backend.is_enabled_many(self.FN, ['bar', 'bazz'])) | should.eql([True, False])
+
+    def test_variant(self):
+        _variants = ['foo', 'bar', 'bazz']
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN, variants=_variants)))
+        backend = self.SYNC_BACKEND()
+        for user in ('juan', 'juan2', 'juan3'):
+            self.run_until_complete(
+                self.backend.variant(self.FN, user)) | should.eql(backend.variant(self.FN, user))
+
+    def test_disable_enable_and_toggle(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN)))
+        self.run_until_complete(self.backend.disable(self.FN))
+        self.run_until_complete(self.backend.is_enabled(self.FN)) | should.be_false()
+        self.run_until_complete(self.backend.enable(self.FN))
+        self.run_until_complete(self.backend.is_enabled(self.FN)) | should.be_true()
+        self.run_until_complete(self.backend.toggle(self.FN))
+        self.run_until_complete(self.backend.is_enabled(self.FN)) | should.be_false()
+
+    def test_set_percentage(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN)))
+        self.run_until_complete(self.backend.set_percentage(self.FN, 0))
+        self.run_until_complete(self.backend.get_functionality(self.FN)).percentage | should.eql(0)
+
+    def test_remove_a_functionality(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN)))
+        self.run_until_complete(self.backend.remove_functionality(self.FN))
+        self.run_until_complete(self.backend.is_enabled(self.FN)) | should.be_false()
+
+    def test_evaluate_all(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN, variants=['foo'])))
+        self.run_until_complete(self.backend.add_functionality(Feature('BAR', percentage=0)))
+        self.run_until_complete(self.backend.evaluate_all('juan')) | should.eql({
+            self.FN: (True, 'foo'),
+            'BAR': (False, None),
+        })
+
+    def test_shares_the_data_with_the_synchronous_backend(self):
+        backend = self.SYNC_BACKEND()
+        backend.add_functionality(Feature(self.FN, percentage=0))
+        backend.add(self.FN, 'bar')
+        backend.set_rule(self.FN, re.compile(r'00$'))
+        self.run_until_complete(self.backend.is_enabled(self.FN, 'bar')) | should.be_true()
+        self.run_until_complete(self.backend.is_enabled(self.FN, '4400')) | should.be_true()
+        self.run_until_complete(self.backend.disable(self.FN))
+        backend.is_enabled(self.FN, 'bar') | should.be_false()
+
+    def test_concurrent_checks_share_the_fetch(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN)))
+        fetches = []
+        fetch = self.backend._fetch
+
+        def counting_fetch(name):
+            fetches.append(name)
+            return fetch(name)
+
+        self.backend._fetch = counting_fetch
+        checks = [self.loop.create_task(self.backend.is_enabled(self.FN)) for _ in range(100)]
+        self.run_until_complete(asyncio.gather(*checks)) | should.eql([True] * 100)
+        fetches | should.eql([self.FN])
+        self.backend._flights | should.be_empty()
+
+    def test_cancelled_check_does_not_cancel_the_shared_fetch(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN)))
+        first = self.loop.create_task(self.backend.is_enabled(self.FN))
+        second = self.loop.create_task(self.backend.is_enabled(self.FN))
+        self.run_until_complete(asyncio.sleep(0))
+        first.cancel()
+        self.run_until_complete(second) | should.be_true()
+
+    def test_checks_after_a_change_do_not_join_a_previous_fetch(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN)))
+        fetch = self.backend._fetch
+
+        async def slow_fetch(name):
+            definition = await fetch(name)
+            await asyncio.sleep(0.05)
+            return definition
+
+        self.backend._fetch = slow_fetch
+
+        async def scenario():
+            before = asyncio.ensure_future(self.backend.is_enabled(self.FN))
+            await asyncio.sleep(0.01)
+            await self.backend.disable(self.FN)
+            after = asyncio.ensure_future(self.backend.is_enabled(self.FN))
+            return await asyncio.gather(before, after)
+
+        self.run_until_complete(scenario()) | should.eql([True, False])
+
+    def test_get_rules(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN, percentage=0)))
+        self.run_until_complete(self.backend.set_rule(self.FN, re.compile(r'00$')))
+        rules = self.run_until_complete(self.backend.get_rules(self.FN))
+        [r.pattern for r in rules] | should.eql(['00$'])
+
+    def test_iter_whitelist_not_implemented(self):
+        with should.throw(NotImplementedError):
+            self.backend.iter_whitelist(self.FN)
+
+    def test_users_are_kept_upon_updates(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN, percentage=0)))
+        self.run_until_complete(self.backend.add(self.FN, 'bar'))
+        self.run_until_complete(self.backend.add(self.FN, 'bar'))
+        self.run_until_complete(self.backend.set_percentage(self.FN, 10))
+        f = self.run_until_complete(self.backend.get_functionality(self.FN))
+        f.percentage | should.eql(10)
+        self.run_until_complete(self.backend.is_enabled(self.FN, 'bar')) | should.be_true()
+        self.run_until_complete(self.backend.remove(self.FN, 'bar'))
+        self.run_until_complete(self.backend.is_enabled(self.FN, 'bar')) | should.be_false()
+
+    def test_add_many(self):
+        self.run_until_complete(self.backend.add_functionality(Feature(self.FN, percentage=0)))
+        progress = []
+        added = self.run_until_complete(self.backend.add_many(
+            self.FN, (str(i) for i in range(5)), chunk_size=2, progress=progress.append))
+        added | should.eql(5)
+        progress | should.eql([2, 4, 5])
+        self.run_until_complete(self.backend.is_enabled_many(self.FN, ['0', '4', '5'])) | \
+            should.eql([True, True, False])
+        with should.throw(ValueError):
+            self.run_until_complete(self.backend.add_many('bar', ['bar']))
+
+    def test_add_to_a_functionality_not_defined(self):
+        with should.throw(ValueError):
+            self.run_until_complete(self.backend.add(self.FN, 'bar'))
+
+
+class AsyncRedisHighPerfBackEndTestCase(AsyncRedisBackEndTestCase):
+
+    SYNC_BACKEND = RedisHighPerfBackEnd
+
+    def _get_backend(self):
+        return AsyncRedisHighPerfBackEnd(max_connections=10)
+
+    def test_whitelisted_users_on_creation(self):
+        self.run_until_complete(
+            self.backend.add_functionality(Feature(self.FN, percentage=0), ['bar']))
+        self.run_until_complete(self.backend.is_enabled(self.FN, 'bar')) | should.be_true()
+
+    def test_get_functionalities(self):
+        for i in range(25):
+            self.run_until_complete(self.backend.add_functionality(Feature('foo%d' % i)))
+        names = self.run_until_complete(self.backend.get_functionalities(count=10))
+        sorted(names) | should.eql(sorted('foo%d' % i for i in range(25)))
+
+    def test_get_functionalities_detail(self):
+        self.run_until_complete(
+            self.backend.add_functionality(Feature(self.FN, percentage=10), ['bar', 'baz']))
+        details = self.run_until_complete(self.backend.get_functionalities_detail())
+        fn, users = details[self.FN]
+        fn.percentage | should.eql(10)
+        users | should.eql(2)
+
+    def test_changes_are_seen_by_bloom_filters(self):
+        self.run_until_complete(
+            self.backend.add_functionality(Feature(self.FN, percentage=0), ['bar']))
+        backend = self.SYNC_BACKEND()
+        backend.use_bloom(self.FN)
+        self.run_until_complete(self.backend.add(self.FN, 'baz'))
+        backend.is_enabled(self.FN, 'baz') | should.be_true()
+        backend.drop_bloom(self.FN)
+
+    def test_bloom_filters_not_implemented(self):
+        with should.throw(NotImplementedError):
+            self.backend.use_bloom(self.FN)
+
+
+class AsyncRolloutTestCase(AsyncTestCase):
+
+    FN = 'foo'
+
+    def _get_backend(self):
+        return MemoryBackEnd()
+
+    def setUp(self):
+        super(AsyncRolloutTestCase, self).setUp()
+        self.rollout = AsyncRollout(self._get_backend())
+        self.run_until_complete(self.rollout.add_func(self.FN))
+
+    def test_is_enabled(self):
+        self.run_until_complete(self.rollout.is_enabled(self.FN)) | should.be_true()
+        self.run_until_complete(self.rollout.is_enabled('bar')) | should.be_false()
+
+    def test_register_and_unregister(self):
+        self.run_until_complete(self.rollout.set_percentage(self.FN, 0))
+        self.run_until_complete(self.rollout.register(self.FN, 'bar'))
+        self.run_until_complete(self.rollout.register(self.FN, re.compile(r'00$')))
+        self.run_until_complete(
+            self.rollout.is_enabled_many(self.FN, ['bar', '4400', 'bazz'])
+        ) | should.eql([True, True, False])
+        self.run_until_complete(self.rollout.unregister(self.FN, 'bar'))
+        self.run_until_complete(self.rollout.unregister(self.FN, re.compile(r'00$')))
+        self.run_until_complete(
+            self.rollout.is_enabled_many(self.FN, ['bar', '4400'])) | should.eql([False, False])
+
+    def test_variant(self):
+        self.run_until_complete(self.rollout.add_func(self.FN, percentage=100, variants=['foo']))
+        self.run_until_complete(self.rollout.variant(self.FN, 'juan')) | should.eql('foo')
+
+    def test_disable_enable_and_toggle(self):
+        self.run_until_complete(self.rollout.disable(self.FN))
+        self.run_until_complete(self.rollout.is_enabled(self.FN)) | should.be_false()
+        self.run_until_complete(self.rollout.enable(self.FN))
+        self.run_until_complete(self.rollout.is_enabled(self.FN)) | should.be_true()
+        self.run_until_complete(self.rollout.toggle(self.FN))
+        self.run_until_complete(self.rollout.is_enabled(self.FN)) | should.be_false()
+
+    def test_register_many(self):
+        self.run_until_complete(self.rollout.set_percentage(self.FN, 0))
+        self.run_until_complete(self.rollout.register_many(self.FN, ['bar', 'bazz'])) | should.eql(2)
+        self.run_until_complete(self.rollout.is_enabled(self.FN, 'bazz')) | should.be_true()
+
+    def test_decide(self):
+        self.run_until_complete(self.rollout.register(self.FN, 'bar'))
+        self.run_until_complete(self.rollout.decide(self.FN, 'bar')) | should.eql(
+            Decision(True, True, None, Decision.MATCHED))
+        self.run_until_complete(self.rollout.decide(self.FN, 'bazz')) | should.eql(
+            Decision(True, False, None, Decision.NOT_MATCHED))
+        self.run_until_complete(self.rollout.decide('bar')) | should.eql(
+            Decision(False, False, None, Decision.UNDEFINED))
+
+    def test_is_feature_accessor(self):
+        self.run_until_complete(self.rollout.register(self.FN, 'bar'))
+        self.run_until_complete(self.rollout.is_foo('bar')) | should.be_true()
+        self.run_until_complete(self.rollout.is_foo('bazz')) | should.be_false()
+        with should.throw(ValueError):
+            self.run_until_complete(self.rollout.is_bar('bar'))
+
+    def test_is_feature_accessor_is_cached(self):
+        accessor = self.rollout.is_foo
+        (self.rollout.is_foo is accessor) | should.be_true()
+        self.run_until_complete(self.rollout.remove_func(self.FN))
+        (self.rollout.is_foo is accessor) | should.be_false()
+        with should.throw(ValueError):
+            self.run_until_complete(self.rollout.is_foo())
+
+    def test_remove_func(self):
+        self.run_until_complete(self.rollout.remove_func(self.FN))
+        self.run_until_complete(self.rollout.get_functionality(self.FN)) | should.be_none()
+
+    def test_evaluate_all(self):
+        self.run_until_complete(self.rollout.evaluate_all('juan')) | should.eql({
+            self.FN: (False, None)
+        })
+
+
+class AsyncRolloutWithRedisHighPerfTestCase(AsyncRolloutTestCase):
+
+    def _get_backend(self):
+        return AsyncRedisHighPerfBackEnd()
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        backend = self._get_backend()
+        self.run_until_complete(backend._redis.flushdb())
+        self.rollout = AsyncRollout(backend)
+        self.run_until_complete(self.rollout.add_func(self.FN))
+
+    def tearDown(self):
+        self.run_until_complete(self.rollout.backend.close())
+        super(AsyncRolloutWithRedisHighPerfTestCase, self).tearDown()
+
+
+class AsyncDecoratorTestCase(AsyncTestCase):
+
+    FN = 'foo'
+
+    def _get_backend(self):
+        return MemoryBackEnd()
+
+    def setUp(self):
+        super(AsyncDecoratorTestCase, self).setUp()
+        self.backend = self._get_backend()
+        self.rollout = AsyncRollout(self.backend)
+        self.run_until_complete(self.rollout.add_func(self.FN))
+        self.run_until_complete(self.rollout.register(self.FN, 'bar'))
+
+    def test_enabled_wraps_a_coroutine_function(self):
+        @self.rollout.enabled(self.FN)
+        async def foo(name):
+            """foo docstring"""
+            return name
+
+        inspect.iscoroutinefunction(foo) | should.be_true()
+        foo.__name__ | should.eql('foo')
+        foo.__doc__ | should.eql('foo docstring')
+        self.run_until_complete(foo('bazz')) | should.eql('bazz')
+
+    def test_enabled_is_checked_when_awaited(self):
+        @self.rollout.enabled(self.FN)
+        async def foo():
+            return True
+
+        coro = foo()
+        self.run_until_complete(self.rollout.disable(self.FN))
+        with should.throw(RolloutException):
+            self.run_until_complete(coro)
+
+    def test_check_with_argument(self):
+        @self.rollout.check(self.FN, 1)
+        async def foo(user):
+            return user.id
+
+        inspect.iscoroutinefunction(foo) | should.be_true()
+        self.run_until_complete(foo(Foo('bar'))) | should.eql('bar')
+        with should.throw(Exception):
+            self.run_until_complete(foo(Foo('bazz')))
+
+    def test_check_with_keyword_argument(self):
+        @self.rollout.check(self.FN, 2)
+        async def foo(bar, user):
+            return user.id
+
+        self.run_until_complete(foo(None, user=Foo('bar'))) | should.eql('bar')
+
+    def test_check_with_current_id(self):
+        @self.rollout.check(self.FN)
+        async def foo():
+            return True
+
+        self.rollout.set_current_id('bar')
+        self.run_until_complete(foo()) | should.be_true()
+        self.rollout.set_current_id('bazz')
+        with should.throw(Exception):
+            self.run_until_complete(foo())
+
+    def test_current_id_is_local_to_the_task(self):
+        @self.rollout.check(self.FN)
+        async def foo():
+            return True
+
+        async def request(user):
+            with self.rollout.current_id(user):
+                await asyncio.sleep(0.01)
+                try:
+                    return await foo()
+                except Exception:
+                    return False
+
+        tasks = [self.loop.create_task(request(user)) for user in ('bar', 'bazz', 'bar')]
+        self.run_until_complete(asyncio.gather(*tasks)) | should.eql([True, False, True])
+        self.rollout._item | should.be_none()
+
+    def test_check_when_feature_not_exist(self):
+        @self.rollout.check('bazz', 1)
+        async def foo(user):
+            return user.id
+
+        with should.throw(Exception):
+            self.run_until_complete(foo(Foo('bar')))
+
+    def test_rollout_decorates_coroutine_functions(self):
+        rollout = Rollout(self.backend)
+
+        @rollout.check(self.FN, 1)
+        async def foo(user):
+            return user.id
+
+        self.run_until_complete(foo(Foo('bar'))) | should.eql('bar')
+
+
+class AsyncDecoratorWithRedisHighPerfTestCase(AsyncDecoratorTestCase):
+
+    def _get_backend(self):
+        backend = AsyncRedisHighPerfBackEnd()
+        self.run_until_complete(backend._redis.flushdb())
+        return backend
+
+    def tearDown(self):
+        self.run_until_complete(self.backend.close())
+        super(AsyncDecoratorWithRedisHighPerfTestCase, self).tearDown()
+
+    def test_synchronous_function_requires_a_synchronous_backend(self):
+        @self.rollout.enabled(self.FN)
+        def foo():
+            return True
+
+        @self.rollout.check(self.FN, 1)
+        def bar(user):
+            return True
+
+        with should.throw(TypeError):
+            foo()
+        with should.throw(TypeError):
+            bar(Foo('bar'))
@@ -1,9 +1,12 @@
 # -*- encoding: utf-8 -*-
 
+import gc
+import threading
 import unittest
+import weakref
 from pyshould import should, all_of, should_not
 
-from hanoi.api import Rollout, RolloutException
+from hanoi.api import Decision, Rollout, RolloutException, _LocalVar
 from hanoi.backend import MemoryBackEnd, RedisBackEnd, RedisHighPerfBackEnd
 
 
@@ -142,12 +145,21 @@ class RolloutTestCase(unittest.TestCase):
         self.rollout.register(self.FN, re.compile("00$"))
         self.rollout.is_enabled(self.FN, "0000010") | should.be_truthy
 
-    def test_set_a_rule_overrides_previous_rule(self):
+    def test_set_several_rules(self):
         import re
         self.rollout.register(self.FN, re.compile("00$"))
         self.rollout.is_enabled(self.FN, "0000010") | should.be_falsy
         self.rollout.register(self.FN, re.compile("10$"))
         self.rollout.is_enabled(self.FN, "0000010") | should.be_truthy
+        self.rollout.is_enabled(self.FN, "0000000") | should.be_truthy
+
+    def test_unregister_a_rule_keeps_the_others(self):
+        import re
+        self.rollout.register(self.FN, re.compile("00$"))
+        self.rollout.register(self.FN, re.compile("10$"))
+        self.rollout.unregister(self.FN, re.compile("00$"))
+        self.rollout.is_enabled(self.FN, "0000000") | should.be_falsy
+        self.rollout.is_enabled(self.FN, "0000010") | should.be_truthy
 
     def test_decorator_enabled_decorator_when_feature_enabled(self):
         @self.rollout.enabled(self.FN)
@@ -191,6 +203,275 @@ class RolloutTestCase(unittest.TestCase):
         self.rollout.register(self.FN, 'bar')
         foo(Foo('bar')) | should.eql('bar')
 
+    def test_current_id_is_local_to_the_thread(self):
+        seen = []
+        self.rollout.set_current_id('bar')
+
+        def worker():
+            seen.append(self.rollout._item)
+            self.rollout.set_current_id('bazz')
+            seen.append(self.rollout._item)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        seen | should.eql([None, 'bazz'])
+        self.rollout._item | should.eql('bar')
+
+    def test_current_id_context_manager(self):
+        @self.rollout.check(self.FN)
+        def foo():
+            return True
+
+        self.rollout.register(self.FN, 'bar')
+        with self.rollout.current_id('bar'):
+            foo() | should.be_true()
+            with self.rollout.current_id('bazz'):
+                with should.throw(Exception):
+                    foo()
+            self.rollout._item | should.eql('bar')
+        self.rollout._item | should.be_none()
+
+    def test_current_id_is_restored_upon_exceptions(self):
+        self.rollout.set_current_id('bar')
+        with should.throw(ValueError):
+            with self.rollout.current_id('bazz'):
+                raise ValueError()
+        self.rollout._item | should.eql('bar')
+
+    def test_current_id_per_rollout(self):
+        other = Rollout(MemoryBackEnd())
+        self.rollout.set_current_id('bar')
+        with other.current_id('bazz'):
+            other._item | should.eql('bazz')
+            self.rollout._item | should.eql('bar')
+        other._item | should.be_none()
+        other.set_current_id('foo')
+        reference = weakref.ref(other)
+        del other
+        gc.collect()
+        reference() | should.be_none()
+        self.rollout._item | should.eql('bar')
+
+    def test_current_id_without_contextvars(self):
+        var = _LocalVar()
+        token = var.set('bar')
+        var.get() | should.eql('bar')
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(var.get()))
+        thread.start()
+        thread.join()
+        seen | should.eql([None])
+        var.reset(token)
+        var.get() | should.be_none()
+
+    def test_decorator_check_with_keyword_argument(self):
+        @self.rollout.check(self.FN, 2)
+        def foo(bar, name):
+            return name.id
+
+        self.rollout.register(self.FN, 'bar')
+        foo(None, name=Foo('bar')) | should.eql('bar')
+        with should.throw(Exception):
+            foo(None, name=Foo('bazz'))
+
+    def test_decorator_check_in_a_method(self):
+        rollout = self.rollout
+
+        class Service(object):
+            @rollout.check(self.FN, 2)
+            def foo(self, name):
+                return name.id
+
+        self.rollout.register(self.FN, 'bar')
+        Service().foo(Foo('bar')) | should.eql('bar')
+
+    def test_decorator_check_when_feature_not_exist(self):
+        @self.rollout.check('bar', 1)
+        def foo(name):
+            return name
+
+        with should.throw(Exception):
+            foo(Foo('bar'))
+
+    def test_decorators_keep_the_function_metadata(self):
+        @self.rollout.check(self.FN, 1)
+        def foo(name):
+            """foo docstring"""
+
+        @self.rollout.enabled(self.FN)
+        def bar():
+            """bar docstring"""
+
+        foo.__name__ | should.eql('foo')
+        foo.__doc__ | should.eql('foo docstring')
+        bar.__name__ | should.eql('bar')
+        bar.__doc__ | should.eql('bar docstring')
+
+    def test_is_enabled_many(self):
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.register(self.FN, 'bar')
+        self.rollout.is_enabled_many(self.FN, ['bar', 'bazz']) | should.eql([True, False])
+
+    def test_is_enabled_many_when_feature_not_exist(self):
+        self.rollout.is_enabled_many('bar', ['bar', 'bazz']) | should.eql([False, False])
+
+    def test_unregister_an_user(self):
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.register(self.FN, 'bar')
+        self.rollout.unregister(self.FN, 'bar')
+        self.rollout.is_enabled(self.FN, 'bar') | should.be_falsy
+
+    def test_unregister_a_rule(self):
+        import re
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.register(self.FN, re.compile("00$"))
+        self.rollout.unregister(self.FN, re.compile("00$"))
+        self.rollout.is_enabled(self.FN, '0000000') | should.be_falsy
+
+    def test_remove_a_functionality(self):
+        self.rollout.remove_func(self.FN)
+        self.rollout.is_enabled(self.FN) | should.be_falsy
+
+    def test_decide_when_feature_not_exist(self):
+        decision = self.rollout.decide('bar', 'bar')
+        decision | should.eql(Decision(False, False, None, Decision.UNDEFINED))
+        bool(decision) | should.be_false()
+
+    def test_decide_when_feature_disabled(self):
+        self.rollout.disable(self.FN)
+        self.rollout.decide(self.FN) | should.eql(Decision(True, False, None, Decision.DISABLED))
+
+    def test_decide_globally(self):
+        decision = self.rollout.decide(self.FN)
+        decision | should.eql(Decision(True, True, None, Decision.GLOBAL))
+        bool(decision) | should.be_true()
+
+    def test_decide_for_an_item(self):
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.register(self.FN, 'bar')
+        self.rollout.decide(self.FN, 'bar') | should.eql(
+            Decision(True, True, None, Decision.MATCHED))
+        self.rollout.decide(self.FN, 'bazz') | should.eql(
+            Decision(True, False, None, Decision.NOT_MATCHED))
+
+    def test_decide_a_variant(self):
+        _variants = ['foo', 'bar', 'bazz']
+        self.rollout.add_func('variants', percentage=100, variants=_variants)
+        for user in ('juan', 'juan2', 'juan3'):
+            decision = self.rollout.decide('variants', user)
+            decision.enabled | should.be_true()
+            decision.variant | should.eql(self.rollout.backend.variant('variants', user))
+            self.rollout.variant('variants', user) | should.eql(decision.variant)
+
+    def test_decorator_check_fetches_the_functionality_once(self):
+        @self.rollout.check(self.FN)
+        def foo():
+            return True
+
+        backend = self.rollout.backend
+        loads = []
+        load = backend._load
+        backend._load = lambda name: loads.append(name) or load(name)
+        backend.get_functionality = None
+
+        self.rollout.register(self.FN, 'bar')
+        with self.rollout.current_id('bar'):
+            foo() | should.be_true()
+        loads | should.eql([self.FN])
+
+    def test_register_many(self):
+        self.rollout.set_percentage(self.FN, 0)
+        progress = []
+        users = (str(i) for i in range(25))
+        self.rollout.register_many(
+            self.FN, users, chunk_size=10, progress=progress.append) | should.eql(25)
+        progress | should.eql([10, 20, 25])
+        self.rollout.is_enabled(self.FN, '0') | should.be_true()
+        self.rollout.is_enabled(self.FN, '24') | should.be_true()
+        self.rollout.is_enabled(self.FN, '25') | should.be_false()
+
+    def test_register_many_validates_the_functionality_first(self):
+        consumed = []
+
+        def users():
+            consumed.append(True)
+            yield 'bar'
+        with should.throw(ValueError):
+            self.rollout.register_many('bar', users())
+        consumed | should.be_empty()
+
+    def test_is_feature_accessor(self):
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.register(self.FN, 'bar')
+        self.rollout.is_foo('bar') | should.be_true()
+        self.rollout.is_foo('bazz') | should.be_false()
+        self.rollout.is_foo() | should.be_true()
+        with should.throw(ValueError):
+            self.rollout.is_bar
+        with should.throw(AttributeError):
+            self.rollout.foo
+
+    def test_is_feature_accessor_is_cached(self):
+        accessor = self.rollout.is_foo
+        (self.rollout.is_foo is accessor) | should.be_true()
+        backend = self.rollout.backend
+        loads = []
+        load = backend._load
+        backend._load = lambda name: loads.append(name) or load(name)
+        self.rollout.is_foo() | should.be_true()
+        loads | should.eql([self.FN])
+        self.rollout.disable(self.FN)
+        self.rollout.is_foo() | should.be_false()
+
+    def test_is_feature_accessor_is_dropped_when_removed(self):
+        self.rollout.is_foo() | should.be_true()
+        self.rollout.remove_func(self.FN)
+        with should.throw(ValueError):
+            self.rollout.is_foo
+        self.rollout.add_func(self.FN, percentage=100)
+        self.rollout.is_foo() | should.be_true()
+
+    def test_is_feature_accessor_removed_elsewhere(self):
+        accessor = self.rollout.is_foo
+        self.rollout.backend.remove_functionality(self.FN)
+        with should.throw(ValueError):
+            accessor()
+        with should.throw(ValueError):
+            self.rollout.is_foo
+
+    def test_evaluate_all(self):
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.add_func('bar', percentage=100, variants=['a'])
+        self.rollout.add_func('bazz', percentage=0)
+        self.rollout.disable('bazz')
+        self.rollout.register(self.FN, Foo('1'))
+        self.rollout.evaluate_all('1') | should.eql({
+            self.FN: (False, None),
+            'bar': (True, 'a'),
+            'bazz': (False, None),
+        })
+
+    def test_variants_of_object_and_int_items(self):
+        _variants = ['foo', 'bar', 'bazz']
+        self.rollout.add_func('V', 'id', percentage=100, variants=_variants)
+        self.rollout.add_func('W', percentage=100, variants=_variants)
+
+        @self.rollout.check('V')
+        def foo():
+            return True
+
+        user = Foo('u1')
+        with self.rollout.current_id(user):
+            foo() | should.be_true()
+        self.rollout.is_V(user) | should.be_true()
+        # Same identifier, same variant
+        self.rollout.decide('V', user).variant | should.eql(self.rollout.variant('W', 'u1'))
+        self.rollout.decide('V', user).variant | should.be_in(_variants)
+        self.rollout.evaluate_all(user)['V'] | should.eql((True, self.rollout.variant('W', 'u1')))
+        self.rollout.decide('W', 12345).variant | should.eql(self.rollout.variant('W', '12345'))
+        self.rollout.is_W(12345) | should.be_true()
+
 
 class RolloutWithRedisTestCase(unittest.TestCase):
 
@@ -322,12 +603,21 @@ class RolloutWithRedisTestCase(unittest.TestCase):
         self.rollout.register(self.FN, re.compile("00$"))
         self.rollout.is_enabled(self.FN, Foo("0000010")) | should.be_truthy
 
-    def test_set_a_rule_overrides_previous_rule(self):
+    def test_set_several_rules(self):
         import re
         self.rollout.register(self.FN, re.compile("00$"))
         self.rollout.is_enabled(self.FN, Foo("0000010")) | should.be_falsy
         self.rollout.register(self.FN, re.compile("10$"))
         self.rollout.is_enabled(self.FN, Foo("0000010")) | should.be_truthy
+        self.rollout.is_enabled(self.FN, Foo("0000000")) | should.be_truthy
+
+    def test_unregister_a_rule_keeps_the_others(self):
+        import re
+        self.rollout.register(self.FN, re.compile("00$"))
+        self.rollout.register(self.FN, re.compile("10$"))
+        self.rollout.unregister(self.FN, re.compile("00$"))
+        self.rollout.is_enabled(self.FN, Foo("0000000")) | should.be_falsy
+        self.rollout.is_enabled(self.FN, Foo("0000010")) | should.be_truthy
 
     def test_decorator_enabled_decorator_when_feature_enabled(self):
         @self.rollout.enabled(self.FN)
@@ -372,6 +662,185 @@ class RolloutWithRedisTestCase(unittest.TestCase):
         self.rollout.register(self.FN, 'bar')
         foo(Foo('bar')) | should.eql('bar')
 
+    def test_is_enabled_many(self):
+        self.rollout.set_percentage(self.FN, 0)
+        for u in ('bar', '0000000'):
+            self.rollout.register(self.FN, u)
+        import re
+        self.rollout.register(self.FN, re.compile("10$"))
+        users = ['bar', 'bazz', '0000000', '0000010']
+        self.rollout.is_enabled_many(self.FN, users) | should.eql([True, False, True, True])
+
+    def test_is_enabled_many_when_feature_disabled(self):
+        self.rollout.register(self.FN, 'bar')
+        self.rollout.disable(self.FN)
+        self.rollout.is_enabled_many(self.FN, ['bar', 'bazz']) | should.eql([False, False])
+
+    def test_unregister_an_user(self):
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.register(self.FN, Foo('bar'))
+        self.rollout.unregister(self.FN, Foo('bar'))
+        self.rollout.is_enabled(self.FN, Foo('bar')) | should.be_falsy
+
+    def test_unregister_a_rule(self):
+        import re
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.register(self.FN, re.compile("00$"))
+        self.rollout.unregister(self.FN, re.compile("00$"))
+        self.rollout.is_enabled(self.FN, '0000000') | should.be_falsy
+
+    def test_remove_a_functionality(self):
+        self.rollout.remove_func(self.FN)
+        self.rollout.is_enabled(self.FN) | should.be_falsy
+
+    def test_decide_when_feature_not_exist(self):
+        decision = self.rollout.decide('bar', 'bar')
+        decision | should.eql(Decision(False, False, None, Decision.UNDEFINED))
+        bool(decision) | should.be_false()
+
+    def test_decide_when_feature_disabled(self):
+        self.rollout.disable(self.FN)
+        self.rollout.decide(self.FN) | should.eql(Decision(True, False, None, Decision.DISABLED))
+
+    def test_decide_globally(self):
+        decision = self.rollout.decide(self.FN)
+        decision | should.eql(Decision(True, True, None, Decision.GLOBAL))
+        bool(decision) | should.be_true()
+
+    def test_decide_for_an_item(self):
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.register(self.FN, 'bar')
+        self.rollout.decide(self.FN, 'bar') | should.eql(
+            Decision(True, True, None, Decision.MATCHED))
+        self.rollout.decide(self.FN, 'bazz') | should.eql(
+            Decision(True, False, None, Decision.NOT_MATCHED))
+
+    def test_decide_a_variant(self):
+        _variants = ['foo', 'bar', 'bazz']
+        self.rollout.add_func('variants', percentage=100, variants=_variants)
+        for user in ('juan', 'juan2', 'juan3'):
+            decision = self.rollout.decide('variants', user)
+            decision.enabled | should.be_true()
+            decision.variant | should.eql(self.rollout.backend.variant('variants', user))
+            self.rollout.variant('variants', user) | should.eql(decision.variant)
+
+    def test_decorator_check_fetches_the_functionality_once(self):
+        @self.rollout.check(self.FN)
+        def foo():
+            return True
+
+        backend = self.rollout.backend
+        loads = []
+        load = backend._load
+        backend._load = lambda name: loads.append(name) or load(name)
+        backend.get_functionality = None
+
+        self.rollout.register(self.FN, 'bar')
+        with self.rollout.current_id('bar'):
+            foo() | should.be_true()
+        loads | should.eql([self.FN])
+
+    def test_register_many(self):
+        self.rollout.set_percentage(self.FN, 0)
+        progress = []
+        users = (str(i) for i in range(25))
+        self.rollout.register_many(
+            self.FN, users, chunk_size=10, progress=progress.append) | should.eql(25)
+        progress | should.eql([10, 20, 25])
+        self.rollout.is_enabled(self.FN, '0') | should.be_true()
+        self.rollout.is_enabled(self.FN, '24') | should.be_true()
+        self.rollout.is_enabled(self.FN, '25') | should.be_false()
+
+    def test_register_many_validates_the_functionality_first(self):
+        consumed = []
+
+        def users():
+            consumed.append(True)
+            yield 'bar'
+        with should.throw(ValueError):
+            self.rollout.register_many('bar', users())
+        consumed | should.be_empty()
+
+    def test_is_feature_accessor(self):
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.register(self.FN, 'bar')
+        self.rollout.is_foo('bar') | should.be_true()
+        self.rollout.is_foo('bazz') | should.be_false()
+        self.rollout.is_foo() | should.be_true()
+        with should.throw(ValueError):
+            self.rollout.is_bar
+        with should.throw(AttributeError):
+            self.rollout.foo
+
+    def test_is_feature_accessor_is_cached(self):
+        accessor = self.rollout.is_foo
+        (self.rollout.is_foo is accessor) | should.be_true()
+        backend = self.rollout.backend
+        loads = []
+        load = backend._load
+        backend._load = lambda name: loads.append(name) or load(name)
+        self.rollout.is_foo() | should.be_true()
+        loads | should.eql([self.FN])
+        self.rollout.disable(self.FN)
+        self.rollout.is_foo() | should.be_false()
+
+    def test_is_feature_accessor_is_dropped_when_removed(self):
+        self.rollout.is_foo() | should.be_true()
+        self.rollout.remove_func(self.FN)
+        with should.throw(ValueError):
+            self.rollout.is_foo
+        self.rollout.add_func(self.FN, percentage=100)
+        self.rollout.is_foo() | should.be_true()
+
+    def test_is_feature_accessor_removed_elsewhere(self):
+        accessor = self.rollout.is_foo
+        self.rollout.backend.remove_functionality(self.FN)
+        with should.throw(ValueError):
+            accessor()
+        with should.throw(ValueError):
+            self.rollout.is_foo
+
+    def test_evaluate_all(self):
+        import re
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.add_func('bar', percentage=100, variants=['a'])
+        self.rollout.add_func('bazz', percentage=0)
+        self.rollout.add_func('rule', percentage=0)
+        self.rollout.add_func('whitelist', percentage=0, variants=['b', 'c'])
+        self.rollout.register('rule', re.compile('1$'))
+        self.rollout.register('whitelist', '1')
+        self.rollout.evaluate_all('1') | should.eql({
+            self.FN: (False, None),
+            'bar': (True, 'a'),
+            'bazz': (False, None),
+            'rule': (True, None),
+            'whitelist': (True, self.rollout.variant('whitelist', '1')),
+        })
+
+    def test_evaluate_all_without_functionalities(self):
+        self.rollout.remove_func(self.FN)
+        self.rollout.evaluate_all('1') | should.eql({})
+
+    def test_variants_of_object_and_int_items(self):
+        _variants = ['foo', 'bar', 'bazz']
+        self.rollout.add_func('V', 'id', percentage=100, variants=_variants)
+        self.rollout.add_func('W', percentage=100, variants=_variants)
+
+        @self.rollout.check('V')
+        def foo():
+            return True
+
+        user = Foo('u1')
+        with self.rollout.current_id(user):
+            foo() | should.be_true()
+        self.rollout.is_V(user) | should.be_true()
+        # Same identifier, same variant
+        self.rollout.decide('V', user).variant | should.eql(self.rollout.variant('W', 'u1'))
+        self.rollout.decide('V', user).variant | should.be_in(_variants)
+        self.rollout.evaluate_all(user)['V'] | should.eql((True, self.rollout.variant('W', 'u1')))
+        self.rollout.decide('W', 12345).variant | should.eql(self.rollout.variant('W', '12345'))
+        self.rollout.is_W(12345) | should.be_true()
+
 
 class RolloutWithRedisHighPerfTestCase(unittest.TestCase):
 
@@ -504,12 +973,21 @@ class RolloutWithRedisHighPerfTestCase(unittest.TestCase):
         self.rollout.register(self.FN, re.compile("00$"))
         self.rollout.is_enabled(self.FN, Foo("0000010")) | should.be_truthy
 
-    def test_set_a_rule_overrides_previous_rule(self):
+    def test_set_several_rules(self):
         import re
         self.rollout.register(self.FN, re.compile("00$"))
         self.rollout.is_enabled(self.FN, Foo("0000010")) | should.be_falsy
         self.rollout.register(self.FN, re.compile("10$"))
         self.rollout.is_enabled(self.FN, Foo("0000010")) | should.be_truthy
+        self.rollout.is_enabled(self.FN, Foo("0000000")) | should.be_truthy
+
+    def test_unregister_a_rule_keeps_the_others(self):
+        import re
+        self.rollout.register(self.FN, re.compile("00$"))
+        self.rollout.register(self.FN, re.compile("10$"))
+        self.rollout.unregister(self.FN, re.compile("00$"))
+        self.rollout.is_enabled(self.FN, Foo("0000000")) | should.be_falsy
+        self.rollout.is_enabled(self.FN, Foo("0000010")) | should.be_truthy
 
     def test_decorator_enabled_decorator_when_feature_enabled(self):
         @self.rollout.enabled(self.FN)
@@ -554,6 +1032,165 @@ class RolloutWithRedisHighPerfTestCase(unittest.TestCase):
         self.rollout.register(self.FN, 'bar')
         foo(Foo('bar')) | should.eql('bar')
 
+    def test_is_enabled_many(self):
+        self.rollout.set_percentage(self.FN, 0)
+        for u in ('bar', '0000000'):
+            self.rollout.register(self.FN, u)
+        import re
+        self.rollout.register(self.FN, re.compile("10$"))
+        users = ['bar', 'bazz', '0000000', '0000010']
+        self.rollout.is_enabled_many(self.FN, users) | should.eql([True, False, True, True])
+
+    def test_is_enabled_many_when_feature_disabled(self):
+        self.rollout.register(self.FN, 'bar')
+        self.rollout.disable(self.FN)
+        self.rollout.is_enabled_many(self.FN, ['bar', 'bazz']) | should.eql([False, False])
+
+    def test_unregister_an_user(self):
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.register(self.FN, Foo('bar'))
+        self.rollout.unregister(self.FN, Foo('bar'))
+        self.rollout.is_enabled(self.FN, Foo('bar')) | should.be_falsy
+
+    def test_unregister_a_rule(self):
+        import re
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.register(self.FN, re.compile("00$"))
+        self.rollout.unregister(self.FN, re.compile("00$"))
+        self.rollout.is_enabled(self.FN, '0000000') | should.be_falsy
+
+    def test_remove_a_functionality(self):
+        self.rollout.remove_func(self.FN)
+        self.rollout.is_enabled(self.FN) | should.be_falsy
+
+    def test_decide_when_feature_not_exist(self):
+        decision = self.rollout.decide('bar', 'bar')
+        decision | should.eql(Decision(False, False, None, Decision.UNDEFINED))
+        bool(decision) | should.be_false()
+
+    def test_decide_when_feature_disabled(self):
+        self.rollout.disable(self.FN)
+        self.rollout.decide(self.FN) | should.eql(Decision(True, False, None, Decision.DISABLED))
+
+    def test_decide_globally(self):
+        decision = self.rollout.decide(self.FN)
+        decision | should.eql(Decision(True, True, None, Decision.GLOBAL))
+        bool(decision) | should.be_true()
+
+    def test_decide_for_an_item(self):
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.register(self.FN, 'bar')
+        self.rollout.decide(self.FN, 'bar') | should.eql(
+            Decision(True, True, None, Decision.MATCHED))
+        self.rollout.decide(self.FN, 'bazz') | should.eql(
+            Decision(True, False, None, Decision.NOT_MATCHED))
+
+    def test_decide_a_variant(self):
+        _variants = ['foo', 'bar', 'bazz']
+        self.rollout.add_func('variants', percentage=100, variants=_variants)
+        for user in ('juan', 'juan2', 'juan3'):
+            decision = self.rollout.decide('variants', user)
+            decision.enabled | should.be_true()
+            decision.variant | should.eql(self.rollout.backend.variant('variants', user))
+            self.rollout.variant('variants', user) | should.eql(decision.variant)
+
+    def test_decorator_check_fetches_the_functionality_once(self):
+        @self.rollout.check(self.FN)
+        def foo():
+            return True
+
+        backend = self.rollout.backend
+        loads = []
+        load = backend._load
+        backend._load = lambda name: loads.append(name) or load(name)
+        backend.get_functionality = None
+
+        self.rollout.register(self.FN, 'bar')
+        with self.rollout.current_id('bar'):
+            foo() | should.be_true()
+        loads | should.eql([self.FN])
+
+    def test_register_many(self):
+        self.rollout.set_percentage(self.FN, 0)
+        progress = []
+        users = (str(i) for i in range(25))
+        self.rollout.register_many(
+            self.FN, users, chunk_size=10, progress=progress.append) | should.eql(25)
+        progress | should.eql([10, 20, 25])
+        self.rollout.is_enabled(self.FN, '0') | should.be_true()
+        self.rollout.is_enabled(self.FN, '24') | should.be_true()
+        self.rollout.is_enabled(self.FN, '25') | should.be_false()
+
+    def test_register_many_validates_the_functionality_first(self):
+        consumed = []
+
+        def users():
+            consumed.append(True)
+            yield 'bar'
+        with should.throw(ValueError):
+            self.rollout.register_many('bar', users())
+        consumed | should.be_empty()
+
+    def test_is_feature_accessor(self):
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.register(self.FN, 'bar')
+        self.rollout.is_foo('bar') | should.be_true()
+        self.rollout.is_foo('bazz') | should.be_false()
+        self.rollout.is_foo() | should.be_true()
+        with should.throw(ValueError):
+            self.rollout.is_bar
+        with should.throw(AttributeError):
+            self.rollout.foo
+
+    def test_is_feature_accessor_is_cached(self):
+        accessor = self.rollout.is_foo
+        (self.rollout.is_foo is accessor) | should.be_true()
+        backend = self.rollout.backend
+        loads = []
+        load = backend._load
+        backend._load = lambda name: loads.append(name) or load(name)
+        self.rollout.is_foo() | should.be_true()
+        loads | should.eql([self.FN])
+        self.rollout.disable(self.FN)
+        self.rollout.is_foo() | should.be_false()
+
+    def test_is_feature_accessor_is_dropped_when_removed(self):
+        self.rollout.is_foo() | should.be_true()
+        self.rollout.remove_func(self.FN)
+        with should.throw(ValueError):
+            self.rollout.is_foo
+        self.rollout.add_func(self.FN, percentage=100)
+        self.rollout.is_foo() | should.be_true()
+
+    def test_is_feature_accessor_removed_elsewhere(self):
+        accessor = self.rollout.is_foo
+        self.rollout.backend.remove_functionality(self.FN)
+        with should.throw(ValueError):
+            accessor()
+        with should.throw(ValueError):
+            self.rollout.is_foo
+
+    def test_evaluate_all(self):
+        import re
+        self.rollout.set_percentage(self.FN, 0)
+        self.rollout.add_func('bar', percentage=100, variants=['a'])
+        self.rollout.add_func('bazz', percentage=0)
+        self.rollout.add_func('rule', percentage=0)
+        self.rollout.add_func('whitelist', percentage=0, variants=['b', 'c'])
+        self.rollout.register('rule', re.compile('1$'))
+        self.rollout.register('whitelist', '1')
+        self.rollout.evaluate_all('1') | should.eql({
+            self.FN: (False, None),
+            'bar': (True, 'a'),
+            'bazz': (False, None),
+            'rule': (True, None),
+            'whitelist': (True, self.rollout.variant('whitelist', '1')),
+        })
+
+    def test_evaluate_all_without_functionalities(self):
+        self.rollout.remove_func(self.FN)
+        self.rollout.evaluate_all('1') | should.eql({})
+
     def test_create_feature_with_variants(self):
         FN = 'bar'
         _variants = ['BAR', 'BAZZ']
@@ -561,3 +1198,80 @@ class RolloutWithRedisHighPerfTestCase(unittest.TestCase):
         self.rollout.set_percentage(FN, 100)
         self.rollout.variant('bar', 'user') | should.be_in(_variants)
 
+    def test_variants_of_object_and_int_items(self):
+        _variants = ['foo', 'bar', 'bazz']
+        self.rollout.add_func('V', 'id', percentage=100, variants=_variants)
+        self.rollout.add_func('W', percentage=100, variants=_variants)
+
+        @self.rollout.check('V')
+        def foo():
+            return True
+
+        user = Foo('u1')
+        with self.rollout.current_id(user):
+            foo() | should.be_true()
+        self.rollout.is_V(user) | should.be_true()
+        # Same identifier, same variant
+        self.rollout.decide('V', user).variant | should.eql(self.rollout.variant('W', 'u1'))
+        self.rollout.decide('V', user).variant | should.be_in(_variants)
+        self.rollout.evaluate_all(user)['V'] | should.eql((True, self.rollout.variant('W', 'u1')))
+        self.rollout.decide('W', 12345).variant | should.eql(self.rollout.variant('W', '12345'))
+        self.rollout.is_W(12345) | should.be_true()
+
+
+class RolloutWithRedisHighPerfLuaTestCase(RolloutWithRedisHighPerfTestCase):
+
+    def _get_basic_rollout(self, fn):
+        rollout = Rollout(RedisHighPerfBackEnd(lua=True))
+        rollout.backend._redis.flushdb()
+        rollout.add_func(fn)
+        return rollout
+
+    def _count_round_trips(self):
+        backend = self.rollout.backend
+        calls = []
+        load, script = backend._load, backend._check_script
+        backend._load = lambda name: calls.append('load') or load(name)
+        backend._check_script = lambda **kw: calls.append('script') or script(**kw)
+        return calls
+
+    def test_decorator_check_fetches_the_functionality_once(self):
+        @self.rollout.check(self.FN)
+        def foo():
+            return True
+
+        self.rollout.register(self.FN, 'bar')
+        calls = self._count_round_trips()
+        with self.rollout.current_id('bar'):
+            foo() | should.be_true()
+        calls | should.eql(['script'])
+
+    def test_decorator_check_undefined_in_a_single_round_trip(self):
+        @self.rollout.check('bar')
+        def foo():
+            return True
+
+        calls = self._count_round_trips()
+        with self.rollout.current_id('bar'):
+            with should.throw(Exception, 'Feature <bar> is not defined'):
+                foo()
+        calls | should.eql(['script'])
+
+    def test_decide_in_a_single_round_trip(self):
+        _variants = ['foo', 'bar', 'bazz']
+        self.rollout.add_func('variants', percentage=100, variants=_variants)
+        self.rollout.disable(self.FN)
+        calls = self._count_round_trips()
+        self.rollout.variant('variants', 'juan') | should.be_in(_variants)
+        self.rollout.decide(self.FN, 'juan') | should.eql(
+            Decision(True, False, None, Decision.DISABLED))
+        self.rollout.decide('bar', 'juan') | should.eql(
+            Decision(False, False, None, Decision.UNDEFINED))
+        calls | should.eql(['script'] * 3)
+
+    def test_accessor_in_a_single_round_trip(self):
+        self.rollout.register(self.FN, 'bar')
+        accessor = getattr(self.rollout, 'is_' + self.FN)
+        calls = self._count_round_trips()
+        accessor('bar') | should.be_true()
+        calls | should.eql(['script'])
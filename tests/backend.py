@@ -3,8 +3,28 @@
 import unittest
 from pyshould import should, all_of
 import re
+import time
 
-from hanoi.backend import MemoryBackEnd, RedisBackEnd, RedisHighPerfBackEnd, Feature
+from hanoi.encoding import encode_users
+from hanoi.backend import (MemoryBackEnd, RedisBackEnd, RedisHighPerfBackEnd, Feature,
+                           VARIANT_BUCKETS, _MAX_UNKNOWN, _crc32, _pick_variant)
+
+WEIGHTED_VARIANTS = [('foo', 90), ('bar', 5), ('bazz', 5)]
+
+
+class Foo(object):
+    def __init__(self, id):
+        self.id = id
+
+
+def published_messages(pubsub, count, timeout=1):
+    deadline = time.time() + timeout
+    messages = []
+    while len(messages) < count and time.time() < deadline:
+        message = pubsub.get_message(timeout=0.05)
+        if message:
+            messages.append(message['data'])
+    return messages
 
 
 class FeatureTestCase(unittest.TestCase):
@@ -89,6 +109,63 @@ class FeatureTestCase(unittest.TestCase):
         with should.throw(AttributeError):
             f.bar
 
+    def test_variants_are_equally_weighted_by_default(self):
+        f = Feature('foo', variants=['foo', 'bar'])
+        f.variants | should.eql(['foo', 'bar'])
+        f.weights | should.be_none()
+
+    def test_weighted_variants(self):
+        f = Feature('foo', variants=WEIGHTED_VARIANTS)
+        f.variants | should.eql(['foo', 'bar', 'bazz'])
+        f.weights | should.eql([90, 5, 5])
+
+    def test_weighted_variants_allocation(self):
+        f = Feature('foo', variants=WEIGHTED_VARIANTS)
+        _pick_variant(f, 0) | should.eql('foo')
+        _pick_variant(f, 8999) | should.eql('foo')
+        _pick_variant(f, 9000) | should.eql('bar')
+        _pick_variant(f, 9500) | should.eql('bazz')
+        _pick_variant(f, VARIANT_BUCKETS + 9999) | should.eql('bazz')
+
+    def test_weighted_variants_distribution(self):
+        f = Feature('foo', variants=WEIGHTED_VARIANTS)
+        picks = [_pick_variant(f, _crc32(str(i))) for i in range(10000)]
+        picks.count('foo') | should.be_greater_than(8800)
+        picks.count('bar') | should.be_greater_than(400)
+        picks.count('bazz') | should.be_greater_than(400)
+
+    def test_adjusting_a_weight_keeps_most_assignments(self):
+        f = Feature('foo', variants=WEIGHTED_VARIANTS)
+        before = [_pick_variant(f, _crc32(str(i))) for i in range(10000)]
+        f.weights = [89, 6, 5]
+        after = [_pick_variant(f, _crc32(str(i))) for i in range(10000)]
+        moved = [(b, a) for b, a in zip(before, after) if b != a]
+        set(moved) | should.eql(set([('foo', 'bar')]))
+        len(moved) | should.be_less_than(200)
+
+    def test_setting_variants_resets_the_weights(self):
+        f = Feature('foo', variants=WEIGHTED_VARIANTS)
+        f.variants = ['foo', 'bar']
+        f.weights | should.be_none()
+        _pick_variant(f, 3) | should.eql('bar')
+
+    def test_a_weight_is_required_per_variant(self):
+        f = Feature('foo', variants=['foo', 'bar'])
+        with should.throw(AttributeError):
+            f.weights = [100]
+
+    def test_weights_should_be_positive_numbers(self):
+        with should.throw(AttributeError):
+            Feature('foo', variants=[('foo', 'bar')])
+        with should.throw(AttributeError):
+            Feature('foo', variants=[('foo', -1), ('bar', 2)])
+        with should.throw(AttributeError):
+            Feature('foo', variants=[('foo', 0), ('bar', 0)])
+
+    def test_variants_cannot_mix_names_and_weights(self):
+        with should.throw(AttributeError):
+            Feature('foo', variants=['foo', ('bar', 10)])
+
 
 class MemoryBackEndTestCase(unittest.TestCase):
     def setUp(self):
@@ -104,6 +181,17 @@ class MemoryBackEndTestCase(unittest.TestCase):
         self.backend.variant(fn, 'juan') | should.be_in(f.variants)
         self.backend.variant(fn, 'juan2') | should.be_in(f.variants)
 
+    def test_weighted_variants_are_persisted(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, variants=WEIGHTED_VARIANTS))
+        f = self.backend.get_functionality(fn)
+        f.variants | should.eql(['foo', 'bar', 'bazz'])
+        f.weights | should.eql([90, 5, 5])
+        expected = Feature(fn, variants=WEIGHTED_VARIANTS)
+        for i in range(200):
+            user = str(i)
+            self.backend.variant(fn, user) | should.eql(_pick_variant(expected, _crc32(user)))
+
     def test_retrieve_a_variant_is_none_if_disabled(self):
         fn = "FOO"
         _variants = ["foo", "bar", "bazz"]
@@ -113,6 +201,64 @@ class MemoryBackEndTestCase(unittest.TestCase):
         self.backend.variant(fn, 'juan') | should.be_none()
         self.backend.variant(fn, 'juan2') | should.be_none()
 
+    def test_add_an_existing_user_is_not_duplicated(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        self.backend.add(fn, "bar")
+        self.backend.add(fn, "bar")
+        self.backend.reg[fn] | should.have_len(1)
+
+    def test_remove_an_user(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        self.backend.add(fn, "bar")
+        self.backend.remove(fn, "bar")
+        self.backend.is_enabled(fn, "bar") | should.be_false()
+
+    def test_is_enabled_does_not_create_a_whitelist(self):
+        self.backend.is_enabled("FOO", "bar") | should.be_false()
+        self.backend.reg | should.be_empty()
+
+    def test_checking_unknown_functionalities_is_cached_up_to_a_limit(self):
+        for i in range(_MAX_UNKNOWN + 10):
+            self.backend.is_enabled("FOO%d" % i, "bar") | should.be_false()
+        self.backend._decisions | should.have_len(_MAX_UNKNOWN)
+        self.backend.add_functionality(Feature("FOO0"))
+        self.backend.is_enabled("FOO0", "bar") | should.be_true()
+
+    def test_decision_is_rebuilt_when_the_functionality_changes(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        self.backend.is_enabled(fn, "4400") | should.be_false()
+        self.backend.set_rule(fn, re.compile(r"00$"))
+        self.backend.is_enabled(fn, "4400") | should.be_true()
+        self.backend.set_percentage(fn, 100)
+        self.backend.is_enabled(fn, "bar") | should.be_true()
+        self.backend.disable(fn)
+        self.backend.is_enabled(fn, "bar") | should.be_false()
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        self.backend.is_enabled(fn, "bar") | should.be_false()
+        self.backend.is_enabled(fn) | should.be_true()
+
+    def test_decision_sees_the_users_added_later(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        self.backend.is_enabled(fn, "bar") | should.be_false()
+        self.backend.add(fn, "bar")
+        self.backend.is_enabled(fn, "bar") | should.be_true()
+        self.backend.remove(fn, "bar")
+        self.backend.is_enabled(fn, "bar") | should.be_false()
+
+    def test_remove_a_functionality(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        self.backend.add(fn, "bar")
+        self.backend.set_rule(fn, re.compile(r"00$"))
+        self.backend.remove_functionality(fn)
+        self.backend.get_functionalities() | should.be_empty()
+        self.backend.reg | should.be_empty()
+        self.backend.rules | should.be_empty()
+
 
 class RedisBackEndTestCase(unittest.TestCase):
 
@@ -177,6 +323,58 @@ class RedisBackEndTestCase(unittest.TestCase):
         f, users = self.backend._get_functionality(fn)
         users | should.eql(['bar'])
 
+    def test_add_an_user_appends_it(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, "id"))
+        before = self.backend._redis.get("h:FOO")
+        self.backend.add(fn, Foo("bar"))
+        self.backend._redis.get("h:FOO") | should.eql(before + encode_users(["bar"]))
+
+    def test_add_an_user_to_a_functionality_not_defined(self):
+        with should.throw(ValueError):
+            self.backend.add("FOO", "bar")
+        self.backend._redis.get("h:FOO") | should.be_none()
+
+    def test_duplicated_users_are_dropped_upon_update(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        self.backend.add(fn, "bar")
+        self.backend.add(fn, "bar")
+        self.backend.is_enabled(fn, "bar") | should.be_true()
+        self.backend.set_percentage(fn, 10)
+        self.backend._redis.get("h:FOO") | should.eql(
+            self.backend.serialize_feature(Feature(fn, percentage=10), ["bar"]))
+        self.backend.remove(fn, "bar")
+        self.backend.is_enabled(fn, "bar") | should.be_false()
+
+    def test_add_many_users(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        for i in range(2000):
+            self.backend.add(fn, str(i))
+        self.backend._get_functionality(fn)[1] | should.eql([str(i) for i in range(2000)])
+        self.backend.is_enabled(fn, "1999") | should.be_true()
+
+    def test_updates_do_not_lose_the_users_added_meanwhile(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0), ["bar"])
+        other = RedisBackEnd(self.backend._redis)
+        editable = self.backend._editable
+        calls = []
+
+        def racing(definition):
+            # Another process adds an user after the functionality was read
+            if not calls:
+                other.add(fn, "bazz")
+            calls.append(definition)
+            return editable(definition)
+        self.backend._editable = racing
+        self.backend.set_percentage(fn, 50)
+        calls | should.have_len(2)
+        f, users = other._get_functionality(fn)
+        f.percentage | should.eql(50)
+        users | should.eql(["bar", "bazz"])
+
     def test_is_enabled_func_does_not_exist(self):
         fn = "FOO"
         self.backend.is_enabled(fn) | should.be_falsy()
@@ -272,6 +470,77 @@ class RedisBackEndTestCase(unittest.TestCase):
         self.backend.variant(fn, 'juan') | should.be_in(f.variants)
         self.backend.variant(fn, 'juan2') | should.be_in(f.variants)
 
+    def test_weighted_variants_are_persisted(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, variants=WEIGHTED_VARIANTS))
+        f = self.backend._get_functionality(fn)[0]
+        f.variants | should.eql(['foo', 'bar', 'bazz'])
+        f.weights | should.eql([90, 5, 5])
+        expected = Feature(fn, variants=WEIGHTED_VARIANTS)
+        for i in range(200):
+            user = str(i)
+            self.backend.variant(fn, user) | should.eql(_pick_variant(expected, _crc32(user)))
+
+    def test_read_legacy_values(self):
+        self.backend._redis.set("h:FOO", "1|0||bar,bazz|foo:90,bar:10")
+        f, users = self.backend._get_functionality("FOO")
+        users | should.eql(["bar", "bazz"])
+        f.weights | should.eql([90, 10])
+        self.backend.is_enabled("FOO", "bazz") | should.be_true()
+        self.backend.is_enabled("FOO", "foo") | should.be_false()
+        self.backend.add("FOO", "foo")
+        self.backend._get_functionality("FOO")[1] | should.eql(["bar", "bazz", "foo"])
+
+    def test_read_legacy_variants_with_colons(self):
+        self.backend._redis.set("h:FOO", "1|100|||color:red,color:blue")
+        f = self.backend.get_functionality("FOO")
+        f.variants | should.eql(["color:red", "color:blue"])
+        f.weights | should.be_none()
+        self.backend.variant("FOO", "bar") | should.eql(_pick_variant(f, _crc32("bar")))
+
+    def test_add_many_rewrites_a_legacy_value(self):
+        self.backend._redis.set("h:FOO", "1|0||bar|")
+        self.backend.add_many("FOO", ["bazz", "foo"]) | should.eql(2)
+        self.backend._get_functionality("FOO")[1] | should.eql(["bar", "bazz", "foo"])
+
+    def test_whitelisted_twice_is_read_once_and_dropped_on_rewrite(self):
+        self.backend.add_functionality(Feature("FOO", percentage=0))
+        self.backend.add("FOO", "bar")
+        self.backend.add_many("FOO", ["bazz", "foo", "bazz"])
+        size = self.backend._redis.strlen("h:FOO")
+        self.backend.add("FOO", "bar")
+        self.backend.add_many("FOO", ["foo", "bar"])
+        self.backend._redis.strlen("h:FOO") | should.eql(size + len(encode_users(["bar", "foo", "bar"])))
+        self.backend._get_functionality("FOO")[1] | should.eql(["bar", "bazz", "foo"])
+        sum(self.backend.iter_whitelist("FOO"), []) | should.eql(["bar", "bazz", "foo"])
+        self.backend.set_percentage("FOO", 10)
+        self.backend._redis.strlen("h:FOO") | should.eql(size)
+        self.backend.is_enabled("FOO", "foo") | should.be_true()
+
+    def test_whitelisting_an_item_contained_in_another_one(self):
+        self.backend.add_functionality(Feature("FOO", percentage=0))
+        # Encoded, "ab" is found within the first user
+        self.backend.add("FOO", "z\x00\x02ab")
+        self.backend.add("FOO", "ab")
+        self.backend.is_enabled("FOO", "ab") | should.be_true()
+        self.backend._get_functionality("FOO")[1] | should.eql(["z\x00\x02ab", "ab"])
+
+    def test_add_many_appends_a_chunk_at_once(self):
+        self.backend.add_functionality(Feature("FOO", "id"))
+        before = self.backend._redis.get("h:FOO")
+        self.backend.add_many("FOO", [Foo("bar"), Foo("bazz")], chunk_size=2)
+        self.backend._redis.get("h:FOO") | should.eql(before + encode_users(["bar", "bazz"]))
+
+    def test_identifiers_with_separators(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0, variants=["a|b", "c,d"]))
+        self.backend.add(fn, "bar,bazz")
+        self.backend.add(fn, "bar|bazz")
+        self.backend.is_enabled(fn, "bar,bazz") | should.be_true()
+        self.backend.is_enabled(fn, "bar|bazz") | should.be_true()
+        self.backend.is_enabled(fn, "bar") | should.be_false()
+        self.backend.variant(fn, "bar,bazz") | should.be_in(["a|b", "c,d"])
+
     def test_retrieve_a_variant_is_none_if_disabled(self):
         fn = "FOO"
         _variants = ["foo", "bar", "bazz"]
@@ -281,6 +550,65 @@ class RedisBackEndTestCase(unittest.TestCase):
         self.backend.variant(fn, 'juan') | should.be_none()
         self.backend.variant(fn, 'juan2') | should.be_none()
 
+    def test_remove_a_functionality_unregisters_it(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn))
+        self.backend.remove_functionality(fn)
+        self.backend.get_functionalities() | should.be_empty()
+        self.backend.is_enabled(fn) | should.be_falsy()
+
+    def test_changes_are_published(self):
+        pubsub = self.backend._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.backend.channel)
+        self.backend.add_functionality(Feature("FOO"))
+        self.backend.disable("FOO")
+        self.backend.add("FOO", "bar")
+        self.backend.remove_functionality("FOO")
+        published_messages(pubsub, 4) | should.eql([b"FOO"] * 4)
+        pubsub.close()
+
+    def test_migrate_registry(self):
+        # Keyspace created before the registry existed
+        self.backend._redis.set("h:FOO", "1|100|||")
+        self.backend._redis.set("h:BAR", "0|50||bar|")
+        self.backend._redis.sadd("h:users:BAR", "bar")
+        self.backend.get_functionalities() | should.be_empty()
+
+        self.backend.migrate_registry(count=1) | should.eql(2)
+        sorted(self.backend.get_functionalities()) | should.eql(["BAR", "FOO"])
+        self.backend.migrate_registry() | should.eql(2)
+        self.backend.get_functionalities() | should.have_len(2)
+
+    def test_rules_are_shared_between_processes(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        other = self.backend.__class__(self.backend._redis)
+        other.set_rule(fn, re.compile(r"00$"))
+        self.backend.is_enabled(fn, "4400") | should.be_true()
+        other.remove_rule(fn, re.compile(r"00$"))
+        self.backend.is_enabled(fn, "4400") | should.be_false()
+
+    def test_rules_are_compiled_once_per_version(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        self.backend.set_rule(fn, re.compile(r"00$"))
+        self.backend.is_enabled(fn, "4400") | should.be_true()
+        rules = self.backend.rules[fn]
+        self.backend.is_enabled(fn, "4401") | should.be_false()
+        (self.backend.rules[fn] is rules) | should.be_true()
+        self.backend.set_rule(fn, re.compile(r"01$"))
+        self.backend.is_enabled(fn, "4401") | should.be_true()
+        (self.backend.rules[fn] is rules) | should.be_false()
+
+    def test_remove_a_functionality_removes_its_rules(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        self.backend.set_rule(fn, re.compile(r"00$"))
+        self.backend.is_enabled(fn, "4400") | should.be_true()
+        self.backend.remove_functionality(fn)
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        self.backend.is_enabled(fn, "4400") | should.be_false()
+
 
 class RedisHighPerfBackEndTestCase(unittest.TestCase):
 
@@ -288,9 +616,44 @@ class RedisHighPerfBackEndTestCase(unittest.TestCase):
         self.backend = RedisHighPerfBackEnd()
         self.backend._redis.flushdb()
 
-    def test_get_functionalities_not_implemented(self):
-        with should.throw(NotImplementedError):
-            self.backend.get_functionalities()
+    def test_get_functionalities(self):
+        self.backend.get_functionalities() | should.be_empty()
+        for i in range(25):
+            self.backend.add_functionality(Feature("FOO%d" % i))
+        self.backend.remove_functionality("FOO0")
+        names = self.backend.get_functionalities(count=10)
+        sorted(names) | should.eql(sorted("FOO%d" % i for i in range(1, 25)))
+
+    def test_get_functionalities_page(self):
+        for i in range(25):
+            self.backend.add_functionality(Feature("FOO%d" % i))
+        names = set()
+        cursor, pages = 0, 0
+        while True:
+            cursor, page = self.backend.get_functionalities_page(cursor, count=10)
+            names.update(page)
+            pages += 1
+            if cursor == 0:
+                break
+        names | should.have_len(25)
+        pages | should.be_greater_than(1)
+
+    def test_get_functionalities_detail(self):
+        self.backend.add_functionality(Feature("FOO", percentage=10), ['1', '2', '3'])
+        self.backend.add_functionality(Feature("BAR", 'id', variants=['a', 'b']))
+        details = self.backend.get_functionalities_detail()
+        sorted(details) | should.eql(["BAR", "FOO"])
+        foo, users = details["FOO"]
+        foo.percentage | should.eql(10)
+        users | should.eql(3)
+        bar, users = details["BAR"]
+        bar.variants | should.eql(['a', 'b'])
+        users | should.eql(0)
+
+    def test_get_functionalities_detail_of_some_names(self):
+        self.backend.add_functionality(Feature("FOO"))
+        self.backend.add_functionality(Feature("BAR"))
+        list(self.backend.get_functionalities_detail(["BAR", "BAZ"])) | should.eql(["BAR"])
 
     def test_add_a_functionality(self):
         fn = "FOO"
@@ -453,6 +816,56 @@ class RedisHighPerfBackEndTestCase(unittest.TestCase):
         self.backend.variant(fn, 'juan') | should.be_in(f.variants)
         self.backend.variant(fn, 'juan2') | should.be_in(f.variants)
 
+    def test_weighted_variants_are_persisted(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, variants=WEIGHTED_VARIANTS))
+        f = self.backend._get_functionality(fn)
+        f.variants | should.eql(['foo', 'bar', 'bazz'])
+        f.weights | should.eql([90, 5, 5])
+        expected = Feature(fn, variants=WEIGHTED_VARIANTS)
+        for i in range(200):
+            user = str(i)
+            self.backend.variant(fn, user) | should.eql(_pick_variant(expected, _crc32(user)))
+
+    def test_weighted_variants_serialization(self):
+        f = Feature("FOO", variants=WEIGHTED_VARIANTS)
+        value = RedisHighPerfBackEnd.serialize_feature(f)
+        RedisHighPerfBackEnd.unserialize_feature("FOO", value).weights | should.eql([90, 5, 5])
+        legacy = RedisHighPerfBackEnd.unserialize_feature("FOO", '1|100||foo:90,bar:5,bazz:5')
+        legacy.weights | should.eql([90, 5, 5])
+        RedisHighPerfBackEnd.unserialize_feature("FOO", '1|100||foo,bar').weights | should.be_none()
+
+    def test_read_legacy_values(self):
+        self.backend._redis.set("h:FOO", "1|0|id|foo:90,bar:5,bazz:5")
+        self.backend._redis.sadd("h:users:FOO", "bar")
+        f = self.backend.get_functionality("FOO")
+        f.field | should.eql("id")
+        f.percentage | should.eql(0)
+        self.backend.is_enabled("FOO", Foo("bar")) | should.be_true()
+        self.backend.is_enabled("FOO", Foo("bazz")) | should.be_false()
+        self.backend._redis.set("h:BAR", "1|100||foo:90,bar:5,bazz:5")
+        expected = Feature("BAR", variants=WEIGHTED_VARIANTS)
+        for i in range(100):
+            user = str(i)
+            self.backend.variant("BAR", user) | should.eql(_pick_variant(expected, _crc32(user)))
+        self.backend._redis.set("h:BAZZ", "0|100||foo,bar")
+        self.backend.is_enabled("BAZZ", "bar") | should.be_false()
+
+    def test_read_legacy_variants_with_colons(self):
+        self.backend._redis.set("h:FOO", "1|100||color:red,color:blue")
+        f = self.backend.get_functionality("FOO")
+        f.variants | should.eql(["color:red", "color:blue"])
+        f.weights | should.be_none()
+        for user in ("bar", "bazz", "juan"):
+            self.backend.variant("FOO", user) | should.eql(_pick_variant(f, _crc32(user)))
+
+    def test_legacy_values_are_rewritten_encoded(self):
+        self.backend._redis.set("h:FOO", "1|100||foo,bar")
+        self.backend.disable("FOO")
+        self.backend._redis.get("h:FOO") | should.eql(
+            RedisHighPerfBackEnd.serialize_feature(self.backend.get_functionality("FOO")))
+        self.backend.get_functionality("FOO").variants | should.eql(["foo", "bar"])
+
     def test_retrieve_a_variant_is_none_if_disabled(self):
         fn = "FOO"
         _variants = ["foo", "bar", "bazz"]
@@ -461,3 +874,222 @@ class RedisHighPerfBackEndTestCase(unittest.TestCase):
         f.name | should.eql(fn)
         self.backend.variant(fn, 'juan') | should.be_none()
         self.backend.variant(fn, 'juan2') | should.be_none()
+
+    def test_is_enabled_many(self):
+        fn = "FOO"
+        users = ["bar" + str(i) for i in range(100)]
+        self.backend.add_functionality(Feature(fn, None, 0), users[::2])
+        expected = [i % 2 == 0 for i in range(100)]
+        self.backend.is_enabled_many(fn, users) | should.eql(expected)
+
+    def test_is_enabled_many_accepts_a_generator(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, None, 0), ["bar"])
+        users = (u for u in ["bar", "bazz"])
+        self.backend.is_enabled_many(fn, users) | should.eql([True, False])
+
+    def test_changes_are_published(self):
+        pubsub = self.backend._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.backend.channel)
+        self.backend.add_functionality(Feature("FOO"))
+        self.backend.set_percentage("FOO", 10)
+        self.backend.add("FOO", "bar")
+        self.backend.remove("FOO", "bar")
+        published_messages(pubsub, 4) | should.eql([b"FOO"] * 4)
+        pubsub.close()
+
+    def test_changes_are_not_published_without_channel(self):
+        backend = RedisHighPerfBackEnd(self.backend._redis, channel=None)
+        pubsub = self.backend._redis.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.backend.channel)
+        backend.add_functionality(Feature("FOO"))
+        published_messages(pubsub, 1, timeout=0.2) | should.be_empty()
+        pubsub.close()
+
+    def test_registry_is_maintained(self):
+        self.backend.add_functionality(Feature("FOO"))
+        self.backend.add_functionality(Feature("BAR"))
+        self.backend.remove_functionality("BAR")
+        self.backend._functionality_names() | should.eql(["FOO"])
+
+    def test_rules_are_shared_between_processes(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        other = self.backend.__class__(self.backend._redis)
+        other.set_rule(fn, re.compile(r"00$"))
+        self.backend.is_enabled(fn, "4400") | should.be_true()
+        other.remove_rule(fn, re.compile(r"00$"))
+        self.backend.is_enabled(fn, "4400") | should.be_false()
+
+    def test_rules_are_compiled_once_per_version(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        self.backend.set_rule(fn, re.compile(r"00$"))
+        self.backend.is_enabled(fn, "4400") | should.be_true()
+        rules = self.backend.rules[fn]
+        self.backend.is_enabled(fn, "4401") | should.be_false()
+        (self.backend.rules[fn] is rules) | should.be_true()
+        self.backend.set_rule(fn, re.compile(r"01$"))
+        self.backend.is_enabled(fn, "4401") | should.be_true()
+        (self.backend.rules[fn] is rules) | should.be_false()
+
+    def test_remove_a_functionality_removes_its_rules(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        self.backend.set_rule(fn, re.compile(r"00$"))
+        self.backend.is_enabled(fn, "4400") | should.be_true()
+        self.backend.remove_functionality(fn)
+        self.backend.add_functionality(Feature(fn, percentage=0))
+        self.backend.is_enabled(fn, "4400") | should.be_false()
+
+    def _bloom_backend(self, users=100):
+        # The Bloom filter is not used by the Lua check
+        backend = RedisHighPerfBackEnd(self.backend._redis)
+        backend.add_functionality(Feature("FOO", percentage=0), [str(i) for i in range(users)])
+        return backend
+
+    def _count_sismember(self, backend):
+        calls = []
+        sismember = backend._redis.sismember
+
+        def counting(*args):
+            calls.append(args)
+            return sismember(*args)
+        backend._redis.sismember = counting
+        return calls
+
+    def test_bloom_filter_discards_users_locally(self):
+        backend = self._bloom_backend()
+        bloom = backend.use_bloom("FOO")
+        len(bloom) | should.eql(100)
+        bloom.capacity | should.eql(RedisHighPerfBackEnd.BLOOM_MIN_CAPACITY)
+        calls = self._count_sismember(backend)
+        backend.is_enabled("FOO", "5") | should.be_true()
+        calls | should.have_len(1)
+        misses = [str(i) for i in range(1000, 2000)]
+        any(backend.is_enabled("FOO", i) for i in misses) | should.be_false()
+        len(calls) | should.be_less_than(1 + 20)
+
+    def test_bloom_filter_in_bulk_checks(self):
+        backend = self._bloom_backend()
+        backend.use_bloom("FOO")
+        backend.is_enabled_many("FOO", ["1", "1000", "99"]) | should.eql([True, False, True])
+        backend.evaluate_all("1")["FOO"] | should.eql((True, None))
+        backend.evaluate_all("1000")["FOO"] | should.eql((False, None))
+
+    def test_bloom_filter_is_kept_current_on_add(self):
+        backend = self._bloom_backend()
+        backend.use_bloom("FOO")
+        backend.add("FOO", "bar")
+        backend.add_many("FOO", ["baz", "qux"])
+        backend.is_enabled_many("FOO", ["bar", "baz", "qux"]) | should.eql([True, True, True])
+        len(backend.blooms["FOO"]) | should.eql(103)
+
+    def test_bloom_filter_sees_changes_of_other_processes(self):
+        backend = self._bloom_backend()
+        backend.use_bloom("FOO")
+        self.backend.add("FOO", "bar")
+        # Checked in REDIS until rebuilt
+        backend.is_enabled("FOO", "bar") | should.be_true()
+        backend.is_enabled_many("FOO", ["bar", "1000"]) | should.eql([True, False])
+        backend.evaluate_all("bar")["FOO"] | should.eql((True, None))
+        deadline = time.time() + 2
+        while "FOO" not in backend.blooms:
+            time.sleep(0.01)
+            time.time() | should.be_less_than(deadline)
+        "bar" | should.be_in(backend.blooms["FOO"])
+        backend.is_enabled("FOO", "bar") | should.be_true()
+
+    def test_bloom_filter_is_not_rebuilt_on_own_changes(self):
+        backend = self._bloom_backend()
+        bloom = backend.use_bloom("FOO")
+        builds = []
+        backend.rebuild_bloom = lambda *args, **kwargs: builds.append(args)
+        backend.add("FOO", "bar")
+        backend.add_many("FOO", ["baz", "qux"], chunk_size=1)
+        backend.remove("FOO", "1")
+        backend.add_functionality(Feature("FOO", percentage=0), ["quux"])
+        backend.is_enabled("FOO", "bar") | should.be_true()
+        backend.is_enabled("FOO", "1") | should.be_false()
+        backend.is_enabled("FOO", "1000") | should.be_false()
+        builds | should.be_empty()
+        backend.blooms["FOO"] | should.be(bloom)
+
+    def test_bloom_filter_built_while_whitelisting(self):
+        backend = self._bloom_backend()
+        backend.use_bloom("FOO")
+        backend.blooms.clear()
+        # Whitelisted by this process while building the filter
+        sscan_iter = backend._redis.sscan_iter
+
+        def scanning(*args, **kwargs):
+            backend.add("FOO", "bar")
+            return sscan_iter(*args, **kwargs)
+        backend._redis.sscan_iter = scanning
+        bloom = backend.rebuild_bloom("FOO")
+        del backend._redis.sscan_iter
+        "bar" | should.be_in(bloom)
+        backend.rebuild_bloom = lambda *args, **kwargs: None
+        backend.is_enabled("FOO", "bar") | should.be_true()
+        backend.blooms["FOO"] | should.be(bloom)
+
+    def test_bloom_filter_stats(self):
+        backend = self._bloom_backend(users=10)
+        bloom = backend.use_bloom("FOO", error_rate=0.001, capacity=10)
+        bloom.capacity | should.eql(10)
+        bloom.size | should.be_less_than(64)
+        bloom.false_positive_rate | should.be_less_than(0.0011)
+
+    def test_bloom_filter_is_rebuilt_once_full(self):
+        backend = self._bloom_backend(users=10)
+        backend.use_bloom("FOO", capacity=None)
+        backend.add_many("FOO", [str(i) for i in range(10, 1100)])
+        deadline = time.time() + 2
+        while backend.blooms.get("FOO") is None or \
+                backend.blooms["FOO"].capacity == RedisHighPerfBackEnd.BLOOM_MIN_CAPACITY:
+            time.sleep(0.01)
+            time.time() | should.be_less_than(deadline)
+        backend.blooms["FOO"].capacity | should.eql(2200)
+        backend.is_enabled("FOO", "1099") | should.be_true()
+
+    def test_drop_bloom(self):
+        backend = self._bloom_backend()
+        backend.use_bloom("FOO")
+        backend.drop_bloom("FOO")
+        backend.blooms | should.be_empty()
+        backend.rebuild_bloom("FOO") | should.be_none()
+        self.backend.add("FOO", "bar")
+        backend.is_enabled("FOO", "bar") | should.be_true()
+
+
+class RedisHighPerfLuaBackEndTestCase(RedisHighPerfBackEndTestCase):
+
+    def setUp(self):
+        self.backend = RedisHighPerfBackEnd(lua=True)
+        self.backend._redis.flushdb()
+
+    def test_variant_is_the_same_than_without_lua(self):
+        fn = "FOO"
+        _variants = ["foo", "bar", "bazz"]
+        self.backend.add_functionality(Feature(fn, variants=_variants))
+        backend = RedisHighPerfBackEnd(self.backend._redis)
+        for user in ("juan", "juan2", "juan3", 44401):
+            self.backend.variant(fn, user) | should.eql(backend.variant(fn, str(user)))
+
+    def test_variant_is_none_without_variants(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn))
+        self.backend.variant(fn, "juan") | should.be_none()
+
+    def test_is_enabled_with_a_numeric_identifier(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, None, 0), ["44401"])
+        self.backend.is_enabled(fn, 44401) | should.be_true()
+        self.backend.is_enabled(fn, 44402) | should.be_false()
+
+    def test_script_is_reloaded_after_a_flush(self):
+        fn = "FOO"
+        self.backend.add_functionality(Feature(fn, None, 0), ["bar"])
+        self.backend.is_enabled(fn, "bar") | should.be_true()
+        self.backend._redis.script_flush()
+        self.backend.is_enabled(fn, "bar") | should.be_true()
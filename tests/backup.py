@@ -0,0 +1,144 @@
+# -*- encoding: utf-8 -*-
+
+import io
+import json
+import re
+import unittest
+from pyshould import should
+
+import hanoi
+from hanoi.backend import MemoryBackEnd, RedisBackEnd, RedisHighPerfBackEnd, Feature
+from hanoi.cache import CachingBackEnd
+
+
+class Foo(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class BackupTestCase(unittest.TestCase):
+
+    def _get_backend(self):
+        return MemoryBackEnd()
+
+    def _get_target(self):
+        return MemoryBackEnd()
+
+    def setUp(self):
+        self.backend = self._get_backend()
+        self.backend.add_functionality(Feature('foo', percentage=0))
+        self.backend.add_many('foo', [str(i) for i in range(25)])
+        self.backend.set_rule('foo', re.compile(r'01$'))
+        bar = Feature('bar', 'id', 20, [('a', 90), ('b', 10)])
+        bar.enabled = False
+        self.backend.add_functionality(bar)
+        self.backend.add_many('bar', [Foo('u1'), Foo('u2')])
+
+    def _dump(self, backend=None, chunk_size=10):
+        fp = io.StringIO()
+        hanoi.dump(backend or self.backend, fp, chunk_size) | should.eql(2)
+        return fp.getvalue()
+
+    def _load(self, backend, text):
+        return hanoi.load(backend, io.StringIO(text))
+
+    def test_dump_is_json_lines(self):
+        records = [json.loads(line) for line in self._dump().splitlines()]
+        records[0] | should.eql({'type': 'hanoi', 'version': 1})
+        [r['type'] for r in records] | should.eql(
+            ['hanoi', 'functionality', 'users', 'functionality', 'rule', 'users', 'users', 'users'])
+        records[1] | should.eql({
+            'type': 'functionality', 'name': 'bar', 'field': 'id', 'percentage': 20,
+            'enabled': False, 'variants': ['a', 'b'], 'weights': [90, 10]
+        })
+        records[4] | should.eql({
+            'type': 'rule', 'name': 'foo', 'pattern': '01$', 'flags': re.compile('01$').flags
+        })
+
+    def test_whitelists_are_written_in_chunks(self):
+        records = [json.loads(line) for line in self._dump().splitlines()]
+        chunks = [r['users'] for r in records if r['type'] == 'users' and r['name'] == 'foo']
+        [len(c) for c in chunks] | should.eql([10, 10, 5])
+        sorted(sum(chunks, [])) | should.eql(sorted(str(i) for i in range(25)))
+
+    def test_load(self):
+        target = self._get_target()
+        self._load(target, self._dump()) | should.eql(2)
+        foo = target.get_functionality('foo')
+        foo.percentage | should.eql(0)
+        target.is_enabled('foo', '24') | should.be_true()
+        target.is_enabled('foo', '4401') | should.be_true()
+        target.is_enabled('foo', '4400') | should.be_false()
+        bar = target.get_functionality('bar')
+        bar.enabled | should.be_false()
+        bar.field | should.eql('id')
+        bar.variants | should.eql(['a', 'b'])
+        bar.weights | should.eql([90, 10])
+        # Identifiers as stored, not resolved again by the field
+        sorted(sum(target.iter_whitelist('bar'), [])) | should.eql(['u1', 'u2'])
+
+    def test_load_replaces_the_functionalities(self):
+        text = self._dump()
+        target = self._get_target()
+        target.add_functionality(Feature('foo', percentage=0))
+        target.add('foo', 'bazz')
+        target.add_functionality(Feature('other'))
+        self._load(target, text)
+        target.is_enabled('foo', 'bazz') | should.be_false()
+        target.is_enabled('foo', '1') | should.be_true()
+        target.is_enabled('other') | should.be_true()
+
+    def test_dump_through_a_cache(self):
+        text = self._dump(CachingBackEnd(self.backend))
+        text | should.eql(self._dump())
+
+    def test_unsupported_version(self):
+        with should.throw(ValueError):
+            self._load(self._get_target(), u'{"type": "hanoi", "version": 2}\n')
+
+    def test_unknown_record(self):
+        with should.throw(ValueError):
+            self._load(self._get_target(), u'{"type": "foo"}\n')
+
+
+class BackupRedisTestCase(BackupTestCase):
+
+    def _get_backend(self):
+        backend = RedisHighPerfBackEnd()
+        backend._redis.flushdb()
+        return backend
+
+    def _get_target(self):
+        # Same REDIS database, different layout
+        return RedisBackEnd()
+
+    def test_dump_is_json_lines(self):
+        records = [json.loads(line) for line in self._dump().splitlines()]
+        # SSCAN does not return the whitelist in order
+        [r['type'] for r in records][:5] | should.eql(
+            ['hanoi', 'functionality', 'users', 'functionality', 'rule'])
+
+    def test_load(self):
+        target = self._get_target()
+        text = self._dump()
+        self.backend._redis.flushdb()
+        self._load(target, text) | should.eql(2)
+        target.is_enabled('foo', '24') | should.be_true()
+        target.is_enabled('foo', '4401') | should.be_true()
+        target.is_enabled('foo', '4400') | should.be_false()
+        target.get_functionality('bar').weights | should.eql([90, 10])
+        target.enable('bar')
+        target.set_percentage('bar', 0)
+        target.is_enabled('bar', Foo('u1')) | should.be_true()
+        target.is_enabled('bar', Foo('u3')) | should.be_false()
+
+
+class BackupRedisBackEndTestCase(BackupRedisTestCase):
+
+    def _get_backend(self):
+        backend = RedisBackEnd()
+        backend._redis.flushdb()
+        return backend
+
+    def _get_target(self):
+        return RedisHighPerfBackEnd()
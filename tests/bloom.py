@@ -0,0 +1,48 @@
+# -*- encoding: utf-8 -*-
+
+import unittest
+from pyshould import should
+
+from hanoi.bloom import BloomFilter
+
+
+class BloomFilterTestCase(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000)
+        items = [str(i) for i in range(1000)]
+        bloom.update(items)
+        len(bloom) | should.eql(1000)
+        all(item in bloom for item in items) | should.be_true()
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, 0.01)
+        bloom.update(str(i) for i in range(1000))
+        bloom.false_positive_rate | should.be_less_than(0.011)
+        false_positives = sum(1 for i in range(1000, 21000) if str(i) in bloom)
+        (false_positives / 20000.0) | should.be_less_than(0.02)
+
+    def test_rate_grows_beyond_the_capacity(self):
+        bloom = BloomFilter(100, 0.01)
+        bloom.false_positive_rate | should.eql(0)
+        bloom.update(str(i) for i in range(1000))
+        bloom.false_positive_rate | should.be_greater_than(0.5)
+
+    def test_size(self):
+        # ~9.6 bits per item for 1%
+        BloomFilter(10000, 0.01).size | should.eql(11982)
+        BloomFilter(10000, 0.001).size | should.be_greater_than(BloomFilter(10000, 0.01).size)
+
+    def test_identifiers_are_compared_as_text(self):
+        bloom = BloomFilter(10)
+        bloom.add(u'ñandú')
+        bloom.add(1)
+        u'ñandú'.encode('utf-8') | should.be_in(bloom)
+        '1' | should.be_in(bloom)
+        b'1' | should.be_in(bloom)
+
+    def test_invalid_error_rate(self):
+        with should.throw(ValueError):
+            BloomFilter(10, 0)
+        with should.throw(ValueError):
+            BloomFilter(10, 1)
@@ -0,0 +1,194 @@
+# -*- encoding: utf-8 -*-
+
+import threading
+import time
+import unittest
+from pyshould import should
+
+from hanoi.api import Rollout
+from hanoi.backend import MemoryBackEnd, RedisHighPerfBackEnd, Feature
+from hanoi.cache import CachingBackEnd, ChangeSubscriber
+
+
+class CountingBackEnd(MemoryBackEnd):
+    """MemoryBackEnd counting (and optionally delaying) the functionality fetches"""
+
+    def __init__(self, delay=0):
+        super(CountingBackEnd, self).__init__()
+        self.fetches = 0
+        self.delay = delay
+
+    def _load(self, name):
+        self.fetches += 1
+        time.sleep(self.delay)
+        return super(CountingBackEnd, self)._load(name)
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class CachingBackEndTestCase(unittest.TestCase):
+
+    FN = 'foo'
+
+    def setUp(self):
+        self.origin = CountingBackEnd()
+        self.backend = CachingBackEnd(self.origin, max_size=2, ttl=60)
+        self.rollout = Rollout(self.backend)
+        self.rollout.add_func(self.FN, percentage=0)
+
+    def test_definition_is_fetched_once(self):
+        self.rollout.register(self.FN, 'bar')
+        for _ in range(10):
+            self.rollout.is_enabled(self.FN, 'bar') | should.be_truthy
+        self.origin.fetches | should.eql(1)
+        self.backend.hits | should.eql(9)
+        self.backend.misses | should.eql(1)
+
+    def test_undefined_functionality_is_cached(self):
+        self.rollout.is_enabled('bar', 'bar') | should.be_falsy
+        self.rollout.is_enabled('bar', 'bar') | should.be_falsy
+        self.origin.fetches | should.eql(1)
+
+    def test_mutation_invalidates_the_functionality(self):
+        self.rollout.is_enabled(self.FN) | should.be_truthy
+        self.rollout.disable(self.FN)
+        self.rollout.is_enabled(self.FN) | should.be_falsy
+        self.origin.fetches | should.eql(2)
+
+    def test_add_functionality_invalidates_a_negative_result(self):
+        self.rollout.is_enabled('bar') | should.be_falsy
+        self.rollout.add_func('bar')
+        self.rollout.is_enabled('bar') | should.be_truthy
+
+    def test_least_recently_used_is_evicted(self):
+        for name in ('a', 'b', 'c'):
+            self.rollout.is_enabled(name)
+        self.backend.stats['size'] | should.eql(2)
+        self.rollout.is_enabled('a')
+        self.origin.fetches | should.eql(4)
+
+    def test_expired_entry_is_fetched_again(self):
+        self.backend.ttl = 0
+        self.backend.stale_ttl = 0
+        self.rollout.is_enabled(self.FN)
+        self.rollout.is_enabled(self.FN)
+        self.origin.fetches | should.eql(2)
+
+    def test_stale_entry_is_served_while_refreshed(self):
+        self.backend.ttl = 0
+        self.rollout.is_enabled(self.FN) | should.be_truthy
+        self.origin.delay = 0.2
+        # Stale value served without waiting, the refresh runs in background
+        started = time.time()
+        self.rollout.is_enabled(self.FN) | should.be_truthy
+        (time.time() - started) | should.be_less_than(0.1)
+        self.backend.hits | should.eql(1)
+        wait_for(lambda: self.origin.fetches == 2 and not self.backend._flights) | should.be_true()
+
+    def test_stale_definition_is_evaluated(self):
+        self.backend.ttl = 0
+        self.rollout.is_enabled(self.FN) | should.be_true()
+        self.origin.remove_functionality(self.FN)
+        # Stale value, the refresh runs in background
+        self.rollout.is_enabled(self.FN) | should.be_true()
+        wait_for(lambda: self.origin.fetches == 2 and not self.backend._flights) | should.be_true()
+        self.backend.stale_ttl = 0
+        self.rollout.is_enabled(self.FN) | should.be_false()
+
+    def test_concurrent_misses_issue_a_single_fetch(self):
+        self.origin.delay = 0.1
+        threads = [
+            threading.Thread(target=self.rollout.is_enabled, args=(self.FN, 'bar'))
+            for _ in range(10)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.origin.fetches | should.eql(1)
+
+    def test_variant(self):
+        self.rollout.add_func('bar', percentage=100, variants=['a', 'b'])
+        self.rollout.variant('bar', 'user') | should.be_in(['a', 'b'])
+
+
+class CachingRedisHighPerfBackEndTestCase(unittest.TestCase):
+
+    FN = 'foo'
+
+    def setUp(self):
+        origin = RedisHighPerfBackEnd()
+        origin._redis.flushdb()
+        self.backend = CachingBackEnd(origin)
+        self.rollout = Rollout(self.backend)
+        self.rollout.add_func(self.FN, percentage=0)
+
+    def test_is_enabled_to_a_register_user(self):
+        self.rollout.register(self.FN, 'bar')
+        self.rollout.is_enabled(self.FN, 'bar') | should.be_truthy
+        self.rollout.is_enabled(self.FN, 'bazz') | should.be_falsy
+
+    def test_is_enabled_many(self):
+        self.rollout.register(self.FN, 'bar')
+        self.rollout.is_enabled_many(self.FN, ['bar', 'bazz']) | should.eql([True, False])
+
+    def test_disable(self):
+        self.rollout.is_enabled(self.FN) | should.be_truthy
+        self.rollout.disable(self.FN)
+        self.rollout.is_enabled(self.FN) | should.be_falsy
+
+    def test_register_many_invalidates_the_functionality(self):
+        self.rollout.is_enabled(self.FN, 'bar') | should.be_falsy
+        self.rollout.register_many(self.FN, ['bar', 'bazz'])
+        self.rollout.is_enabled(self.FN, 'bazz') | should.be_truthy
+
+    def test_add_functionality_with_users(self):
+        self.backend.add_functionality(Feature('bar', None, 0), ['bazz'])
+        self.rollout.is_enabled('bar', 'bazz') | should.be_truthy
+
+    def test_change_in_another_process_invalidates_the_cache(self):
+        subscriber = self.backend.subscribe()
+        try:
+            self.backend.ttl = 3600
+            self.rollout.is_enabled(self.FN) | should.be_truthy
+
+            # Kill switch executed from another process
+            Rollout(RedisHighPerfBackEnd()).disable(self.FN)
+            wait_for(lambda: not self.rollout.is_enabled(self.FN)) | should.be_true()
+        finally:
+            subscriber.stop()
+
+
+class ChangeSubscriberTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = RedisHighPerfBackEnd()
+        self.backend._redis.flushdb()
+        self.cache = CachingBackEnd(MemoryBackEnd())
+        self.subscriber = ChangeSubscriber(self.backend._redis, retry_interval=0.1)
+        self.subscriber.attach(self.cache)
+
+    def tearDown(self):
+        self.subscriber.stop()
+
+    def test_invalidates_the_changed_functionality(self):
+        self.cache.add_functionality(Feature('foo'))
+        self.cache.add_functionality(Feature('bar'))
+        self.subscriber.start(wait=2)
+        self.cache.is_enabled('foo')
+        self.cache.is_enabled('bar')
+        self.backend.add_functionality(Feature('foo'))
+        wait_for(lambda: 'foo' not in self.cache._entries) | should.be_true()
+        self.cache._entries | should.have_key('bar')
+
+    def test_invalidates_every_functionality_upon_subscribing(self):
+        self.cache.add_functionality(Feature('foo'))
+        self.cache.is_enabled('foo')
+        self.subscriber.start(wait=2)
+        self.subscriber.subscribed | should.be_true()
+        self.cache._entries | should.be_empty()
@@ -0,0 +1,72 @@
+# -*- encoding: utf-8 -*-
+
+import struct
+import unittest
+from pyshould import should
+
+from hanoi.encoding import Record, encode, is_encoded, _MISSING
+
+
+class EncodingTestCase(unittest.TestCase):
+
+    def test_round_trip(self):
+        record = Record(encode(True, 50, 'id', ['foo', 'bar'], [90, 10], ['1', '2']))
+        record.enabled | should.be_true()
+        record.percentage | should.eql(50)
+        record.field | should.eql('id')
+        record.variants | should.eql(['foo', 'bar'])
+        record.weights | should.eql([90, 10])
+        record.users | should.eql(['1', '2'])
+
+    def test_defaults(self):
+        record = Record(encode(False, 0))
+        record.enabled | should.be_false()
+        record.field | should.be_none()
+        record.variants | should.be_none()
+        record.weights | should.be_none()
+        record.users | should.eql([])
+
+    def test_empty_values_are_kept(self):
+        record = Record(encode(True, 100, '', [], None, []))
+        record.field | should.eql('')
+        record.variants | should.eql([])
+        record.weights | should.be_none()
+
+    def test_arbitrary_identifiers(self):
+        users = [u'a,b', u'c|d', u'üéê', u'']
+        record = Record(encode(True, 100, None, [u'x|y', u'z,w'], None, users))
+        record.variants | should.eql([u'x|y', u'z,w'])
+        record.users | should.eql(users)
+
+    def test_numeric_identifiers(self):
+        Record(encode(True, 100, users=[1, 2])).users | should.eql(['1', '2'])
+
+    def test_fields_are_decoded_lazily(self):
+        record = Record(encode(True, 100, 'id', ['foo'], None, ['1']))
+        record.field | should.eql('id')
+        (record._variants is _MISSING) | should.be_true()
+        (record._users is _MISSING) | should.be_true()
+        record.variants | should.eql(['foo'])
+        record.users | should.eql(['1'])
+
+    def test_smaller_than_the_legacy_format(self):
+        value = encode(True, 100, None, ['foo', 'bar'])
+        len(value) | should.be_less_than(20)
+
+    def test_is_encoded(self):
+        is_encoded(encode(True, 100)) | should.be_true()
+        is_encoded(encode(False, 100)) | should.be_true()
+        is_encoded(b'1|100||') | should.be_false()
+        is_encoded(b'0|100||') | should.be_false()
+        is_encoded(u'1|100||') | should.be_false()
+        is_encoded(b'') | should.be_false()
+        is_encoded(None) | should.be_false()
+
+    def test_unsupported_version(self):
+        value = struct.pack('!BBBHI', 2, 1, 100, 0, 0)
+        with should.throw(ValueError):
+            Record(value)
+
+    def test_values_are_limited_to_64k(self):
+        with should.throw(ValueError):
+            encode(True, 100, users=['x' * 0x10000])
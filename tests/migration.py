@@ -0,0 +1,167 @@
+# -*- encoding: utf-8 -*-
+
+import re
+import unittest
+from pyshould import should
+
+from hanoi.api import Rollout
+from hanoi.backend import MemoryBackEnd, RedisBackEnd, RedisHighPerfBackEnd, Feature
+from hanoi.migration import DualWriteBackEnd, Mismatch, copy, verify
+
+ITEMS = [str(i) for i in range(1000, 1200)]
+
+
+class Foo(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class MigrationTestCase(unittest.TestCase):
+
+    def _get_source(self):
+        return MemoryBackEnd()
+
+    def _get_target(self):
+        return MemoryBackEnd()
+
+    def setUp(self):
+        self.source = self._get_source()
+        self.source.add_functionality(Feature('foo', percentage=0))
+        self.source.add_many('foo', [str(i) for i in range(25)])
+        self.source.set_rule('foo', re.compile(r'01$'))
+        self.source.add_functionality(Feature('bar', percentage=30, variants=[('a', 90), ('b', 10)]))
+        baz = Feature('baz')
+        baz.enabled = False
+        self.source.add_functionality(baz)
+        self.target = self._get_target()
+
+    def test_copy(self):
+        copy(self.source, self.target, chunk_size=10) | should.eql(3)
+        for name in ('foo', 'bar', 'baz'):
+            self.target.get_functionality(name) | should.not_be_none()
+        self.target.is_enabled('foo', '24') | should.be_true()
+        self.target.is_enabled('foo', '4401') | should.be_true()
+        self.target.is_enabled('foo', '4400') | should.be_false()
+        self.target.get_functionality('bar').weights | should.eql([90, 10])
+        self.target.is_enabled('baz') | should.be_false()
+
+    def test_copy_reports_progress_per_chunk(self):
+        progress = []
+        copy(self.source, self.target, chunk_size=10, progress=lambda *a: progress.append(a))
+        progress | should.eql([('foo', 10), ('foo', 20), ('foo', 25)])
+
+    def test_copy_replaces_the_functionalities(self):
+        self.target.add_functionality(Feature('foo', percentage=0))
+        self.target.add('foo', 'bazz')
+        self.target.add_functionality(Feature('other'))
+        copy(self.source, self.target, names=['foo']) | should.eql(1)
+        self.target.is_enabled('foo', 'bazz') | should.be_false()
+        self.target.is_enabled('foo', '1') | should.be_true()
+        self.target.is_enabled('other') | should.be_true()
+        self.target.get_functionality('bar') | should.be_none()
+
+    def test_verify_after_copy(self):
+        copy(self.source, self.target)
+        verify(self.source, self.target, ITEMS) | should.be_empty()
+
+    def test_verify_missing_functionality(self):
+        mismatches = verify(self.source, self.target, ['1'], names=['baz'])
+        mismatches | should.eql([
+            Mismatch('baz', None, (False, None), None),
+            Mismatch('baz', '1', (False, None), None)
+        ])
+
+    def test_verify_samples_the_whitelist(self):
+        copy(self.source, self.target)
+        self.target.remove('foo', '3')
+        verify(self.source, self.target, names=['foo']) | should.eql(
+            [Mismatch('foo', '3', (True, None), (False, None))])
+        verify(self.source, self.target, names=['foo'], sample_size=0) | should.eql([])
+
+    def test_verify_global_decision(self):
+        copy(self.source, self.target)
+        self.target.disable('foo')
+        verify(self.source, self.target, names=['foo'], sample_size=0) | should.eql(
+            [Mismatch('foo', None, (True, None), (False, None))])
+
+    def test_verify_different_decisions(self):
+        copy(self.source, self.target)
+        self.target.set_percentage('bar', 60)
+        mismatches = verify(self.source, self.target, ITEMS, names=['bar'])
+        mismatches | should.not_be_empty()
+        for mismatch in mismatches:
+            mismatch.expected[0] | should.be_false()
+            mismatch.found[0] | should.be_true()
+
+    def test_copy_and_verify_a_functionality_with_field(self):
+        self.source.add_functionality(Feature('qux', 'id', 0))
+        self.source._add_ids('qux', ['u1', 'u2'])
+        copy(self.source, self.target, names=['qux']) | should.eql(1)
+        sorted(sum(self.target.iter_whitelist('qux'), [])) | should.eql(['u1', 'u2'])
+        verify(self.source, self.target, ['u3'], names=['qux']) | should.be_empty()
+        self.target._add_ids('qux', ['u3'])
+        verify(self.source, self.target, ['u3'], names=['qux']) | should.eql(
+            [Mismatch('qux', 'u3', (False, None), (True, None))])
+
+    def test_copy_whitelisted_objects(self):
+        self.source.add_functionality(Feature('qux', 'id', 0))
+        self.source.add_many('qux', [Foo('u1'), Foo('u2')])
+        copy(self.source, self.target, names=['qux']) | should.eql(1)
+        sorted(sum(self.target.iter_whitelist('qux'), [])) | should.eql(['u1', 'u2'])
+
+    def test_dual_write(self):
+        rollout = Rollout(DualWriteBackEnd(self.source, self.target))
+        rollout.add_func('qux', percentage=0)
+        rollout.register('qux', '1')
+        rollout.register_many('qux', iter(['2', '3']))
+        rollout.backend.set_rule('qux', re.compile(r'^44'))
+        rollout.set_percentage('qux', 10)
+        for backend in (self.source, self.target):
+            backend.is_enabled('qux', '2') | should.be_true()
+            backend.is_enabled('qux', '4401') | should.be_true()
+            backend.get_functionality('qux').percentage | should.eql(10)
+        rollout.unregister('qux', '2')
+        rollout.disable('qux')
+        for backend in (self.source, self.target):
+            backend.is_enabled('qux', '1') | should.be_false()
+            backend.is_enabled('qux', '2') | should.be_false()
+        rollout.remove_func('qux')
+        self.target.get_functionality('qux') | should.be_none()
+
+    def test_dual_write_before_copy(self):
+        rollout = Rollout(DualWriteBackEnd(self.source, self.target))
+        rollout.register('foo', '100')
+        rollout.register_many('foo', ['101'])
+        rollout.backend.set_rule('foo', re.compile(r'^44'))
+        rollout.set_percentage('foo', 10)
+        rollout.unregister('foo', '1')
+        rollout.disable('foo')
+        rollout.enable('foo')
+        rollout.toggle('foo')
+        self.target.get_functionality('foo') | should.be_none()
+        self.source.get_functionality('foo').percentage | should.eql(10)
+        copy(self.source, self.target)
+        verify(self.source, self.target, ITEMS) | should.be_empty()
+
+    def test_dual_write_reads_from_primary(self):
+        self.target.add_functionality(Feature('only_target'))
+        rollout = Rollout(DualWriteBackEnd(self.source, self.target))
+        rollout.is_enabled('only_target') | should.be_false()
+        rollout.is_enabled('foo', '3') | should.be_true()
+        rollout.decide('bar', '1') | should.eql(Rollout(self.source).decide('bar', '1'))
+
+
+class MigrationToRedisHighPerfTestCase(MigrationTestCase):
+
+    def _get_target(self):
+        backend = RedisHighPerfBackEnd()
+        backend._redis.flushdb()
+        return backend
+
+
+class MigrationFromRedisTestCase(MigrationTestCase):
+
+    def _get_source(self):
+        backend = RedisBackEnd()
+        backend._redis.flushdb()
+        return backend
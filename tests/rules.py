@@ -0,0 +1,127 @@
+# -*- encoding: utf-8 -*-
+
+import re
+import unittest
+from pyshould import should
+
+from hanoi.rules import RuleSet, classify
+
+
+class ClassifyTestCase(unittest.TestCase):
+
+    def test_exact(self):
+        classify(re.compile(r'^4400$')) | should.eql(('exact', '4400'))
+
+    def test_prefix(self):
+        classify(re.compile(r'^4400')) | should.eql(('prefix', '4400'))
+
+    def test_suffix(self):
+        classify(re.compile(r'01$')) | should.eql(('suffix', '01'))
+
+    def test_escaped_punctuation_is_literal(self):
+        classify(re.compile(r'^\+44\.')) | should.eql(('prefix', '+44.'))
+
+    def test_not_anchored(self):
+        classify(re.compile(r'01')) | should.eql((None, None))
+
+    def test_special_characters(self):
+        classify(re.compile(r'^44\d+')) | should.eql((None, None))
+        classify(re.compile(r'0[12]$')) | should.eql((None, None))
+        classify(re.compile(r'^(44|34)')) | should.eql((None, None))
+
+    def test_escaped_dollar_is_not_an_anchor(self):
+        classify(re.compile(r'^44\$')) | should.eql(('prefix', '44$'))
+
+    def test_flags(self):
+        classify(re.compile(r'^foo', re.IGNORECASE)) | should.eql((None, None))
+
+
+class RuleSetTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.rules = RuleSet(cache_size=2)
+
+    def test_empty(self):
+        self.rules | should.be_empty()
+        self.rules.match('4400') | should.be_false()
+
+    def test_exact(self):
+        self.rules.add(re.compile(r'^4400$'))
+        self.rules.match('4400') | should.be_true()
+        self.rules.match('44001') | should.be_false()
+        self.rules.match('14400') | should.be_false()
+
+    def test_prefix(self):
+        self.rules.add(re.compile(r'^44'))
+        self.rules.add(re.compile(r'^3460'))
+        self.rules.match('4400') | should.be_true()
+        self.rules.match('346012') | should.be_true()
+        self.rules.match('346112') | should.be_false()
+        self.rules.match('0044') | should.be_false()
+
+    def test_suffix(self):
+        self.rules.add(re.compile(r'01$'))
+        self.rules.add(re.compile(r'999$'))
+        self.rules.match('44001') | should.be_true()
+        self.rules.match('44999') | should.be_true()
+        self.rules.match('44010') | should.be_false()
+
+    def test_dollar_matches_before_a_trailing_newline(self):
+        self.rules.add(re.compile(r'01$'))
+        self.rules.add(re.compile(r'^4400$'))
+        self.rules.match('44001\n') | should.be_true()
+        self.rules.match('4400\n') | should.be_true()
+
+    def test_other_patterns_are_combined(self):
+        self.rules.add(re.compile(r'^44\d{2}$'))
+        self.rules.add(re.compile(r'0[12]$'))
+        self.rules.add(re.compile(r'foo', re.IGNORECASE))
+        self.rules.match('4412') | should.be_true()
+        self.rules.match('34502') | should.be_true()
+        self.rules.match('a FOO b') | should.be_true()
+        self.rules.match('44123') | should.be_false()
+
+    def test_backreferences(self):
+        self.rules.add(re.compile(r'(a)\1'))
+        self.rules.add(re.compile(r'(b)\1'))
+        self.rules.match('bb') | should.be_true()
+        self.rules.match('ab') | should.be_false()
+
+    def test_same_pattern_is_stored_once(self):
+        self.rules.add(re.compile(r'01$'))
+        self.rules.add(re.compile(r'01$'))
+        self.rules.patterns | should.eql(['01$'])
+
+    def test_remove(self):
+        self.rules.add(re.compile(r'01$'))
+        self.rules.add(re.compile(r'^44'))
+        self.rules.match('44001') | should.be_true()
+        self.rules.remove(re.compile(r'^44')) | should.be_true()
+        self.rules.match('44000') | should.be_false()
+        self.rules.match('44001') | should.be_true()
+        self.rules.remove(re.compile(r'^44')) | should.be_false()
+
+    def test_results_are_memoized(self):
+        self.rules.add(re.compile(r'01$'))
+        self.rules.match('44001') | should.be_true()
+        self.rules.match('44000') | should.be_false()
+        self.rules._memo | should.eql({'44001': True, '44000': False})
+
+    def test_memo_is_bounded(self):
+        self.rules.add(re.compile(r'01$'))
+        for item in ('1', '2', '3', '2'):
+            self.rules.match(item)
+        list(self.rules._memo) | should.eql(['3', '2'])
+
+    def test_memo_is_cleared_upon_changes(self):
+        self.rules.match('44001') | should.be_false()
+        self.rules.add(re.compile(r'01$'))
+        self.rules.match('44001') | should.be_true()
+
+    def test_many_rules(self):
+        for i in range(1000):
+            self.rules.add(re.compile(r'^34%03d' % i))
+            self.rules.add(re.compile(r'%03d1$' % i))
+        self.rules.match('34999123') | should.be_true()
+        self.rules.match('44123' + '9991') | should.be_true()
+        self.rules.match('3' + '9990') | should.be_false()
@@ -0,0 +1,139 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from pyshould import should
+
+from hanoi.api import Rollout
+from hanoi.backend import MemoryBackEnd, RedisHighPerfBackEnd, Feature
+from hanoi.snapshot import SnapshotBackEnd, Whitelist, write_snapshot
+
+ITEMS = [str(i) for i in range(1000, 1300)]
+
+
+class User(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class SnapshotBackEndTestCase(unittest.TestCase):
+
+    def _get_source(self):
+        return MemoryBackEnd()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'hanoi.snapshot')
+        self.source = self._get_source()
+        self.source.add_functionality(Feature('foo', percentage=0))
+        self.source.add_many('foo', [str(i) for i in range(100)] + [u'ñandú'])
+        self.source.set_rule('foo', re.compile(r'01$'))
+        self.source.add_functionality(Feature('bar', percentage=30, variants=[('a', 90), ('b', 10)]))
+        baz = Feature('baz', 'id')
+        baz.enabled = False
+        self.source.add_functionality(baz)
+        write_snapshot(self.source, self.path, chunk_size=10) | should.eql(3)
+        self.backend = SnapshotBackEnd(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_functionalities(self):
+        sorted(self.backend.get_functionalities()) | should.eql(['bar', 'baz', 'foo'])
+        bar = self.backend.get_functionality('bar')
+        bar.percentage | should.eql(30)
+        bar.variants | should.eql(['a', 'b'])
+        bar.weights | should.eql([90, 10])
+        baz = self.backend.get_functionality('baz')
+        baz.enabled | should.be_false()
+        baz.field | should.eql('id')
+        self.backend.get_functionality('qux') | should.be_none()
+
+    def test_whitelist(self):
+        self.backend.is_enabled('foo', '0') | should.be_true()
+        self.backend.is_enabled('foo', '99') | should.be_true()
+        self.backend.is_enabled('foo', u'ñandú') | should.be_true()
+        self.backend.is_enabled('foo', '100') | should.be_false()
+        self.backend.is_enabled('foo', '') | should.be_false()
+        whitelisted = sum(self.backend.iter_whitelist('foo', 30), [])
+        whitelisted | should.have_len(101)
+        whitelisted | should.eql(sorted(whitelisted, key=lambda u: u.encode('utf-8')))
+
+    def test_whitelisted_objects(self):
+        self.source.add_functionality(Feature('qux', 'id', 0))
+        self.source.add_many('qux', [User('u1'), User('u2')])
+        write_snapshot(self.source, self.path)
+        backend = SnapshotBackEnd(self.path)
+        backend.is_enabled('qux', User('u1')) | should.be_true()
+        backend.is_enabled('qux', User('u3')) | should.be_false()
+        sorted(sum(backend.iter_whitelist('qux'), [])) | should.eql(['u1', 'u2'])
+
+    def test_rules(self):
+        [r.pattern for r in self.backend.get_rules('foo')] | should.eql(['01$'])
+        self.backend.get_rules('qux') | should.be_empty()
+        self.backend.is_enabled('foo', '4401') | should.be_true()
+
+    def test_same_decisions_than_the_source(self):
+        for name in ('foo', 'bar', 'baz', 'qux'):
+            self.backend.is_enabled(name) | should.eql(self.source.is_enabled(name))
+            self.backend.is_enabled_many(name, ITEMS) | should.eql(
+                self.source.is_enabled_many(name, ITEMS))
+            [self.backend.variant(name, i) for i in ITEMS] | should.eql(
+                [self.source.variant(name, i) for i in ITEMS])
+        self.backend.evaluate_all('1001') | should.eql(self.source.evaluate_all('1001'))
+        user = User('1001')
+        self.backend.evaluate_all(user) | should.eql(self.source.evaluate_all(user))
+
+    def test_rollout(self):
+        rollout = Rollout(self.backend)
+        rollout.decide('foo', '3').enabled | should.be_true()
+        rollout.is_enabled('bar', '1') | should.eql(Rollout(self.source).is_enabled('bar', '1'))
+
+    def test_read_only(self):
+        with should.throw(NotImplementedError):
+            self.backend.add('foo', '1000')
+        with should.throw(NotImplementedError):
+            Rollout(self.backend).add_func('qux')
+
+    def test_empty_whitelist(self):
+        whitelist = Whitelist(b'\x00\x00\x00\x00', 0, 0, str)
+        '1' | should.not_be_in(whitelist)
+        list(whitelist) | should.be_empty()
+
+    def test_not_a_snapshot(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'x' * 64)
+        with should.throw(ValueError):
+            SnapshotBackEnd(self.path)
+
+    def test_new_snapshot_is_picked_up(self):
+        self.source.add('foo', '1000')
+        self.source.disable('bar')
+        write_snapshot(self.source, self.path)
+        self.backend.is_enabled('foo', '1000') | should.be_false()
+        self.backend.check_interval = 0
+        self.backend.is_enabled('foo', '1000') | should.be_true()
+        self.backend.is_enabled('bar', '1') | should.be_false()
+
+    def test_reload(self):
+        self.source.remove_functionality('foo')
+        write_snapshot(self.source, self.path)
+        definition = self.backend._load('foo')
+        self.backend.reload()
+        self.backend.get_functionality('foo') | should.be_none()
+        # A check in progress finishes with the previous snapshot
+        self.backend._evaluate(definition, '3') | should.be_true()
+
+    def test_temporary_files_are_removed(self):
+        os.listdir(self.directory) | should.eql(['hanoi.snapshot'])
+
+
+class SnapshotFromRedisHighPerfTestCase(SnapshotBackEndTestCase):
+
+    def _get_source(self):
+        backend = RedisHighPerfBackEnd()
+        backend._redis.flushdb()
+        return backend